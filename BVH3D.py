@@ -0,0 +1,189 @@
+#Bounding volume hierarchy over triangles for fast ray queries.  The tree is
+#stored flat in numpy arrays and all of the rays in a query are walked down
+#it together one level at a time, so a query is a few dozen vectorized
+#steps no matter how many rays or triangles there are
+import numpy as np
+
+BVH_LEAF_SIZE = 8 #Maximum number of triangles in a leaf
+
+#Vectorized Moller-Trumbore ray/triangle intersection
+#P0, V: Kx3 ray origins and directions (t is in units of V)
+#A, E1, E2: Kx3 first triangle vertices and the two edges leaving them
+#Returns (t, u, v), where the hit point is P0 + t*V = A + u*E1 + v*E2,
+#with t = inf where the ray misses the triangle or is parallel to it
+def intersectRaysTriangles(P0, V, A, E1, E2):
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		pvec = np.cross(V, E2)
+		det = np.sum(E1*pvec, 1)
+		invDet = 1.0/det
+		tvec = P0 - A
+		u = np.sum(tvec*pvec, 1)*invDet
+		qvec = np.cross(tvec, E1)
+		v = np.sum(V*qvec, 1)*invDet
+		t = np.sum(E2*qvec, 1)*invDet
+		hit = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1)
+	t[~hit] = np.inf
+	return (t, u, v)
+
+#Return (elems, owner, segStarts) for a set of disjoint index ranges, where
+#elems lists all of the indices in the ranges, owner is the range each one is
+#in, and segStarts is where each range begins in elems
+def getRangeElements(starts, counts):
+	segStarts = np.cumsum(counts) - counts
+	elems = np.repeat(starts - segStarts, counts) + np.arange(np.sum(counts))
+	owner = np.repeat(np.arange(len(counts)), counts)
+	return (elems, owner, segStarts)
+
+class TriangleBVH(object):
+	#X: Nx3 vertex positions
+	#tris: Mx3 vertex indices of the triangles (e.g. from getFanTriangles())
+	#labels: Optional length M array of integer labels that queries can
+	#ignore triangles by (e.g. the face each triangle belongs to).  By
+	#default every triangle is labeled with its own index
+	def __init__(self, X, tris, leafSize = BVH_LEAF_SIZE, labels = None):
+		X = np.asarray(X, dtype = np.float64).reshape((-1, 3))
+		tris = np.asarray(tris, dtype = np.int64).reshape((-1, 3))
+		self.numTris = tris.shape[0]
+		(A, B, C) = (X[tris[:, 0]], X[tris[:, 1]], X[tris[:, 2]])
+		triMin = np.minimum(np.minimum(A, B), C)
+		triMax = np.maximum(np.maximum(A, B), C)
+		centroids = (A + B + C)/3.0
+		#Split the nodes at the median centroid along their longest axis, one
+		#level of the tree at a time.  The two children of a node are always
+		#stored next to each other
+		order = np.arange(self.numTris)
+		self.starts = np.zeros(1, dtype = np.int64)
+		self.counts = np.array([self.numTris], dtype = np.int64)
+		self.children = -np.ones(1, dtype = np.int64)
+		levels = []
+		level = np.zeros(1, dtype = np.int64)
+		while level.size > 0:
+			levels.append(level)
+			level = level[self.counts[level] > leafSize]
+			if level.size == 0:
+				break
+			(starts, counts) = (self.starts[level], self.counts[level])
+			(elems, owner, segStarts) = getRangeElements(starts, counts)
+			P = centroids[order[elems]]
+			minP = np.minimum.reduceat(P, segStarts)
+			extent = np.maximum.reduceat(P, segStarts) - minP
+			axis = np.argmax(extent, 1)
+			extent = extent[np.arange(level.size), axis]
+			minP = minP[np.arange(level.size), axis]
+			#Sort the triangles of each node along its axis, with a key that
+			#puts the centroid in [0, 1] within the node's range
+			key = (P[np.arange(P.shape[0]), axis[owner]] - minP[owner])/np.maximum(extent, 1e-300)[owner]
+			order[elems] = order[elems[np.argsort(2*owner + key)]]
+			#Nodes whose centroids all coincide stay leaves
+			split = extent > 0
+			(level, starts, counts) = (level[split], starts[split], counts[split])
+			mid = counts/2
+			N = self.starts.size
+			self.children[level] = N + 2*np.arange(level.size)
+			self.starts = np.concatenate((self.starts, np.array([starts, starts + mid]).T.flatten()))
+			self.counts = np.concatenate((self.counts, np.array([mid, counts - mid]).T.flatten()))
+			self.children = np.concatenate((self.children, -np.ones(2*level.size, dtype = np.int64)))
+			level = np.arange(N, self.starts.size)
+		self.boxMin = np.zeros((self.starts.size, 3))
+		self.boxMax = np.zeros((self.starts.size, 3))
+		if self.numTris > 0:
+			for level in levels:
+				(elems, owner, segStarts) = getRangeElements(self.starts[level], self.counts[level])
+				self.boxMin[level] = np.minimum.reduceat(triMin[order[elems]], segStarts)
+				self.boxMax[level] = np.maximum.reduceat(triMax[order[elems]], segStarts)
+		#Triangles in leaf order
+		self.order = order
+		if labels is None:
+			self.labels = order
+		else:
+			self.labels = np.asarray(labels, dtype = np.int64)[order]
+		self.A = A[order]
+		self.E1 = (B - A)[order]
+		self.E2 = (C - A)[order]
+
+	#P0, V: Rx3 ray origins and directions (t is in units of V)
+	#tMin, tMax: Only hits with tMin <= t < tMax count (scalars or
+	#length R arrays)
+	#anyHit: Stop following a ray as soon as it hits anything (for
+	#occlusion tests, where it doesn't matter which triangle is hit first)
+	#ignore: Optional RxK array of triangle labels that each ray goes
+	#straight through (padded with -1), e.g. the faces at the ends of a segment
+	#Returns (t, tri, u, v): length R arrays with the parameter of the
+	#closest hit, the index of the triangle hit, and the barycentric
+	#coordinates of the hit point with respect to the triangle's 2nd and 3rd
+	#vertices.  Rays that miss have t = inf and tri = -1
+	def intersectRays(self, P0, V, tMin = 0.0, tMax = np.inf, anyHit = False, ignore = None):
+		P0 = np.asarray(P0, dtype = np.float64).reshape((-1, 3))
+		V = np.asarray(V, dtype = np.float64).reshape((-1, 3))
+		R = P0.shape[0]
+		tMin = np.zeros(R) + tMin
+		tBest = np.zeros(R) + tMax
+		triBest = -np.ones(R, dtype = np.int64)
+		uBest = np.zeros(R)
+		vBest = np.zeros(R)
+		if ignore is not None:
+			ignore = np.asarray(ignore, dtype = np.int64)
+			if ignore.ndim == 1:
+				ignore = ignore[:, None]
+		#Avoid 0*inf in the slab tests for rays parallel to an axis
+		invV = 1.0/np.where(V == 0, 1e-300, V)
+		rays = np.arange(R)
+		if self.numTris == 0:
+			rays = rays[0:0]
+		nodes = np.zeros(rays.size, dtype = np.int64)
+		while rays.size > 0:
+			#Keep the (ray, node) pairs whose ray passes through the node's box
+			#before the closest hit found so far
+			t1 = (self.boxMin[nodes] - P0[rays])*invV[rays]
+			t2 = (self.boxMax[nodes] - P0[rays])*invV[rays]
+			tNear = np.minimum(t1, t2).max(1)
+			tFar = np.maximum(t1, t2).min(1)
+			keep = (tNear <= tFar) & (tFar >= tMin[rays]) & (tNear < tBest[rays])
+			(rays, nodes) = (rays[keep], nodes[keep])
+			leaf = self.children[nodes] == -1
+			#Test the rays against all of the triangles in the leaves they reached
+			(lRays, lNodes) = (rays[leaf], nodes[leaf])
+			if lRays.size > 0:
+				(pTris, owner, segStarts) = getRangeElements(self.starts[lNodes], self.counts[lNodes])
+				pRays = lRays[owner]
+				(t, u, v) = intersectRaysTriangles(P0[pRays], V[pRays], self.A[pTris], self.E1[pTris], self.E2[pTris])
+				hit = (t >= tMin[pRays]) & (t < tBest[pRays])
+				if ignore is not None:
+					hit = hit & ~np.any(ignore[pRays] == self.labels[pTris][:, None], 1)
+				(pRays, pTris, t, u, v) = (pRays[hit], pTris[hit], t[hit], u[hit], v[hit])
+				#Sort by ray and then by t, and keep the first (closest) hit
+				#of each ray
+				idx = np.lexsort((t, pRays))
+				first = np.ones(idx.size, dtype = np.bool_)
+				first[1:] = pRays[idx[1:]] != pRays[idx[0:-1]]
+				idx = idx[first]
+				pRays = pRays[idx]
+				tBest[pRays] = t[idx]
+				triBest[pRays] = pTris[idx]
+				uBest[pRays] = u[idx]
+				vBest[pRays] = v[idx]
+			#Move the rest of the pairs down to the children of their nodes
+			(rays, nodes) = (rays[~leaf], self.children[nodes[~leaf]])
+			rays = np.concatenate((rays, rays))
+			nodes = np.concatenate((nodes, nodes + 1))
+			if anyHit:
+				keep = triBest[rays] == -1
+				(rays, nodes) = (rays[keep], nodes[keep])
+		hit = triBest > -1
+		tBest[~hit] = np.inf
+		triBest[hit] = self.order[triBest[hit]]
+		return (tBest, triBest, uBest, vBest)
+
+	#Single ray version of intersectRays().  P0 and V are anything that
+	#converts to 3 element arrays (e.g. [P.x, P.y, P.z])
+	#Returns (t, tri, u, v) for the closest hit, or None if the ray misses
+	def intersectRay(self, P0, V, tMin = 0.0, tMax = np.inf):
+		(t, tri, u, v) = self.intersectRays(P0, V, tMin, tMax)
+		if tri[0] == -1:
+			return None
+		return (t[0], tri[0], u[0], v[0])
+
+	#Returns a boolean array saying which of the rays hit anything
+	#with tMin <= t < tMax (other than the triangles they ignore)
+	def occludedRays(self, P0, V, tMin = 0.0, tMax = np.inf, ignore = None):
+		return self.intersectRays(P0, V, tMin, tMax, True, ignore)[1] > -1
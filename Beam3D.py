@@ -4,7 +4,6 @@ from Shapes3D import *
 from Graphics3D import *
 from PolyMesh import *
 from Cameras3D import *
-from OpenGL.GL import *
 import numpy as np
 import math
 import pickle
@@ -248,6 +247,7 @@ class Beam3D(object):
 		return retFace
 			
 	def drawPolygon(self, poly, minX, maxX, minY, maxY, dim):
+		from OpenGL.GL import glBegin, glEnd, glPointSize, glVertex2f, GL_POINTS, GL_POLYGON
 		border = 10
 		scaleX = float(dim - border*2)/(maxX - minX)
 		scaleY = float(dim - border*2)/(maxY - minY)
@@ -262,6 +262,7 @@ class Beam3D(object):
 		glEnd()
 	
 	def drawProjectedMeshFaces(self, faces, dim, toggleDrawSplits):
+		from OpenGL.GL import glBegin, glColor3f, glDisable, glEnable, glEnd, glLineWidth, glLoadIdentity, glMatrixMode, glOrtho, glPolygonMode, glVertex2f, GL_DEPTH_TEST, GL_FILL, GL_FRONT_AND_BACK, GL_LIGHTING, GL_LINE, GL_MODELVIEW, GL_POLYGON, GL_PROJECTION
 		glLineWidth(2)
 		glDisable(GL_LIGHTING)
 		glMatrixMode(GL_PROJECTION)
@@ -313,6 +314,7 @@ class Beam3D(object):
 	
 	#Draw the beam in space as a transparent object
 	def drawBeam(self, color = None, beamTrans = 0.3):
+		from OpenGL.GL import glBegin, glBlendFunc, glColor3f, glColor4f, glDisable, glEnable, glEnd, glLineWidth, glVertex3f, GL_BLEND, GL_LIGHTING, GL_LINES, GL_ONE_MINUS_SRC_ALPHA, GL_POLYGON, GL_SRC_ALPHA, GL_TRIANGLES
 		colormap = [(0, 1, 0), (1, 1, 0), (0, 1, 1), (0, 0, 1)]
 		glDisable(GL_LIGHTING)
 		glEnable(GL_BLEND)
@@ -373,6 +375,7 @@ class Beam3D(object):
 	
 	#Draw outlines of shapes clipped to this beam in 3D
 	def drawBackProjected(self, faces):
+		from OpenGL.GL import glBegin, glColor3f, glDisable, glEnable, glEnd, glLineWidth, glVertex3f, GL_LIGHTING, GL_LINES
 		glDisable(GL_LIGHTING)
 		backProjectedFaces = []
 		self.findLargestUnobstructedFace(faces, backProjectedFaces)
@@ -1,8 +1,6 @@
-from OpenGL.GL import *
-from OpenGL.GLU import *
-from OpenGL.GLUT import *
 from Primitives3D import *
 from Shapes3D import *
+import numpy as np
 import math
 
 def getCameraMatrix(t, u, r, P):
@@ -21,6 +19,7 @@ def getCameraMatrix(t, u, r, P):
 #r - right vector
 #P - Camera center
 def gotoCameraFrame(t, u, r, P):
+	from OpenGL.GL import glLoadIdentity, glMatrixMode, glMultMatrixd, GL_MODELVIEW
 	rotMat = Matrix4([r.x, u.x, -t.x, 0, r.y, u.y, -t.y, 0, r.z, u.z, -t.z, 0, 0, 0, 0, 1])
 	rotMat = rotMat.Inverse()
 	transMat = Matrix4([1, 0, 0, -P.x, 0, 1, 0, -P.y, 0, 0, 1, -P.z, 0, 0, 0, 1])
@@ -32,6 +31,40 @@ def gotoCameraFrame(t, u, r, P):
 	glLoadIdentity()
 	glMultMatrixd(mat.m)
 
+#Return the unit (towards, up, right) vectors of a camera as arrays
+def getCameraAxes(camera):
+	t = np.array([camera.towards.x, camera.towards.y, camera.towards.z], dtype = np.float64)
+	u = np.array([camera.up.x, camera.up.y, camera.up.z], dtype = np.float64)
+	r = np.cross(t, u)
+	return (t/np.linalg.norm(t), u/np.linalg.norm(u), r/np.linalg.norm(r))
+
+#Return the Ray3D from the camera's eye through the center of the pixel
+#(x, y) of a pixWidth x pixHeight viewport, with y going up from the bottom
+#of the viewport (like glReadPixels).  This inverts the projection set up
+#by gluPerspective(180*camera.yfov/pi, pixWidth/pixHeight, ...) followed by
+#camera.gotoCameraFrame()
+def getRayThroughPixel(camera, x, y, pixWidth, pixHeight):
+	(t, u, r) = getCameraAxes(camera)
+	tanFOV = math.tan(camera.yfov/2.0)
+	scaleX = tanFOV*(2.0*(x + 0.5)/pixWidth - 1.0)*float(pixWidth)/pixHeight
+	scaleY = tanFOV*(2.0*(y + 0.5)/pixHeight - 1.0)
+	V = t + scaleX*r + scaleY*u
+	return Ray3D(camera.eye.Copy(), Vector3D(V[0], V[1], V[2]))
+
+#Project the points in the Nx3 array X into a pixWidth x pixHeight viewport
+#of the camera (the inverse of getRayThroughPixel())
+#Returns (Nx2 array of pixel coordinates, length N array of the distances
+#along the towards vector).  Points with distance <= 0 are behind the camera
+def projectToPixels(camera, X, pixWidth, pixHeight):
+	(t, u, r) = getCameraAxes(camera)
+	tanFOV = math.tan(camera.yfov/2.0)
+	D = np.asarray(X, dtype = np.float64).reshape((-1, 3)) - np.array([camera.eye.x, camera.eye.y, camera.eye.z])
+	depth = D.dot(t)
+	pixels = np.zeros((D.shape[0], 2))
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		pixels[:, 0] = (D.dot(r)/(depth*tanFOV*float(pixWidth)/pixHeight) + 1.0)*pixWidth/2.0 - 0.5
+		pixels[:, 1] = (D.dot(u)/(depth*tanFOV) + 1.0)*pixHeight/2.0 - 0.5
+	return (pixels, depth)
 
 class Key6DOFCamera(object):
 	def __init__(self, eye, towards = Vector3D(0, 0, 1), up = Vector3D(0, 1, 0), yfov = 0.75):
@@ -65,6 +98,7 @@ class Key6DOFCamera(object):
 		return False
 
 	def handleUserInput(self, value):
+		from OpenGL.GLUT import glutPostRedisplay, glutTimerFunc, GLUT_KEY_DOWN, GLUT_KEY_LEFT, GLUT_KEY_RIGHT, GLUT_KEY_UP
 		if self.keyPressed('w', 'W'):
 			self.eye = self.eye + self.LINEAR_RATE*self.towards
 		if self.keyPressed('s', 'S'):
@@ -140,6 +174,13 @@ class MousePolarCamera(object):
 
 	def gotoCameraFrame(self):
 		gotoCameraFrame(self.towards, self.up, self.towards%self.up, self.eye)
+
+	#Ray through the pixel (x, y) of the camera's viewport (y going up)
+	def getRayThroughPixel(self, x, y):
+		return getRayThroughPixel(self, x, y, self.pixWidth, self.pixHeight)
+	
+	def projectToPixels(self, X):
+		return projectToPixels(self, X, self.pixWidth, self.pixHeight)
 	
 	def orbitUpDown(self, dP):
 		dP = 1.5*dP/float(self.pixHeight)
@@ -206,6 +247,13 @@ class MouseSphericalCamera(object):
 
 	def gotoCameraFrame(self):
 		gotoCameraFrame(self.towards, self.up, self.towards%self.up, self.eye)
+
+	#Ray through the pixel (x, y) of the camera's viewport (y going up)
+	def getRayThroughPixel(self, x, y):
+		return getRayThroughPixel(self, x, y, self.pixWidth, self.pixHeight)
+	
+	def projectToPixels(self, X):
+		return projectToPixels(self, X, self.pixWidth, self.pixHeight)
 	
 	def orbitUpDown(self, dTheta):
 		dTheta = 1.5*dTheta / float(self.pixHeight)
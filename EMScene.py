@@ -3,10 +3,22 @@ from Graphics3D import *
 from Shapes3D import *
 from PolyMesh import *
 from Beam3D import *
-from OpenGL.GL import *
+from BVH3D import *
+import numpy as np
+from collections import OrderedDict
+import multiprocessing
+import hashlib
 import math
+import time
+import sys
+import os
 from lxml import etree as ET
 
+#Fraction of a segment at its far end that occlusion queries don't look at,
+#so that faces touching the end point (e.g. next to a reflection point on an
+#edge) don't count as blockers
+OCCLUSION_EPS = 1e-9
+
 
 #fP0 is the apex of the frustum
 #frustPoints are the points that define the frustum face 
@@ -27,6 +39,499 @@ def meshFaceInFrustum(fP0, frustPoints, facePoints, alwaysPass = False):
 		return True
 	return False
 
+#Return the parameter t where the Ray3D hits the face (using the same fan
+#triangles as the scene BVH, so that points on the face's edges count), or
+#None if it misses the face
+def intersectRayFace(ray, face):
+	X = np.array([[P.pos.x, P.pos.y, P.pos.z] for P in face.getVertices()]).reshape((-1, 3))
+	if X.shape[0] < 3:
+		return None
+	NTris = X.shape[0] - 2
+	P0 = np.tile([ray.P0.x, ray.P0.y, ray.P0.z], (NTris, 1))
+	V = np.tile([ray.V.x, ray.V.y, ray.V.z], (NTris, 1))
+	A = np.tile(X[0], (NTris, 1))
+	(t, u, v) = intersectRaysTriangles(P0, V, A, X[1:-1] - A, X[2:] - A)
+	t = t[(t >= 0) & np.isfinite(t)]
+	if t.size == 0:
+		return None
+	return float(t.min())
+
+#Number of (source, face) pairs that getMirrorImageArrays() works on at once
+IMAGE_CHUNK_SIZE = 200000
+#Faces have to be this far inside or outside of a frustum's bounding planes
+#for the plane tests to decide them without clipping
+FRUSTUM_PLANE_EPS = 1e-7
+#Distance of the near plane of the frustum from its apex (the near distance
+#of a Beam3D that isn't cast through a mesh face)
+FRUSTUM_NEAR_DIST = 0.01
+#Number of random points per face (on top of the center and the corners)
+#that face to face visibility is sampled with
+FACE_VISIBILITY_SAMPLES = 8
+#Fraction of the way that corner samples are pulled in towards the center
+FACE_SAMPLE_SHRINK = 0.01
+#Number of face pairs checked in one occlusion query
+FACE_VISIBILITY_CHUNK_SIZE = 200000
+#Face visibility matrices keyed by (scene fingerprint, number of samples);
+#least recently used entries are evicted first
+FACE_VISIBILITY_CACHE_SIZE = 8
+FACE_VISIBILITY_CACHE = OrderedDict()
+
+#Plane equations, vertices and bounding spheres of the faces that virtual
+#sources get mirrored across, precomputed once per tree
+#facePoints: List of the Point3D vertices of every face in the scene
+#Returns a dictionary with
+#'points': facePoints
+#'normals', 'offsets': Fx3 unit normals (zero for degenerate faces) and
+#length F offsets, so that the plane of face i is normals[i].X = offsets[i]
+#'verts': FxMx3 vertices, where faces with less than M vertices repeat
+#their last one
+#'centers', 'radii': Fx3 and length F bounding spheres
+#'visibility': The visibility argument, an optional FxF sparse matrix of
+#the faces that are potentially visible from each face (see
+#EMScene.getFaceVisibility())
+def getImageFaceArrays(facePoints, visibility = None):
+	NFaces = len(facePoints)
+	M = max([3] + [len(points) for points in facePoints])
+	normals = np.zeros((NFaces, 3))
+	offsets = np.zeros(NFaces)
+	verts = np.zeros((NFaces, M, 3))
+	for i in range(NFaces):
+		if len(facePoints[i]) == 0:
+			continue
+		X = np.array([[P.x, P.y, P.z] for P in facePoints[i]])
+		verts[i] = np.concatenate((X, np.tile(X[-1], (M - X.shape[0], 1))))
+		if len(facePoints[i]) < 3:
+			continue
+		normal = getFaceNormal(facePoints[i])
+		if normal:
+			normals[i] = [normal.x, normal.y, normal.z]
+			offsets[i] = np.dot(normals[i], X[0])
+	centers = np.mean(verts, 1)
+	radii = np.sqrt(np.max(np.sum((verts - centers[:, None, :])**2, 2), 1))
+	return {'points':facePoints, 'normals':normals, 'offsets':offsets, 'verts':verts, 'centers':centers, 'radii':radii, 'visibility':visibility}
+
+#Bounding planes of the frusta from virtual sources through the faces they
+#were reflected across (the same frusta that meshFaceInFrustum() clips to):
+#one plane through the source and each edge of the face, plus the near plane
+#P: Kx3 source positions
+#parentFaces: Length K face indices (all of them > -1)
+#faceArrays: From getImageFaceArrays()
+#Returns (normals, offsets): KxJx3 and KxJ, where a point X is inside plane
+#j of frustum k if normals[k, j].X - offsets[k, j] >= 0.  Planes for repeated
+#vertices have zero normals and offsets of -inf, so everything is inside them
+def getFrustumPlanes(P, parentFaces, faceArrays):
+	Q = faceArrays['verts'][parentFaces] - P[:, None, :]
+	N = np.cross(Q, np.roll(Q, -1, 1))
+	NL = np.sqrt(np.sum(N**2, 2))
+	valid = NL > 1e-12*np.sum(Q**2, 2)
+	N[valid] /= NL[valid][:, None]
+	N[~valid] = 0
+	#Point the side planes towards the inside of the face
+	C = faceArrays['centers'][parentFaces] - P
+	N *= np.where(np.sum(N*C[:, None, :], 2) < 0, -1, 1)[:, :, None]
+	offsets = np.sum(N*P[:, None, :], 2)
+	offsets[~valid] = -np.inf
+	#Near plane, facing away from the source
+	towards = faceArrays['normals'][parentFaces]
+	towards *= np.where(np.sum(towards*Q[:, 0, :], 1) < 0, -1, 1)[:, None]
+	nearOffsets = np.sum(towards*P, 1) + FRUSTUM_NEAR_DIST
+	return (np.concatenate((N, towards[:, None, :]), 1), np.concatenate((offsets, nearOffsets[:, None]), 1))
+
+#Classify faces against frusta without clipping them.  The bounding spheres
+#and then the vertices of the faces are checked against the planes of the
+#frusta.  Faces that are still undecided are accepted if the axis of the
+#frustum goes through them, or if they share a vertex with the face that
+#defines the frustum (clipping always keeps such a vertex, so these faces
+#pass even when they only touch the frustum)
+#apexes: Ux3 apexes of the frusta
+#parentFaces: Length U indices of the faces that define the frusta
+#normals, offsets: UxJx3 and UxJ frustum planes (see getFrustumPlanes())
+#faces: Length U indices of the faces to check against each frustum
+#faceArrays: From getImageFaceArrays()
+#Returns a length U array that is 1 for faces that are known to pass
+#meshFaceInFrustum(), -1 for faces that are strictly outside one of the
+#planes, and 0 for the rest (which have to be clipped to find out)
+def classifyFacesInFrusta(apexes, parentFaces, normals, offsets, faces, faceArrays):
+	ret = np.zeros(faces.size, dtype = np.int64)
+	d = np.sum(normals*faceArrays['centers'][faces][:, None, :], 2) - offsets
+	r = faceArrays['radii'][faces][:, None] + FRUSTUM_PLANE_EPS
+	ret[np.all(d > FRUSTUM_PLANE_EPS, 1)] = 1
+	ret[np.any(d < -r, 1)] = -1
+	idx = np.nonzero(ret == 0)[0]
+	if idx.size > 0:
+		d = np.einsum('ujc,umc->ujm', normals[idx], faceArrays['verts'][faces[idx]]) - offsets[idx][:, :, None]
+		inside = np.any(np.all(d > FRUSTUM_PLANE_EPS, 1), 1)
+		outside = np.any(np.all(d < -FRUSTUM_PLANE_EPS, 2), 1)
+		ret[idx[inside]] = 1
+		ret[idx[outside]] = -1
+	idx = np.nonzero(ret == 0)[0]
+	if idx.size > 0:
+		X = faceArrays['verts'][faces[idx]]
+		(P0, V) = (apexes[idx], faceArrays['centers'][parentFaces[idx]] - apexes[idx])
+		t = np.inf*np.ones(idx.size)
+		for j in range(1, X.shape[1] - 1):
+			t = np.minimum(t, intersectRaysTriangles(P0, V, X[:, 0], X[:, j] - X[:, 0], X[:, j+1] - X[:, 0])[0])
+		hit = np.isfinite(t) & (t > 0)
+		H = P0[hit] + t[hit][:, None]*V[hit]
+		d = np.sum(normals[idx[hit]]*H[:, None, :], 2) - offsets[idx[hit]]
+		ret[idx[hit][np.all(d > FRUSTUM_PLANE_EPS, 1)]] = 1
+	idx = np.nonzero(ret == 0)[0]
+	if idx.size > 0:
+		X = faceArrays['verts'][faces[idx]]
+		Y = faceArrays['verts'][parentFaces[idx]]
+		shared = np.all(X[:, :, None, :] == Y[:, None, :, :], 3)
+		#Distance of each vertex past the near plane
+		d = np.sum(normals[idx, -1][:, None, :]*X, 2) - offsets[idx, -1][:, None]
+		ret[idx[np.any(np.any(shared, 2) & (d > FRUSTUM_PLANE_EPS), 1)]] = 1
+	return ret
+
+#Candidate (source, face) pairs for a batch of sources: every face for the
+#real source, and the faces in the row of the parent face in the sparse
+#visibility matrix for the others
+#Returns (sources, faces), sorted by source and then by face
+def getVisibleSuccessors(parentFaces, visibility, NFaces):
+	hasParent = parentFaces > -1
+	parents = np.maximum(parentFaces, 0)
+	starts = np.where(hasParent, visibility.indptr[parents], 0)
+	counts = np.where(hasParent, visibility.indptr[parents + 1] - visibility.indptr[parents], NFaces)
+	(elems, owner, segStarts) = getRangeElements(starts, counts)
+	faces = elems.copy()
+	fromMatrix = hasParent[owner]
+	faces[fromMatrix] = visibility.indices[elems[fromMatrix]]
+	return (owner, faces)
+
+#Sample points on faces for visibility tests: the center of each face, its
+#vertices pulled slightly towards the center and nRandom random points
+#inside it (the same ones every time)
+#faceArrays: From getImageFaceArrays()
+#Returns an FxSx3 array of the samples of each face
+def getFaceSamples(faceArrays, nRandom):
+	(verts, centers) = (faceArrays['verts'], faceArrays['centers'])
+	corners = verts + FACE_SAMPLE_SHRINK*(centers[:, None, :] - verts)
+	weights = np.random.RandomState(0).dirichlet(np.ones(verts.shape[1]), nRandom)
+	random = np.einsum('sm,fmc->fsc', weights, verts)
+	return np.concatenate((centers[:, None, :], corners, random), 1)
+
+#Mirror a batch of (virtual) sources across every face that can be reached
+#from them, i.e. every face for the real source, or else every other face
+#that's inside the frustum from the source through the face it was
+#reflected across.  If faceArrays has a face visibility matrix, only the
+#faces that are potentially visible from the parent face are tried.  All of
+#the sources are mirrored across all of their faces at once.  The mirror
+#images that aren't "impossible" (the same as the source) go through cheap
+#plane tests against the frusta, and only the faces that straddle a
+#frustum are clipped to it with meshFaceInFrustum()
+#P: Kx3 positions of the sources
+#parentFaces: Length K indices of the faces the sources were reflected
+#across (-1 for the real source)
+#faceArrays: From getImageFaceArrays()
+#Returns (sources, faces, positions): the index in P of the source of each
+#image, the face it was mirrored across and its Nx3 position, sorted by
+#source and then by face
+def getMirrorImageArrays(P, parentFaces, faceArrays):
+	P = np.asarray(P, dtype = np.float64).reshape((-1, 3))
+	parentFaces = np.asarray(parentFaces, dtype = np.int64).flatten()
+	(facePoints, normals, offsets) = (faceArrays['points'], faceArrays['normals'], faceArrays['offsets'])
+	visibility = faceArrays['visibility']
+	NFaces = normals.shape[0]
+	sources = [np.zeros(0, dtype = np.int64)]
+	faces = [np.zeros(0, dtype = np.int64)]
+	positions = [np.zeros((0, 3))]
+	chunk = max(1, IMAGE_CHUNK_SIZE/max(NFaces, 1))
+	for start in range(0, P.shape[0], chunk):
+		(Q, parents) = (P[start:start+chunk], parentFaces[start:start+chunk])
+		if visibility is None:
+			(k, i) = np.nonzero(np.ones((Q.shape[0], NFaces), dtype = np.bool_))
+		else:
+			(k, i) = getVisibleSuccessors(parents, visibility, NFaces)
+		#Signed distance from each source to the plane of each face
+		d = np.sum(Q[k]*normals[i], 1) - offsets[i]
+		keep = (d**2 > EPS) & (i != parents[k])
+		(k, i, d) = (k[keep], i[keep], d[keep])
+		#Do pruning test to avoid making virtual sources that cannot be
+		#reached from their parents
+		passed = np.ones(k.size, dtype = np.bool_)
+		reflected = np.nonzero(parents[k] > -1)[0]
+		if reflected.size > 0:
+			hasParent = parents > -1
+			(N, D) = getFrustumPlanes(Q[hasParent], parents[hasParent], faceArrays)
+			planeNormals = np.zeros((Q.shape[0], N.shape[1], 3))
+			planeOffsets = np.zeros((Q.shape[0], N.shape[1]))
+			(planeNormals[hasParent], planeOffsets[hasParent]) = (N, D)
+			(kr, ir) = (k[reflected], i[reflected])
+			inFrustum = classifyFacesInFrusta(Q[kr], parents[kr], planeNormals[kr], planeOffsets[kr], ir, faceArrays)
+			passed[reflected] = inFrustum > -1
+			for j in reflected[inFrustum == 0].tolist():
+				[x, y, z] = Q[k[j]].tolist()
+				passed[j] = meshFaceInFrustum(Point3D(x, y, z), facePoints[parents[k[j]]], facePoints[i[j]])
+		(k, i, d) = (k[passed], i[passed], d[passed])
+		sources.append(k + start)
+		faces.append(i)
+		positions.append(Q[k] - 2*d[:, None]*normals[i])
+	return (np.concatenate(sources), np.concatenate(faces), np.concatenate(positions))
+
+#Face arrays in the virtual source worker processes (see initImageWorker())
+IMAGE_FACE_ARRAYS = None
+
+#Pack the face vertices into (Nx3 array of all of the vertices, number of
+#vertices in each face) to send to the workers
+def packFacePoints(facePoints):
+	coords = np.array([[P.x, P.y, P.z] for points in facePoints for P in points], dtype = np.float64).reshape((-1, 3))
+	counts = np.array([len(points) for points in facePoints], dtype = np.int64)
+	return (coords, counts)
+
+#Pool initializer that unpacks the face vertices (and the optional face
+#visibility matrix) once per worker
+def initImageWorker(coords, counts, visibility = None):
+	global IMAGE_FACE_ARRAYS
+	coords = coords.tolist()
+	facePoints = []
+	start = 0
+	for count in counts.tolist():
+		facePoints.append([Point3D(x, y, z) for [x, y, z] in coords[start:start+count]])
+		start += count
+	IMAGE_FACE_ARRAYS = getImageFaceArrays(facePoints, visibility)
+
+#getMirrorImageArrays() for one chunk of a level of the tree in a worker
+#job: (Kx3 source positions, length K parent faces)
+def getMirrorImageChunk(job):
+	(P, parentFaces) = job
+	return getMirrorImageArrays(P, parentFaces, IMAGE_FACE_ARRAYS)
+
+#Number of (receiver, image) candidate paths that are traced at once
+PATH_CHUNK_SIZE = 100000
+#Paths whose points are all within this distance of each other are the
+#same path.  The reflection points are moved EPS off of the faces, so a
+#double reflection in a corner comes out about 2*EPS apart from the two
+#image orders that produce it
+PATH_DUPLICATE_EPS = 1e-9
+
+#Trace candidate paths from receivers back to the real source through
+#virtual sources that are all on the same level of the tree.  All of the
+#paths are walked together one leg at a time: each leg has to hit the face
+#that made the current image and be unblocked, which is checked with one
+#batched occlusion query per leg
+#R: Kx3 receiver positions
+#images: Length K indices of the images (with nReflections reflections)
+#pathData: From EMScene.getPathData()
+#Returns (valid, points), where valid is a length K boolean array of the
+#paths that got through, and points is a Kx(nReflections+2)x3 array of the
+#receiver, the reflection points (moved slightly off of the faces) and the
+#source along each path
+def traceImagePaths(R, images, nReflections, pathData):
+	(pos, parent, face) = (pathData['pos'], pathData['parent'], pathData['face'])
+	(verts, normals, labels, bvh) = (pathData['verts'], pathData['normals'], pathData['labels'], pathData['bvh'])
+	K = R.shape[0]
+	points = np.zeros((K, nReflections + 2, 3))
+	points[:, 0] = R
+	curr = np.array(images, dtype = np.int64)
+	lastLabels = -np.ones(K, dtype = np.int64) #Face that the last leg reflected off of
+	alive = np.arange(K)
+	for leg in range(nReflections):
+		#This leg has to reflect off of the face that made the virtual source
+		(T, s) = (points[alive, leg], curr[alive])
+		f = face[s]
+		V = pos[s] - T
+		V = V/np.sqrt(np.sum(V**2, 1))[:, None]
+		X = verts[f]
+		t = np.inf*np.ones(alive.size)
+		for j in range(1, X.shape[1] - 1):
+			tj = intersectRaysTriangles(T, V, X[:, 0], X[:, j] - X[:, 0], X[:, j+1] - X[:, 0])[0]
+			t = np.minimum(t, np.where(tj >= 0, tj, np.inf))
+		hit = np.isfinite(t)
+		t[~hit] = 0
+		P = T + t[:, None]*V
+		ignore = np.array([lastLabels[alive], labels[f]]).T
+		ok = hit & ~bvh.occludedRays(T, P - T, 0.0, 1.0 - OCCLUSION_EPS, ignore)
+		#Move the intersection point slightly away from the face
+		N = normals[f[ok]]
+		N *= np.where(np.sum(N*(P[ok] - T[ok]), 1) > 0, -1, 1)[:, None]
+		alive = alive[ok]
+		points[alive, leg+1] = P[ok] + EPS*N
+		lastLabels[alive] = labels[f[ok]]
+		curr[alive] = parent[s[ok]]
+	#The last leg goes straight to the source
+	(T, S) = (points[alive, nReflections], pos[curr[alive]])
+	ignore = np.array([lastLabels[alive], -np.ones(alive.size, dtype = np.int64)]).T
+	alive = alive[~bvh.occludedRays(T, S - T, 0.0, 1.0 - OCCLUSION_EPS, ignore)]
+	points[alive, nReflections+1] = pos[curr[alive]]
+	valid = np.zeros(K, dtype = np.bool_)
+	valid[alive] = True
+	return (valid, points)
+
+#Find the paths from each of the receivers R (Kx3) to the source through
+#every virtual source in pathData (see EMScene.getPathData()).  Paths that
+#are longer than pathData['maxPathLength'] (if it's not None) are dropped,
+#and paths that are found more than once are only kept once
+#Returns a list with (paths, pathAttens) for each receiver, where paths is
+#a list of Nx3 arrays of the points along each path (from the receiver to
+#the source), in the order of the images in the tree
+def getReceiverPaths(R, pathData):
+	R = np.asarray(R, dtype = np.float64).reshape((-1, 3))
+	levels = pathData['levels']
+	found = [[] for r in range(R.shape[0])]
+	for level in range(len(levels) - 1):
+		images = np.arange(levels[level], levels[level+1])
+		if images.size == 0:
+			continue
+		rows = max(1, PATH_CHUNK_SIZE/images.size)
+		for start in range(0, R.shape[0], rows):
+			receivers = np.arange(start, min(start + rows, R.shape[0]))
+			(r, k) = (np.repeat(receivers, images.size), np.tile(images, receivers.size))
+			(valid, points) = traceImagePaths(R[r], k, level, pathData)
+			if pathData['maxPathLength']:
+				lengths = np.sum(np.sqrt(np.sum((points[:, 1:] - points[:, 0:-1])**2, 2)), 1)
+				valid = valid & (lengths <= pathData['maxPathLength'])
+			for j in np.nonzero(valid)[0].tolist():
+				found[r[j]].append((k[j], points[j]))
+	ret = []
+	for paths in found:
+		#Corner reflections are found through both image orders
+		paths = [paths[i] for i in getDistinctPaths([P for (k, P) in paths])]
+		ret.append(([P for (k, P) in paths], [float(pathData['atten'][k]) for (k, P) in paths]))
+	return ret
+
+#Return the indices of the paths (Nx3 arrays of points) to keep so that
+#paths that go through the same points (within PATH_DUPLICATE_EPS) are
+#only counted once, keeping the first of each.  Duplicates have the same
+#length, so each path is only compared against the paths with the same
+#number of points and about the same length
+def getDistinctPaths(paths):
+	if len(paths) < 2:
+		return range(len(paths))
+	lengths = getPathLengths(paths)
+	counts = [P.shape[0] for P in paths]
+	order = np.lexsort((np.arange(len(paths)), lengths)).tolist()
+	lengths = lengths.tolist()
+	tol = 2*PATH_DUPLICATE_EPS*max(counts)
+	duplicate = [False]*len(paths)
+	for (a, i) in enumerate(order):
+		b = a - 1
+		while b >= 0 and lengths[i] - lengths[order[b]] <= tol:
+			j = order[b]
+			b -= 1
+			if duplicate[j] or counts[i] != counts[j]:
+				continue
+			if np.abs(paths[i] - paths[j]).max() <= PATH_DUPLICATE_EPS:
+				duplicate[max(i, j)] = True
+				if max(i, j) == i:
+					break
+	return [i for i in range(len(paths)) if not duplicate[i]]
+
+#Path data in the path worker processes (see initPathWorker())
+PATH_DATA = None
+
+#Pool initializer that receives the path data once per worker
+def initPathWorker(pathData):
+	global PATH_DATA
+	PATH_DATA = pathData
+
+#getReceiverPaths() for one block of receivers in a worker
+def getReceiverPathsBlock(R):
+	return getReceiverPaths(R, PATH_DATA)
+
+#Friis ideal free space path loss over distances dist (a number or an
+#array) at fMhz MHz, capped at 1 for distances that are too short for the
+#far field formula to hold
+def getFreeSpaceLoss(fMhz, dist):
+	with np.errstate(divide = 'ignore'):
+		return np.minimum((300/(4*math.pi*fMhz*np.asarray(dist, dtype = np.float64)))**2, 1.0)
+
+#Speed of light in m/s
+SPEED_OF_LIGHT = 3e8
+#Number of receivers in each tile of a coverage map
+COVERAGE_TILE_SIZE = 256
+#Minimum number of seconds between coverage map checkpoints
+COVERAGE_CHECKPOINT_INTERVAL = 30.0
+
+#Total lengths of paths, where each path is an Nx3 array (or a list of
+#Point3D) of the points along it.  All of the paths are stacked so that the
+#leg lengths come from one vectorized norm, and the legs that would join the
+#end of one path to the start of the next are left out of the sums
+def getPathLengths(paths):
+	if len(paths) == 0:
+		return np.zeros(0)
+	paths = [P if isinstance(P, np.ndarray) else np.array([[X.x, X.y, X.z] for X in P]) for P in paths]
+	counts = np.array([P.shape[0] for P in paths], dtype = np.int64)
+	X = np.concatenate(paths, 0)
+	d = np.sqrt(np.sum((X[1:] - X[0:-1])**2, 1))
+	ends = np.cumsum(counts)
+	d[ends[0:-1] - 1] = 0
+	d = np.concatenate((d, [0]))
+	return np.add.reduceat(d, ends - counts)
+
+#Impulse response of paths with total lengths lengths (see getPathLengths())
+#and reflection coefficients pathAttens at fMhz MHz
+#Returns (loss, delay), arrays of the attenuation of each path (reflections
+#times free space loss) and its delay in seconds
+def getImpulseResponseArrays(lengths, pathAttens, fMhz):
+	lengths = np.asarray(lengths, dtype = np.float64)
+	loss = np.asarray(pathAttens, dtype = np.float64)*getFreeSpaceLoss(fMhz, lengths)
+	return (loss, lengths/SPEED_OF_LIGHT)
+
+#Steady state response at times (an array of seconds) to a sinusoid at fMhz
+#MHz, from impulses with amplitudes loss and delays delay (see
+#getImpulseResponseArrays()).  The sum of the delayed cosines is a single
+#cosine at the same frequency, so the impulses are summed once as phasors
+#and the result is evaluated at every time
+def getSteadyStateSignal(loss, delay, fMhz, times):
+	w = 2*math.pi*fMhz*1e6
+	S = np.sum(np.asarray(loss)*np.exp(-1j*w*np.asarray(delay)))
+	return np.abs(S)*np.cos(w*np.asarray(times) + np.angle(S))
+
+#Received power at a receiver, relative to the transmitted power, from the
+#paths to it (in the format of getReceiverPaths()).  Every path
+#contributes its reflection coefficients times the free space loss.  If
+#coherent is true, the contributions are added as phasors with the phase
+#of each path's length, so that paths can interfere, and otherwise their
+#powers are added.  fMhz is a frequency in MHz or an array of frequencies
+#in a band, in which case the power is averaged over the band
+def getReceivedPower(paths, pathAttens, fMhz, coherent = False):
+	fMhz = np.asarray(fMhz, dtype = np.float64).flatten()
+	if len(paths) == 0:
+		return 0.0
+	d = getPathLengths(paths)
+	loss = np.array(pathAttens)[:, None]*getFreeSpaceLoss(fMhz[None, :], d[:, None])
+	if coherent:
+		phase = 2*math.pi*fMhz[None, :]*1e6*d[:, None]/SPEED_OF_LIGHT
+		power = np.abs(np.sum(np.sqrt(loss)*np.exp(-1j*phase), 0))**2
+	else:
+		power = np.sum(loss, 0)
+	return float(np.mean(power))
+
+#Received power at one tile of coverage map receivers in a worker (see
+#initPathWorker())
+#job: (tile index, Kx3 receiver positions, fMhz, coherent)
+#Returns (tile index, length K array of received powers)
+def getCoverageTile(job):
+	(index, R, fMhz, coherent) = job
+	power = [getReceivedPower(paths, pathAttens, fMhz, coherent) for (paths, pathAttens) in getReceiverPaths(R, PATH_DATA)]
+	return (index, np.array(power))
+
+#Return a grid of receiver positions with spacing step (in every
+#direction) inside of the box with corners P0 and P1.  Directions in which
+#the box is flat are dropped, so a box with P0.y = P1.y (e.g. a floor plan at
+#some height) gives an NxMx3 grid of positions, and a box that isn't flat
+#in any direction gives an NxMxLx3 grid
+def getReceiverGrid(P0, P1, step):
+	axes = []
+	for (a, b) in zip(P0, P1):
+		(a, b) = (min(a, b), max(a, b))
+		axes.append(a + step*np.arange(int(np.floor((b - a)/step + 1e-9)) + 1))
+	grid = np.array(np.meshgrid(*axes, indexing = 'ij'))
+	grid = np.rollaxis(grid, 0, 4)
+	keep = tuple([slice(None) if len(x) > 1 else 0 for x in axes] + [slice(None)])
+	return grid[keep]
+
+#Save a coverage map checkpoint to filename, going through a temporary
+#file so that an interrupted save doesn't clobber the last checkpoint
+def saveCoverageCheckpoint(filename, key, power, done):
+	tmpFilename = filename + ".tmp"
+	fout = open(tmpFilename, 'wb')
+	np.savez(fout, key = np.array(key), power = power, done = done)
+	fout.close()
+	os.rename(tmpFilename, filename)
+
 class EMMaterial(object):
 	def __init__(self, R = 1.0, T = 0.0):
 		self.R = R;#Reflection coefficient
@@ -54,10 +559,22 @@ class EMScene(object):
 		self.meshes = [] #Keep a list of meshes in the scene
 		self.Source = None
 		self.Receiver = None
-		self.vSources = [] #Virtual sources
+		#Virtual source tree (see buildVirtualSourceLevels())
+		self.sceneFaces = []
+		self.vSourcePos = np.zeros((0, 3))
+		self.vSourceParent = np.zeros(0, dtype = np.int64)
+		self.vSourceFace = np.zeros(0, dtype = np.int64)
+		self.vSourceAtten = np.zeros(0)
+		self.vSourceLevels = []
+		#Limits on the virtual source tree (see buildVirtualSourceLevels())
+		self.maxLevel = 3
+		self.minAtten = 0.0
+		self.maxPathLength = None #Paths longer than this are dropped too
+		self.fMhz = None
 		self.paths = [] #Paths discovered from source to receiver
 		self.pathAttens = [] #Path attenuations from bouncing
 		self.rays = [] #For debugging
+		self.bvh = None #See getBVH()
 
 	#If buildImages is true, construct all of the virtual sources and extract
 	#paths from source to receiver
@@ -67,7 +584,7 @@ class EMScene(object):
 		self.ReadRecurse(filename, {}, {}, {}, parentNode, None)
 		self.getMeshList()
 		if buildImages:
-			self.buildVirtualSourceTree(3)
+			self.buildVirtualSourceTree()
 			self.getPathsToReceiver()
 
 	def ReadRecurse(self, filename = '', EMMaterials = {}, OpticalMaterials = {}, RadiosityMaterials = {}, EMParentNode = None, XMLNode = None):
@@ -243,6 +760,19 @@ class EMScene(object):
 					return
 				coords = [float(i) for i in currNode.get("pos").split()]
 				self.Receiver = Point3D(coords[0], coords[1], coords[2])
+			elif currNode.tag == "ImageSources":
+				#Limits on the virtual source tree (all optional), e.g.
+				#<ImageSources maxLevel = "6" minAtten = "1e-10" maxPathLength = "100" fMhz = "2400"/>
+				#maxPathLength prunes the tree and also drops any traced
+				#path that still comes out longer
+				if currNode.get("maxLevel") != None:
+					self.maxLevel = int(currNode.get("maxLevel"))
+				if currNode.get("minAtten") != None:
+					self.minAtten = float(currNode.get("minAtten"))
+				if currNode.get("maxPathLength") != None:
+					self.maxPathLength = float(currNode.get("maxPathLength"))
+				if currNode.get("fMhz") != None:
+					self.fMhz = float(currNode.get("fMhz"))
 			else:
 				if not (currNode.tag in ["EMMaterials", "OpticalMaterials", "RadiosityMaterials"]):
 					#Checking to make sure it's a string handles the case 
@@ -267,9 +797,78 @@ class EMScene(object):
 	def getMeshList(self):
 		self.meshes = []
 		self.getMeshListRecurse(self.rootEMNode, self.meshes, self.rootEMNode.transformation)
-		
+		self.buildBVH()
+	
+	#Build one TriangleBVH over the fan triangulated faces of all of the
+	#meshes in world coordinates, along with the mesh, face and face
+	#normal of every triangle.  Every face gets a label (its index among
+	#the faces of all of the meshes) that occlusion queries can ignore it by
+	def buildBVH(self):
+		Xs = [np.zeros((0, 3))]
+		allTris = [np.zeros((0, 3), dtype = np.int64)]
+		triMesh = [np.zeros(0, dtype = np.int64)]
+		triFace = [np.zeros(0, dtype = np.int64)]
+		triNormals = [np.zeros((0, 3))]
+		faceLabels = {}
+		offset = 0
+		faceOffset = 0
+		triLabels = [np.zeros(0, dtype = np.int64)]
+		for i in range(len(self.meshes)):
+			m = self.meshes[i]
+			X = m.getVertexPositions()
+			(faceVerts, faceCounts) = m.getFaceIndices()
+			(tris, face) = getFanTriangles(faceVerts, faceCounts)
+			Xs.append(X)
+			allTris.append(tris + offset)
+			triMesh.append(i*np.ones(len(face), dtype = np.int64))
+			triFace.append(face)
+			triLabels.append(face + faceOffset)
+			triNormals.append(getFaceNormalArrays(X, faceVerts, faceCounts)[face])
+			for f in m.faces:
+				faceLabels[f] = f.ID + faceOffset
+			offset += X.shape[0]
+			faceOffset += len(faceCounts)
+		bvh = TriangleBVH(np.concatenate(Xs), np.concatenate(allTris), labels = np.concatenate(triLabels))
+		self.bvh = (bvh, np.concatenate(triMesh), np.concatenate(triFace), np.concatenate(triNormals), faceLabels)
+	
+	#Return (bvh, triangle mesh indices, triangle face indices, triangle
+	#normals, {face: label}), building the scene BVH first if it hasn't been
+	#built.  If the meshes are changed after getMeshList(), call buildBVH()
+	#again
+	def getBVH(self):
+		if self.bvh is None:
+			self.buildBVH()
+		return self.bvh
+	
+	#Return True if any face other than the ones in ignoreFaces blocks the
+	#segment from the Point3D P0 to the Point3D P1.  This stops at the first
+	#blocker it finds instead of looking for the closest one
+	def isOccluded(self, P0, P1, ignoreFaces = []):
+		P0 = np.array([[P0.x, P0.y, P0.z]])
+		P1 = np.array([[P1.x, P1.y, P1.z]])
+		return self.isOccludedBatch(P0, P1, [ignoreFaces])[0]
+	
+	#Batched version of isOccluded() that checks all of the segments in one
+	#traversal of the scene BVH
+	#P0, P1: Kx3 arrays of the segment endpoints
+	#ignoreFaces: Optional list of K lists of faces that don't count as
+	#blockers for each segment (e.g. the faces the segment starts and ends on)
+	#Returns a length K boolean array
+	def isOccludedBatch(self, P0, P1, ignoreFaces = None):
+		(bvh, triMesh, triFace, triNormals, faceLabels) = self.getBVH()
+		P0 = np.asarray(P0, dtype = np.float64).reshape((-1, 3))
+		P1 = np.asarray(P1, dtype = np.float64).reshape((-1, 3))
+		ignore = None
+		if ignoreFaces is not None and len(ignoreFaces) > 0:
+			K = max([len(faces) for faces in ignoreFaces])
+			ignore = -np.ones((P0.shape[0], max(K, 1)), dtype = np.int64)
+			for i in range(len(ignoreFaces)):
+				for j in range(len(ignoreFaces[i])):
+					ignore[i, j] = faceLabels[ignoreFaces[i][j]]
+		return bvh.occludedRays(P0, P1 - P0, 0.0, 1.0 - OCCLUSION_EPS, ignore)
 
 	def renderGLRecurse(self, currEMNode, matrix, drawEdges):
+		from OpenGL.GL import glEnable, glMaterialf, glMaterialfv, GL_AMBIENT, GL_DIFFUSE, GL_FRONT, GL_LIGHTING, GL_SHININESS, GL_SPECULAR
 		for child in currEMNode.children:
 			transform = matrix*child.transformation
 			if len(child.children) > 0:
@@ -299,166 +898,372 @@ class EMScene(object):
 	def renderGL(self, drawEdges = 1):
 		self.renderGLRecurse(self.rootEMNode, self.rootEMNode.transformation, drawEdges)
 	
-	#TODO: Add better recursive intersect method with bounding box tests
-	#NOTE: All meshes are in world coordinates now so no longer need to
-	#transform the ray
+	#Return (t, Point, normal, face, mesh) for the closest face in the scene
+	#that the ray hits, with the face normal flipped to point back along the
+	#ray, or None if it misses everything.  This is one traversal of the
+	#scene BVH (all meshes are in world coordinates)
 	def getRayIntersection(self, ray):
-		t = float("inf")
-		Point = None
-		face = None
+		(bvh, triMesh, triFace, triNormals, faceLabels) = self.getBVH()
+		(P0, V) = (ray.P0, ray.V)
+		hit = bvh.intersectRay([P0.x, P0.y, P0.z], [V.x, V.y, V.z])
+		if not hit:
+			return None
+		t = float(hit[0])
+		mesh = self.meshes[triMesh[hit[1]]]
+		face = mesh.faces[triFace[hit[1]]]
+		[nx, ny, nz] = triNormals[hit[1]].tolist()
+		normal = Vector3D(nx, ny, nz)
+		#Make sure the normal is pointing in the right direction
+		if normal.Dot(V) > 0:
+			normal = (-1)*normal
+		return (t, P0 + t*V, normal, face, mesh)
+
+	#Return (sceneFaces, facePoints): [(mesh, face)] for every face in the
+	#scene and the Point3D vertices of each face.  Faces are referred to by
+	#their index in this list in the virtual source tree
+	def getSceneFaces(self):
+		sceneFaces = [(m, f) for m in self.meshes for f in m.faces]
+		facePoints = [[P.pos for P in f.getVertices()] for (m, f) in sceneFaces]
+		return (sceneFaces, facePoints)
+
+	#Return a hex digest that identifies the scene by the geometry of its
+	#meshes (see PolyMesh.fingerprint()), for use as a cache key
+	def fingerprint(self):
+		h = hashlib.sha1()
 		for m in self.meshes:
-			thisRay = ray.Copy()
-			intersection = m.getRayIntersection(thisRay)
-			if intersection != None:
-				thisPoint = intersection[1]
-				thisFace = intersection[2]
-				dVec = thisPoint - ray.P0
-				this_t = dVec.Length()
-				if this_t < t:
-					t = this_t
-					Point = thisPoint
-					face = thisFace
-		if isinstance(Point, Point3D):
-			#Get the transformed face normal
-			verts = [v.pos for v in face.getVertices()]
-			normal = getFaceNormal(verts)
-			#Make sure the normal is pointing in the right direction
-			if normal.Dot(ray.V) > 0:
-				normal = (-1)*normal;
-			return (t, Point, normal, face)
-		return None
+			h.update(m.fingerprint())
+		return h.hexdigest()
 
-	def buildVirtualSourceTreeRecurse(self, currNode, level, maxLevel):
-		self.vSources.append(currNode)
-		if level == maxLevel: #The maximum number of bounces allowed has been reached
+	#Return an FxF sparse (scipy CSR) boolean matrix whose row i has the
+	#faces (indices into getSceneFaces()) that are potentially visible from
+	#face i, so that a reflection off of face i can be followed by one off
+	#of face j.  Faces that lie in each other's planes can never see each
+	#other, and the other pairs are checked by casting segments between
+	#sample points on the two faces (see getFaceSamples()) against the scene
+	#BVH; a pair is visible if any of the segments gets through.  Since it's
+	#sampled, this can miss pairs that only see each other through small
+	#gaps.  The matrix is cached by the scene's fingerprint, so reloading
+	#the same scene doesn't compute it again
+	def getFaceVisibility(self, nSamples = FACE_VISIBILITY_SAMPLES):
+		key = (self.fingerprint(), nSamples)
+		if key in FACE_VISIBILITY_CACHE:
+			visibility = FACE_VISIBILITY_CACHE.pop(key)
+		else:
+			visibility = self.buildFaceVisibility(nSamples)
+		FACE_VISIBILITY_CACHE[key] = visibility
+		while len(FACE_VISIBILITY_CACHE) > FACE_VISIBILITY_CACHE_SIZE:
+			FACE_VISIBILITY_CACHE.popitem(last = False)
+		return visibility
+
+	def buildFaceVisibility(self, nSamples = FACE_VISIBILITY_SAMPLES):
+		from scipy import sparse
+		(sceneFaces, facePoints) = self.getSceneFaces()
+		faceArrays = getImageFaceArrays(facePoints)
+		(verts, normals, offsets) = (faceArrays['verts'], faceArrays['normals'], faceArrays['offsets'])
+		(bvh, triMesh, triFace, triNormals, faceLabels) = self.getBVH()
+		labels = np.array([faceLabels[f] for (m, f) in sceneFaces], dtype = np.int64)
+		samples = getFaceSamples(faceArrays, nSamples)
+		NFaces = len(sceneFaces)
+		I = [np.zeros(0, dtype = np.int64)]
+		J = [np.zeros(0, dtype = np.int64)]
+		rows = max(1, FACE_VISIBILITY_CHUNK_SIZE/max(NFaces, 1))
+		for start in range(0, NFaces, rows):
+			#Pairs (i, j) with i < j
+			(i, j) = np.nonzero(np.arange(start, min(start + rows, NFaces))[:, None] < np.arange(NFaces)[None, :])
+			i = i + start
+			#Orientation test: each face needs a vertex off of the other's plane
+			di = np.abs(np.einsum('pc,pmc->pm', normals[i], verts[j]) - offsets[i][:, None]).max(1)
+			dj = np.abs(np.einsum('pc,pmc->pm', normals[j], verts[i]) - offsets[j][:, None]).max(1)
+			keep = (di > FRUSTUM_PLANE_EPS) & (dj > FRUSTUM_PLANE_EPS)
+			(i, j) = (i[keep], j[keep])
+			#Look for an unblocked segment between the samples of each pair
+			visible = np.zeros(i.size, dtype = np.bool_)
+			undecided = np.arange(i.size)
+			for a in range(samples.shape[1]):
+				for b in range(samples.shape[1]):
+					if undecided.size == 0:
+						break
+					(ii, jj) = (i[undecided], j[undecided])
+					(P0, P1) = (samples[ii, a], samples[jj, b])
+					ignore = np.array([labels[ii], labels[jj]]).T
+					occluded = bvh.occludedRays(P0, P1 - P0, 0.0, 1.0 - OCCLUSION_EPS, ignore)
+					visible[undecided[~occluded]] = True
+					undecided = undecided[occluded]
+			I.append(i[visible])
+			J.append(j[visible])
+		(I, J) = (np.concatenate(I), np.concatenate(J))
+		V = np.ones(2*I.size, dtype = np.bool_)
+		visibility = sparse.coo_matrix((V, (np.concatenate((I, J)), np.concatenate((J, I)))), shape = (NFaces, NFaces)).tocsr()
+		visibility.sort_indices()
+		return visibility
+
+	#Build the virtual source tree one level at a time.  The tree is stored
+	#breadth first in flat arrays, with the real source at index 0:
+	#vSourcePos: Nx3 positions of the virtual sources
+	#vSourceParent: Index of the image each one was mirrored from (-1 for
+	#the real source)
+	#vSourceFace: Index into sceneFaces of the face each one was mirrored
+	#across (-1 for the real source)
+	#vSourceAtten: Product of the reflection coefficients of the faces
+	#between the real source and each image
+	#vSourceLevels: The images with k reflections are
+	#vSourceLevels[k]:vSourceLevels[k+1]
+	#mirrorLevel takes the (positions, parent faces) of one level and
+	#returns the next level like getMirrorImageArrays()
+	#Besides stopping at maxLevel reflections, images are pruned along with
+	#their subtrees if no path through them or their descendants can do
+	#better than the attenuation floor self.minAtten (reflection
+	#coefficients times the free space loss at self.fMhz, if it's set) or
+	#be shorter than self.maxPathLength.  This uses an optimistic bound:
+	#every path through an image is at least as long as the distance from
+	#the image to the plane it was mirrored across, and the reflections
+	#further down can only make things worse (unless some R > 1)
+	def buildVirtualSourceLevels(self, maxLevel, sceneFaces, mirrorLevel):
+		faceR = np.array([m.EMNode.EMMat.R for (m, f) in sceneFaces], dtype = np.float64)
+		maxR = max([1.0] + faceR.tolist())
+		NPruned = 0
+		S = self.Source
+		pos = [np.array([[S.x, S.y, S.z]])]
+		parent = [-np.ones(1, dtype = np.int64)]
+		face = [-np.ones(1, dtype = np.int64)]
+		atten = [np.ones(1)]
+		levels = [0, 1]
+		for level in range(maxLevel):
+			if pos[-1].shape[0] == 0: #Nothing left to reflect
+				break
+			(sources, faces, P) = mirrorLevel(pos[-1], face[-1])
+			A = atten[-1][sources]*faceR[faces]
+			minLength = np.sqrt(np.sum((P - pos[-1][sources])**2, 1))/2
+			keep = np.ones(P.shape[0], dtype = np.bool_)
+			if self.minAtten > 0:
+				bound = A*maxR**(maxLevel - level - 1)
+				if self.fMhz:
+					bound = bound*getFreeSpaceLoss(self.fMhz, minLength)
+				keep = keep & (bound >= self.minAtten)
+			if self.maxPathLength:
+				keep = keep & (minLength <= self.maxPathLength)
+			NPruned += P.shape[0] - int(np.sum(keep))
+			pos.append(P[keep])
+			parent.append(sources[keep] + levels[-2])
+			face.append(faces[keep])
+			atten.append(A[keep])
+			levels.append(levels[-1] + int(np.sum(keep)))
+		self.sceneFaces = sceneFaces
+		self.vSourcePos = np.concatenate(pos)
+		self.vSourceParent = np.concatenate(parent)
+		self.vSourceFace = np.concatenate(face)
+		self.vSourceAtten = np.concatenate(atten)
+		self.vSourceLevels = levels
+		print "There are %i virtual sources (%i pruned)"%(self.vSourcePos.shape[0], NPruned)
+
+	#maxLevel defaults to self.maxLevel
+	#If useVisibility is true, images are only mirrored across the faces that
+	#are potentially visible from the face their parent was mirrored across
+	#(see getFaceVisibility())
+	def buildVirtualSourceTree(self, maxLevel = None, useVisibility = False):
+		if not isinstance(self.Source, Point3D):
+			print "Error: Trying to initialize virtual sources but no initial source specified"
 			return
-		#Try to mirror this source around every face in the scene
-		frustPoints = []
-		if level > 0:
-			frustPoints = [P.pos for P in currNode.meshFace.getVertices()]
-		for m in self.meshes:
-			for f in m.faces:
-				if f != currNode.meshFace:
-					fP0 = currNode.pos
-					facePoints = [P.pos for P in f.getVertices()]
-					if level > 0: #Do pruning test to avoid making
-						#virtual sources that cannot be reached from this one
-						#meshFaceInFrustum(fP0, frustPoints, facePoints)
-						if not meshFaceInFrustum(fP0, frustPoints, facePoints):
-							continue
-					#Tests passed: need to make a virtual image here
-					#First mirror the current virtual source point
-					#across the plane of the new face
-					faceNormal = getFaceNormal(facePoints)
-					dV = fP0 - facePoints[0]
-					perpFaceV = faceNormal.proj(dV)
-					parFaceV = faceNormal.projPerp(dV)
-					mirrorP0 = facePoints[0] + parFaceV - perpFaceV
-					if perpFaceV.squaredMag() > EPS:
-						#Make sure that this is not an "impossible" image
-						#(i.e. the image is not the same after reflection)
-						newSourceNode = EMVSourceNode(mirrorP0, currNode, f, m.EMNode)
-						currNode.children.append(newSourceNode)
-						#Now recursively make the virtual images for this new image
-						self.buildVirtualSourceTreeRecurse(newSourceNode, level+1, maxLevel)
-
-	def buildVirtualSourceTree(self, maxLevel):
+		if maxLevel is None:
+			maxLevel = self.maxLevel
+		(sceneFaces, facePoints) = self.getSceneFaces()
+		visibility = None
+		if useVisibility:
+			visibility = self.getFaceVisibility()
+		faceArrays = getImageFaceArrays(facePoints, visibility)
+		self.buildVirtualSourceLevels(maxLevel, sceneFaces, lambda P, parentFaces: getMirrorImageArrays(P, parentFaces, faceArrays))
+	
+	#Build the same tree as buildVirtualSourceTree(), with every level split
+	#into chunks that are mirrored in a pool of nWorkers processes (default:
+	#one per CPU).  The workers get the face vertices once as flat arrays,
+	#and the chunks are put back together in order
+	def buildVirtualSourceTreeParallel(self, maxLevel = None, nWorkers = None, useVisibility = False):
 		if not isinstance(self.Source, Point3D):
 			print "Error: Trying to initialize virtual sources but no initial source specified"
 			return
-		self.vSources = []
-		rootSource = EMVSourceNode(self.Source, None, None, None)
-		self.buildVirtualSourceTreeRecurse(rootSource, 0, maxLevel)
-		print "There are %i virtual sources"%len(self.vSources)
+		if maxLevel is None:
+			maxLevel = self.maxLevel
+		if not nWorkers:
+			nWorkers = multiprocessing.cpu_count()
+		(sceneFaces, facePoints) = self.getSceneFaces()
+		(coords, counts) = packFacePoints(facePoints)
+		visibility = None
+		if useVisibility:
+			visibility = self.getFaceVisibility()
+		if nWorkers == 1:
+			initImageWorker(coords, counts, visibility)
+			mapChunks = map
+		else:
+			pool = multiprocessing.Pool(nWorkers, initImageWorker, (coords, counts, visibility))
+			mapChunks = lambda f, jobs: pool.map(f, jobs, chunksize = 1)
+		def mirrorLevel(P, parentFaces):
+			starts = range(0, P.shape[0], max(1, int(math.ceil(P.shape[0]/(4.0*nWorkers)))))
+			jobs = [(P[s:e], parentFaces[s:e]) for (s, e) in zip(starts, starts[1:] + [P.shape[0]])]
+			results = mapChunks(getMirrorImageChunk, jobs)
+			sources = [np.zeros(0, dtype = np.int64)] + [r[0] + s for (r, s) in zip(results, starts)]
+			faces = [np.zeros(0, dtype = np.int64)] + [r[1] for r in results]
+			positions = [np.zeros((0, 3))] + [r[2] for r in results]
+			return (np.concatenate(sources), np.concatenate(faces), np.concatenate(positions))
+		if nWorkers == 1:
+			self.buildVirtualSourceLevels(maxLevel, sceneFaces, mirrorLevel)
+			return
+		try:
+			self.buildVirtualSourceLevels(maxLevel, sceneFaces, mirrorLevel)
+		except:
+			#Don't leave the workers behind on errors or Ctrl-C
+			pool.terminate()
+			pool.join()
+			raise
+		pool.close()
+		pool.join()
 	
+	#Return everything that path tracing needs from the built source tree
+	#and the scene in a dictionary of arrays that can be sent to worker
+	#processes: the tree ('pos', 'parent', 'face', 'atten' and 'levels', see
+	#buildVirtualSourceLevels()), the padded vertices and normals of the
+	#faces ('verts', 'normals', see getImageFaceArrays()), the scene BVH
+	#('bvh'), the BVH label of every face ('labels') and the longest path
+	#that's kept ('maxPathLength')
+	def getPathData(self):
+		(bvh, triMesh, triFace, triNormals, faceLabels) = self.getBVH()
+		faceArrays = getImageFaceArrays([[P.pos for P in f.getVertices()] for (m, f) in self.sceneFaces])
+		labels = np.array([faceLabels[f] for (m, f) in self.sceneFaces], dtype = np.int64).flatten()
+		return {'pos':self.vSourcePos, 'parent':self.vSourceParent, 'face':self.vSourceFace, 'atten':self.vSourceAtten, 'levels':self.vSourceLevels, 'verts':faceArrays['verts'], 'normals':faceArrays['normals'], 'bvh':bvh, 'labels':labels, 'maxPathLength':self.maxPathLength}
+
+	#This assumes the source tree has been built
+	#Find the paths from every receiver position in the Kx3 array receivers
+	#to the source, reusing the same source tree.  The receivers are split
+	#into blocks that are traced in a pool of nWorkers processes if
+	#nWorkers > 1
+	#Returns a list with (paths, pathAttens) for each receiver, where paths is
+	#a list of Nx3 arrays of the points along each path, from the receiver to
+	#the source
+	def getPathsToReceivers(self, receivers, nWorkers = 1):
+		receivers = np.asarray(receivers, dtype = np.float64).reshape((-1, 3))
+		pathData = self.getPathData()
+		nWorkers = max(1, min(nWorkers, receivers.shape[0]))
+		if nWorkers == 1:
+			return getReceiverPaths(receivers, pathData)
+		blocks = np.array_split(receivers, min(receivers.shape[0], 4*nWorkers))
+		pool = multiprocessing.Pool(nWorkers, initPathWorker, (pathData,))
+		try:
+			results = pool.map(getReceiverPathsBlock, blocks, chunksize = 1)
+		except:
+			#Don't leave the workers behind on errors or Ctrl-C
+			pool.terminate()
+			pool.join()
+			raise
+		pool.close()
+		pool.join()
+		return [r for result in results for r in result]
+
+	#Impulse responses (see getImpulseResponse()) at every receiver
+	#position in the Kx3 array receivers, from getPathsToReceivers()
+	def getImpulseResponses(self, receivers, fMhz, nWorkers = 1):
+		ret = []
+		for (paths, pathAttens) in self.getPathsToReceivers(receivers, nWorkers):
+			(loss, delay) = getImpulseResponseArrays(getPathLengths(paths), pathAttens, fMhz)
+			ret.append(zip(loss.tolist(), delay.tolist(), [P.shape[0]-2 for P in paths]))
+		return ret
+
 	#This assumes the source tree has been built
+	#Find the paths from self.Receiver to the source
 	def getPathsToReceiver(self):
-		self.paths = []
-		self.pathAttens = []
-		for source in self.vSources:
-			path = [self.Receiver]
-			pathAtten = 1
-			currSource = source
-			validPath = True
-			while currSource != None:
-				target = path[-1]
-				P0 = target
-				V = currSource.pos - target
-				ray = Ray3D(P0, V)
-				intersection = self.getRayIntersection(ray)
-				if intersection == None:
-					validPath = False
-					break
-				#(t, Point, normal, face)
-				if currSource.parent == None:
-					#The last source
-					if intersection[0] < (target-currSource.pos).Length() - EPS:
-						#Something is blocking the final source
-						validPath = False
-					else:
-						path.append(currSource.pos)
-				else:
-					if intersection[3] != currSource.meshFace:
-						validPath = False
-						break
-					else:
-						#Move the intersection point slightly away from the face
-						path.append(intersection[1]+EPS*intersection[2])
-						#Reflection coefficient
-						pathAtten = pathAtten*source.EMNode.EMMat.R
-				currSource = currSource.parent
-			if validPath:
-				self.paths.append(path)
-				self.pathAttens.append(pathAtten)
+		R = self.Receiver
+		(paths, pathAttens) = self.getPathsToReceivers([[R.x, R.y, R.z]])[0]
+		self.paths = [[Point3D(x, y, z) for [x, y, z] in P.tolist()] for P in paths]
+		#Reflection coefficients
+		self.pathAttens = pathAttens
 		print "There were %i paths found"%len(self.paths)
 
+	#This assumes the source tree has been built
+	#Compute a coverage map: the received power (see getReceivedPower()) at
+	#every position in receivers, an array of positions whose last
+	#dimension is 3 (e.g. from getReceiverGrid()).  The receivers are split
+	#into tiles of tileSize that are traced in a pool of nWorkers processes
+	#if nWorkers > 1, and the progress is printed as the tiles finish if
+	#verbose is true.  If checkpoint is a filename, the finished tiles are
+	#saved to it every so often, and a run that's started again with the
+	#same checkpoint (and the same scene, source tree, receivers and
+	#settings) only computes the tiles that are missing
+	#Returns an array of powers with the shape of receivers minus its last
+	#dimension
+	def getCoverageMap(self, receivers, fMhz, coherent = False, nWorkers = 1, tileSize = COVERAGE_TILE_SIZE, checkpoint = None, verbose = True):
+		receivers = np.asarray(receivers, dtype = np.float64)
+		shape = receivers.shape[0:-1]
+		R = receivers.reshape((-1, 3))
+		starts = range(0, R.shape[0], tileSize)
+		power = np.zeros(R.shape[0])
+		done = np.zeros(len(starts), dtype = np.bool_)
+		#Key that identifies this run in the checkpoint
+		h = hashlib.sha1()
+		h.update(self.fingerprint())
+		for A in [self.vSourcePos, self.vSourceFace, self.vSourceAtten, R, fMhz]:
+			updateArrayHash(h, A, '<f8')
+		#The tree limits too, since maxPathLength also filters the traced paths
+		#and can change them without changing the tree
+		h.update('%s %i %r %r %r %r'%(coherent, tileSize, self.maxPathLength, self.minAtten, self.maxLevel, self.vSourceLevels))
+		key = h.hexdigest()
+		if checkpoint and os.path.exists(checkpoint):
+			data = np.load(checkpoint)
+			if str(data['key']) == key:
+				(power, done) = (data['power'], data['done'])
+				if verbose:
+					print "Resuming from %s with %i of %i tiles done"%(checkpoint, np.sum(done), len(starts))
+			else:
+				print "Warning: Not resuming from %s, which is from a different coverage map"%checkpoint
+		jobs = [(i, R[starts[i]:starts[i]+tileSize], fMhz, coherent) for i in range(len(starts)) if not done[i]]
+		pathData = self.getPathData()
+		nWorkers = max(1, min(nWorkers, len(jobs)))
+		if nWorkers == 1:
+			initPathWorker(pathData)
+			resultsIter = (getCoverageTile(job) for job in jobs)
+		else:
+			pool = multiprocessing.Pool(nWorkers, initPathWorker, (pathData,))
+			resultsIter = pool.imap_unordered(getCoverageTile, jobs)
+		tic = time.time()
+		lastSave = tic
+		try:
+			for (i, tilePower) in resultsIter:
+				power[starts[i]:starts[i]+tileSize] = tilePower
+				done[i] = True
+				if verbose:
+					sys.stdout.write("[%i/%i tiles] %.3fs\n"%(np.sum(done), len(starts), time.time() - tic))
+					sys.stdout.flush()
+				if checkpoint and time.time() - lastSave > COVERAGE_CHECKPOINT_INTERVAL:
+					saveCoverageCheckpoint(checkpoint, key, power, done)
+					lastSave = time.time()
+		except:
+			#Don't leave the workers behind on errors or Ctrl-C, and keep
+			#the tiles that did finish for the next run
+			if nWorkers > 1:
+				pool.terminate()
+				pool.join()
+			if checkpoint:
+				saveCoverageCheckpoint(checkpoint, key, power, done)
+			raise
+		if nWorkers > 1:
+			pool.close()
+			pool.join()
+		if checkpoint:
+			saveCoverageCheckpoint(checkpoint, key, power, done)
+		return power.reshape(shape)
+
 	#Calculate the impulse response given the paths and their attenuations
 	#Returns a list of tuples of the form (attenuation, phase delay, )
 	#fMhz is the operating frequency in MHz
 	def getImpulseResponse(self, fMhz):
-		response = [(0, 0)]*len(self.paths)
-		c = 3e8 #Speed of light
-		for i in range(0, len(self.paths)):
-			totalDist = 0
-			path = self.paths[i]
-			loss = self.pathAttens[i]#Start off with the loss from reflection
-			#Loop through each leg of the path and compute its length
-			#which is used to figure out loss and time delay
-			for j in range(0, len(path)-1):
-				dVec = path[j+1] - path[j]
-				d = dVec.Length()
-				totalDist = totalDist + d
-			phaseDelay = totalDist / c
-			#Friis ideal free space path loss
-			pathLoss = (300/(4*math.pi*fMhz*totalDist))**2
-			if pathLoss < 1:
-				loss = loss*pathLoss
-			response[i] = (loss, phaseDelay, len(path)-2)
-		return response
+		(loss, delay) = getImpulseResponseArrays(getPathLengths(self.paths), self.pathAttens, fMhz)
+		return zip(loss.tolist(), delay.tolist(), [len(path)-2 for path in self.paths])
 	
 	def getSteadyStateSinusoid(self, fMhz, SampsPerCycle, NCycles):
 		T = 1/(fMhz*1e6)
 		dt = T/SampsPerCycle
-		impulses = self.getImpulseResponse(fMhz)
-		signal = [0]*SampsPerCycle*NCycles
-		times = [dt*i for i in range(0, len(signal))]
-		for impulse in impulses:
-			A = impulse[0]
-			phi = impulse[1]
-			signal = [signal[i] + A*math.cos(2*math.pi*fMhz*1e6*(dt*i - phi)) for i in range(0, len(signal))]
-		return (times, signal)
-
-#Used to build virtual source trees
-class EMVSourceNode(object):
-	#pos is the position of the virtual source in world coordinates
-	#meshFace is the face around which this source was reflected
-	def __init__(self, pos, parent, meshFace, EMNode):
-		self.pos = pos
-		self.parent = parent
-		self.meshFace = meshFace
-		self.EMNode = EMNode
-		self.children = []
-			
+		(loss, delay) = getImpulseResponseArrays(getPathLengths(self.paths), self.pathAttens, fMhz)
+		times = dt*np.arange(SampsPerCycle*NCycles)
+		signal = getSteadyStateSignal(loss, delay, fMhz, times)
+		return (times.tolist(), signal.tolist())
+
 if __name__ == '__main__':
 	scene = EMScene()
 	scene.Read('test.xml')
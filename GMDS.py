@@ -2,7 +2,6 @@ from PolyMesh import *
 from Primitives3D import *
 from Utilities2D import *
 from Shapes3D import *
-from OpenGL.GL import *
 from Graphics3D import *
 import sys
 import re
@@ -10,8 +9,6 @@ import math
 import numpy as np
 import numpy.linalg as linalg
 import scipy.spatial as spatial
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
 #from sklearn import manifold
 from ICP import *
 from Utilities2D import *
@@ -215,6 +212,7 @@ def vectorInsideTriangleVertex(vec, v1, face):
 #For debugging, plot a heatmap of the stress function evaluated
 #at different points in the triangle
 def plotRasterizedStress(A, b, triBefore, triNew, ubefore, unew):
+	import matplotlib.pyplot as plt
 	#Spread some barycentric coordinates out
 	#and get colors proportional to the stress at
 	#those coordinates
@@ -240,6 +238,7 @@ def plotRasterizedStress(A, b, triBefore, triNew, ubefore, unew):
 	plt.show()
 
 def plotRasterizedStressEdges(A, b, tri, ubefore, unew):
+	import matplotlib.pyplot as plt
 	N = 100
 	Extent = 1.2
 	ux, uy = np.mgrid[-Extent:Extent:np.complex(0, N), -Extent:Extent:np.complex(0, N)]
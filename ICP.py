@@ -54,13 +54,7 @@ def transformPoints(T, P):
 #update: Update the points to reflect the best found transformation?
 def ICP_PointsToMesh(P, M, allPermsAndFlips = False, pointToPlane = False, update = False, verbose = False, glcanvas = None, glmutex = None):
 	MCentroid = M.getCentroid()
-	NM = len(M.vertices)
-	MPoints = np.zeros((NM, 3))
-	for i in range(NM):
-		pos = M.vertices[i].pos
-		MPoints[i, 0] = pos.x
-		MPoints[i, 1] = pos.y
-		MPoints[i, 2] = pos.z
+	MPoints = M.getVertexPositions().copy()
 	(MAxis1, MAxis2, MAxis3, maxProj, minProj, MAxes) = M.getPrincipalAxes()
 	
 	PCentroid = P.getCentroid()
@@ -200,4 +194,5 @@ def ICP_MeshToMesh(M1, M2, allPermsAndFlips = False, pointToPlane = False, updat
 	AllTransformations, minIndex, error = ICP_PointsToMesh(P, M2, allPermsAndFlips, pointToPlane, update, verbose, glcanvas, glmutex)
 	for i in range(len(M1.vertices)):
 		M1.vertices[i].pos = P.points[i]
+	M1.needsGeometryUpdate = True
 	return AllTransformations, minIndex, error
@@ -1,7 +1,6 @@
 from PolyMesh import *
 from Primitives3D import *
 from Shapes3D import *
-from OpenGL.GL import *
 from Graphics3D import *
 import sys
 import re
@@ -10,7 +9,6 @@ import numpy as np
 from scipy import sparse
 from scipy.sparse.linalg import lsqr, cg, eigsh
 from scipy.spatial import Delaunay
-import matplotlib.pyplot as plt
 
 #Note: This class assumes mesh is triangular
 #(use e.g. PolyMesh.starTriangulate() if this is not the case)
@@ -47,10 +45,11 @@ class LaplacianMesh(PolyMesh):
 		J = []
 		V = []
 		overwriteIdx = 0
+		#Precompute 1-ring areas
+		oneRingAreas = self.getOneRingAreas().tolist()
 		for v1 in self.vertices:
-			#Precompute 1-ring areas
-			v1.oneRingArea = v1.getOneRingArea()
 			i = v1.ID
+			v1.oneRingArea = oneRingAreas[i]
 			if overwriteRows:
 				if overwriteIdx < len(overwriteRows):
 					if i == overwriteRows[overwriteIdx]:
@@ -153,10 +152,7 @@ class LaplacianMesh(PolyMesh):
 			g[i] = [P.x, P.y, P.z]
 			i = i+1
 		newPos = self.solveFunctionWithConstraints(constraintsToPass, deltaCoords, g)
-		for i in range(N):
-			self.vertices[i].pos = Point3D(newPos[i, 0], newPos[i, 1], newPos[i, 2])
-		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.setVertexPositions(newPos)
 
 	#Make a "soap bubble" surface
 	#anchoredVertices: dictionary of the form {index: Position}
@@ -174,10 +170,7 @@ class LaplacianMesh(PolyMesh):
 			deltaCoords[i] = [P.x, P.y, P.z]
 			i = i+1
 		newPos = self.solveFunctionWithConstraints([], deltaCoords, g, constraintsToPass)
-		for i in range(N):
-			self.vertices[i].pos = Point3D(newPos[i, 0], newPos[i, 1], newPos[i, 2])
-		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.setVertexPositions(newPos)
 	
 	#Return the first k eigenvectors of the Laplace-Beltrami operator
 	def getHKSEigenvectors(self, k):
@@ -0,0 +1,302 @@
+#Out-of-core statistics for mesh files that are too big to load into a
+#PolyMesh.  The vertex and face blocks of OFF and PLY (ascii and binary)
+#files are read in chunks of a fixed number of elements, so the memory
+#that's used doesn't depend on the size of the file
+from Primitives3D import *
+from Shapes3D import *
+from PolyMesh import getPrincipalAxesFromScatter, getAreaWeightedSums, parseObjFloatLines, parseOffFaceLines
+import numpy as np
+import itertools
+import tempfile
+import re
+import os
+import sys
+
+STREAM_CHUNKSIZE = 1 << 16 #Number of vertices/faces per chunk
+
+PLY_TYPES = {'char':'i1', 'int8':'i1', 'uchar':'u1', 'uint8':'u1', 'short':'i2', 'int16':'i2', 'ushort':'u2', 'uint16':'u2', 'int':'i4', 'int32':'i4', 'uint':'u4', 'uint32':'u4', 'float':'f4', 'float32':'f4', 'double':'f8', 'float64':'f8'}
+
+#############################################################
+####                   CHUNKED READERS                  #####
+#############################################################
+
+#All of the readers are generators of (kind, data) pairs, where kind is
+#'header': data is (NVertices, NFaces), and this always comes first
+#'vertices': data is a Kx3 array with the positions of the next K vertices
+#'faces': data is (faceVerts, faceCounts) for the next batch of faces, in
+#the format of PolyMesh.getFaceIndices()
+
+#Skip blank lines and comments
+def getOffDataLines(fin):
+	for line in fin:
+		l = line.strip()
+		if len(l) > 0 and not l[0] in ['#', '\0']:
+			yield l
+
+def streamOffFile(filename, chunkSize = STREAM_CHUNKSIZE):
+	fin = open(filename, 'r')
+	lines = getOffDataLines(fin)
+	try:
+		fields = next(lines).split()
+		if fields[0] in ["OFF", "COFF"]:
+			fields = fields[1:]
+			if len(fields) == 0:
+				fields = next(lines).split()
+		[nVertices, nFaces] = [int(field) for field in fields[0:2]]
+	except (StopIteration, ValueError):
+		fin.close()
+		raise ValueError("%s is not an OFF file (bad or missing header)"%filename)
+	yield ('header', (nVertices, nFaces))
+	for (n, kind) in [(nVertices, 'vertices'), (nFaces, 'faces')]:
+		while n > 0:
+			chunk = list(itertools.islice(lines, min(n, chunkSize)))
+			if len(chunk) == 0:
+				sys.stderr.write("Error: %s ended before all %s were read\n"%(filename, kind))
+				break
+			n -= len(chunk)
+			if kind == 'vertices':
+				yield (kind, parseObjFloatLines(chunk, 3)[:, 0:3])
+			else:
+				yield (kind, parseOffFaceLines(chunk))
+	fin.close()
+
+#Return (format, elements), where elements is a list of [name, count, properties]
+#in the order they appear in the file.  Each property is either (name, type)
+#or (name, countType, itemType) for a list property
+def readPlyHeader(fin):
+	if fin.readline().strip() != "ply":
+		return (None, [])
+	format = None
+	elements = []
+	while True:
+		line = fin.readline()
+		if len(line) == 0:
+			break
+		fields = line.split()
+		if len(fields) == 0 or fields[0] in ["comment", "obj_info"]:
+			continue
+		if fields[0] == "end_header":
+			break
+		if fields[0] == "format":
+			format = fields[1]
+		elif fields[0] == "element":
+			elements.append([fields[1], int(fields[2]), []])
+		elif fields[0] == "property":
+			if fields[1] == "list":
+				elements[-1][2].append((fields[4], PLY_TYPES[fields[2]], PLY_TYPES[fields[3]]))
+			else:
+				elements[-1][2].append((fields[2], PLY_TYPES[fields[1]]))
+	return (format, elements)
+
+def getPlyElement(elements, name):
+	for e in elements:
+		if e[0] == name:
+			return e
+	return [name, 0, []]
+
+def streamPlyFile(filename, chunkSize = STREAM_CHUNKSIZE):
+	fin = open(filename, 'rb')
+	(format, elements) = readPlyHeader(fin)
+	if not format:
+		fin.close()
+		raise ValueError("%s is not a PLY file"%filename)
+	yield ('header', (getPlyElement(elements, 'vertex')[1], getPlyElement(elements, 'face')[1]))
+	if format == "ascii":
+		chunks = streamPlyAsciiElements(fin, elements, chunkSize)
+	else:
+		byteOrder = '<'
+		if format == "binary_big_endian":
+			byteOrder = '>'
+		chunks = streamPlyBinaryElements(fin, elements, byteOrder, chunkSize)
+	for chunk in chunks:
+		yield chunk
+	fin.close()
+
+#Return the columns of x, y, z among the vertex properties
+def getPlyXYZColumns(props):
+	names = [p[0] for p in props]
+	return [names.index(c) for c in ['x', 'y', 'z']]
+
+#Return the index of the face index list among the face properties
+def getPlyFaceListIndex(props):
+	for i in range(len(props)):
+		if len(props[i]) == 3 and props[i][0] in ['vertex_indices', 'vertex_index']:
+			return i
+	return -1
+
+def streamPlyAsciiElements(fin, elements, chunkSize):
+	lines = getOffDataLines(fin)
+	for (name, count, props) in elements:
+		if name == 'face':
+			#Strip off any scalar properties that come before the list
+			offset = getPlyFaceListIndex(props)
+		while count > 0:
+			chunk = list(itertools.islice(lines, min(count, chunkSize)))
+			if len(chunk) == 0:
+				break
+			count -= len(chunk)
+			if name == 'vertex':
+				X = parseObjFloatLines(chunk, len(props))
+				yield ('vertices', X[:, getPlyXYZColumns(props)])
+			elif name == 'face':
+				if offset > 0:
+					chunk = [" ".join(l.split()[offset:]) for l in chunk]
+				yield ('faces', parseOffFaceLines(chunk))
+
+def streamPlyBinaryElements(fin, elements, byteOrder, chunkSize):
+	for (name, count, props) in elements:
+		if name == 'face' and len(props) > 0 and max([len(p) for p in props]) == 3:
+			for chunk in streamPlyBinaryFaces(fin, count, props, byteOrder, chunkSize):
+				yield chunk
+			continue
+		if max([len(p) for p in props] + [0]) == 3:
+			sys.stderr.write("Error: List properties are only supported on the face element in binary PLY files\n")
+			return
+		dtype = np.dtype([(p[0], byteOrder + p[1]) for p in props])
+		while count > 0:
+			n = min(count, chunkSize)
+			buf = fin.read(n*dtype.itemsize)
+			n = len(buf)/dtype.itemsize
+			if n == 0:
+				break
+			count -= n
+			if name == 'vertex':
+				X = np.frombuffer(buf, dtype = dtype, count = n)
+				yield ('vertices', np.array([X['x'], X['y'], X['z']], dtype = np.float64).T)
+
+#Faces in binary PLY files have a variable record size.  Every chunk is read
+#assuming all of its faces have the same number of vertices as the first one,
+#and the file is rewound to the first face where that assumption fails
+def streamPlyBinaryFaces(fin, count, props, byteOrder, chunkSize):
+	listIdx = getPlyFaceListIndex(props)
+	if listIdx == -1 or len([p for p in props if len(p) == 3]) > 1:
+		sys.stderr.write("Error: Expecting exactly one vertex index list property on PLY faces\n")
+		return
+	before = [(p[0], byteOrder + p[1]) for p in props[0:listIdx]]
+	after = [(p[0], byteOrder + p[1]) for p in props[listIdx+1:]]
+	(countType, itemType) = (byteOrder + props[listIdx][1], byteOrder + props[listIdx][2])
+	peekType = np.dtype(before + [('n', countType)])
+	while count > 0:
+		pos = fin.tell()
+		buf = fin.read(peekType.itemsize)
+		if len(buf) < peekType.itemsize:
+			break
+		K = int(np.frombuffer(buf, dtype = peekType)['n'][0])
+		fin.seek(pos)
+		fields = before + [('n', countType)]
+		if K > 0:
+			fields.append(('v', itemType, (K,)))
+		dtype = np.dtype(fields + after)
+		buf = fin.read(min(count, chunkSize)*dtype.itemsize)
+		n = len(buf)/dtype.itemsize
+		if n == 0:
+			break
+		F = np.frombuffer(buf, dtype = dtype, count = n)
+		bad = np.nonzero(F['n'] != K)[0]
+		if len(bad) > 0:
+			n = bad[0]
+			F = F[0:n]
+		fin.seek(pos + n*dtype.itemsize)
+		count -= n
+		if K > 0:
+			faceVerts = F['v'].reshape((-1,)).astype(np.int64)
+		else:
+			faceVerts = np.zeros(0, dtype = np.int64)
+		yield ('faces', (faceVerts, K*np.ones(n, dtype = np.int64)))
+
+def streamMeshFile(filename, chunkSize = STREAM_CHUNKSIZE):
+	suffix = re.split("\.", filename)[-1]
+	if suffix == "off":
+		return streamOffFile(filename, chunkSize)
+	elif suffix == "ply":
+		return streamPlyFile(filename, chunkSize)
+	print "Unsupported file suffix (%s) for streaming mesh %s"%(suffix, filename)
+	return None
+
+#############################################################
+####                  STREAMING STATISTICS              #####
+#############################################################
+
+class MeshFileStats(object):
+	def __init__(self):
+		self.NVertices = 0
+		self.NFaces = 0
+		self.bbox = BBox3D(0, 0, 0, 0, 0, 0)
+		self.centroid = None #Mean of the vertices (PolyMesh.getCentroid())
+		self.scatter = np.zeros((3, 3)) #Sum of (P - centroid)(P - centroid)^T over the vertices
+		self.principalAxes = None #Same tuple as PolyMesh.getPrincipalAxes()
+		self.area = 0.0 #Total surface area
+		self.areaWeightedCentroid = None #PolyMesh.getAreaWeightedCentroid()
+
+	def __str__(self):
+		return "MeshFileStats: NVertices = %i, NFaces = %i, centroid = %s, area = %g, bbox = %s"%(self.NVertices, self.NFaces, self.centroid, self.area, self.bbox)
+
+#Compute the bounding box, centroid, principal axes and area weighted centroid
+#of an OFF or PLY file without loading it into memory.  The vertex positions
+#are spilled to a temporary memory mapped file in tmpDir, which is what the
+#faces index into and what the second pass over the principal axes reads.
+#Raises ValueError if the file doesn't start with a valid OFF or PLY header
+def getMeshFileStats(filename, chunkSize = STREAM_CHUNKSIZE, tmpDir = None):
+	chunks = streamMeshFile(filename, chunkSize)
+	if not chunks:
+		return None
+	stats = MeshFileStats()
+	(kind, (NVertices, NFaces)) = next(chunks)
+	(fd, tmpPath) = tempfile.mkstemp(suffix = '.dat', dir = tmpDir)
+	os.close(fd)
+	X = np.memmap(tmpPath, dtype = np.float64, mode = 'w+', shape = (max(NVertices, 1), 3))
+	try:
+		N = 0
+		mean = np.zeros(3)
+		scatter = np.zeros((3, 3))
+		[bmin, bmax] = [np.inf*np.ones(3), -np.inf*np.ones(3)]
+		area = 0.0
+		areaSum = np.zeros(3)
+		for (kind, data) in chunks:
+			if kind == 'vertices':
+				n = data.shape[0]
+				if n == 0:
+					continue
+				X[N:N+n] = data
+				bmin = np.minimum(bmin, data.min(0))
+				bmax = np.maximum(bmax, data.max(0))
+				#Merge the moments of this chunk into the running moments
+				#(Chan et al.'s pairwise update, which avoids the cancellation
+				#of accumulating raw second moments)
+				chunkMean = data.mean(0)
+				D = data - chunkMean
+				delta = chunkMean - mean
+				scatter += D.T.dot(D) + np.outer(delta, delta)*(float(N)*n/(N+n))
+				mean += delta*(float(n)/(N+n))
+				N += n
+			elif kind == 'faces':
+				(a, S) = getAreaWeightedSums(X, data[0], data[1])
+				area += a
+				areaSum += S
+				stats.NFaces += len(data[1])
+		stats.NVertices = N
+		if N == 0:
+			return stats
+		stats.bbox = BBox3D(bmin[0], bmax[0], bmin[1], bmax[1], bmin[2], bmax[2])
+		stats.centroid = Point3D(mean[0], mean[1], mean[2])
+		stats.scatter = scatter
+		stats.area = area
+		stats.areaWeightedCentroid = stats.centroid
+		if area > 0:
+			C = areaSum/area
+			stats.areaWeightedCentroid = Point3D(C[0], C[1], C[2])
+		#Second pass over the spilled positions for the extent along each axis
+		axes = getPrincipalAxesFromScatter(scatter)
+		[maxProj, minProj] = [-np.inf*np.ones(3), np.inf*np.ones(3)]
+		for i in range(0, N, chunkSize):
+			T = (X[i:i+chunkSize] - mean).dot(axes)
+			maxProj = np.maximum(maxProj, T.max(0))
+			minProj = np.minimum(minProj, T.min(0))
+		Axis1 = Vector3D(axes[0, 0], axes[1, 0], axes[2, 0])
+		Axis2 = Vector3D(axes[0, 1], axes[1, 1], axes[2, 1])
+		Axis3 = Vector3D(axes[0, 2], axes[1, 2], axes[2, 2])
+		stats.principalAxes = (Axis1, Axis2, Axis3, maxProj, minProj, axes)
+	finally:
+		del X
+		os.remove(tmpPath)
+	return stats
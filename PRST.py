@@ -47,11 +47,9 @@ def PRST(mesh, NR = 64, NTheta = 64, NPhi = 64, MaxIter = 100000):
 	#Center the mesh so that the binning will be more uniform
 	centroid = mesh.getCentroid()
 	#Copy over the points and work with them
-	NPoints = len(mesh.vertices)
-	Points = np.zeros((NPoints, 3))
-	for i in range(NPoints):
-		pos = mesh.vertices[i].pos
-		Points[i, 0:3] = [pos.x - centroid.x, pos.y - centroid.y, pos.z - centroid.z]
+	VPos = mesh.getVertexPositions()
+	NPoints = VPos.shape[0]
+	Points = VPos - np.array([centroid.x, centroid.y, centroid.z])
 	#Setup the grid and index into it later based on the extent
 	#of R, theta, and Phi
 	RExtent = mesh.getBBox().getDiagLength()
@@ -117,5 +115,6 @@ def PRST(mesh, NR = 64, NTheta = 64, NPhi = 64, MaxIter = 100000):
 	maxPairs = pairs[(RIdx, ThetaIdx, PhiIdx)]
 	for i in range(len(maxPairs)):
 		for j in [0, 1]:
-			maxPairs[i][j] = mesh.vertices[maxPairs[i][j]].pos
+			P = VPos[maxPairs[i][j]].flatten()
+			maxPairs[i][j] = Point3D(P[0], P[1], P[2])
 	return (Plane3D(P0, N), maxPairs)
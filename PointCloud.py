@@ -1,6 +1,5 @@
 from Primitives3D import *
 from Shapes3D import *
-from OpenGL.GL import *
 from Graphics3D import *
 import numpy as np
 import numpy.linalg as linalg
@@ -59,6 +58,7 @@ class PointCloud(object):
 		self.needsDisplayUpdate = True
 	
 	def renderGL(self):
+		from OpenGL.GL import glBegin, glCallList, glColor3f, glDeleteLists, glDisable, glEnable, glEnd, glEndList, glGenLists, glNewList, glPointSize, glVertex3f, GL_COMPILE, GL_LIGHTING, GL_POINTS
 		if self.needsDisplayUpdate:
 			if self.DisplayList != -1: #Deallocate previous display list
 				glDeleteLists(self.DisplayList, 1)
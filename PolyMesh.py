@@ -1,34 +1,120 @@
 from Primitives3D import *
 from Shapes3D import *
-from OpenGL.GL import *
-from OpenGL.arrays import vbo
 from Graphics3D import *
+from Cameras3D import getRayThroughPixel, projectToPixels
+from BVH3D import *
 import sys
+import os
 import re
+import gc
+import threading
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import numpy.linalg as linalg
-try:
-    from PIL.Image import open as imgopen
-except ImportError, err:
-    from Image import open as imgopen
 
 
-def loadTexture(filename):
+#############################################################
+####                    TEXTURE CACHE                   #####
+#############################################################
+
+#Decoded textures shared by every mesh in the process, keyed by
+#(absolute path, modification time) so that meshes which reference the
+#same image only decode it once (and upload it to GL once per context)
+TEXTURE_CACHE = {}
+TEXTURE_CACHE_LOCK = threading.Lock()
+
+#Decode an image file into an (height x width x 4) RGBA uint8 array, with
+#the rows ordered bottom to top the way glTexImage2D expects them
+def decodeTexture(filename):
+	try:
+		from PIL.Image import open as imgopen
+	except ImportError, err:
+		from Image import open as imgopen
 	im = imgopen(filename)
+	im = im.convert('RGBA')
+	pixels = np.asarray(im, dtype = np.uint8)
+	return np.ascontiguousarray(pixels[::-1, :, 0:4])
+
+class TextureImage(object):
+	def __init__(self, filename, background = False):
+		self.filename = filename
+		self.pixels = None
+		self.error = None #Exception from decoding, raised again by getPixels()
+		#GL textures by GL context, created the first time it's drawn in each
+		#one (texture names aren't shared between contexts)
+		self.texIDs = {}
+		self.thread = None
+		if background:
+			self.thread = threading.Thread(target = self.decode)
+			self.thread.daemon = True
+			self.thread.start()
+		else:
+			self.decode()
+	
+	#Decode the pixels, holding on to any exception so that it gets raised
+	#in the thread that asks for them instead of being lost in the background
+	def decode(self):
+		try:
+			self.pixels = decodeTexture(self.filename)
+		except Exception, err:
+			self.error = (err, sys.exc_info()[2])
+	
+	#Return the decoded pixels, waiting for the background decode if
+	#necessary, and raising the exception if it failed
+	def getPixels(self):
+		if self.thread:
+			self.thread.join()
+			self.thread = None
+		if self.error:
+			(err, tb) = self.error
+			raise err, None, tb
+		return self.pixels
+	
+	#Return the GL texture for the current GL context, uploading the pixels
+	#first if this is the first time it's used in that context.  This needs
+	#a valid GL context
+	def getTexID(self):
+		from OpenGL.GL import glBindTexture, glGenTextures, glPixelStorei, glTexImage2D, glTexParameteri, GL_LINEAR, GL_RGBA, GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, GL_UNPACK_ALIGNMENT, GL_UNSIGNED_BYTE
+		from OpenGL.contextdata import getContext
+		context = getContext()
+		if not context in self.texIDs:
+			pixels = self.getPixels()
+			[iy, ix] = pixels.shape[0:2]
+			texID = glGenTextures(1)
+			glBindTexture(GL_TEXTURE_2D, texID)
+			glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+			glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+			glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+			glTexImage2D(GL_TEXTURE_2D, 0, 3, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels.tobytes())
+			self.texIDs[context] = texID
+		return self.texIDs[context]
+	
+	#Only the filename is pickled; unpickling goes back through the cache
+	def __reduce__(self):
+		return (getTexture, (self.filename,))
+
+#Return the TextureImage for "filename" from the cache, decoding it if it
+#isn't there or if the file has changed since it was decoded.  If background
+#is True, the image is decoded in a separate thread and only waited on when
+#the pixels are needed
+def getTexture(filename, background = False):
+	path = os.path.abspath(filename)
+	key = (path, os.path.getmtime(path))
+	TEXTURE_CACHE_LOCK.acquire()
 	try:
-		im = im.convert('RGB')
-		ix, iy, image = im.size[0], im.size[1], im.tostring("raw", "RGBA", 0, -1)
-	except SystemError:
-		ix, iy, image = im.size[0], im.size[1], im.tostring("raw", "RGBX", 0, -1)
-	assert ix*iy*4 == len(image), """Unpacked image size for texture is incorrect"""
-	
-	texID = glGenTextures(1)
-	glBindTexture(GL_TEXTURE_2D, texID)
-	glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
-	glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-	glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-	glTexImage2D(GL_TEXTURE_2D, 0, 3, ix, iy, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
-	return texID
+		if not key in TEXTURE_CACHE:
+			for oldKey in [k for k in TEXTURE_CACHE if k[0] == path]:
+				del TEXTURE_CACHE[oldKey]
+			TEXTURE_CACHE[key] = TextureImage(path, background)
+		return TEXTURE_CACHE[key]
+	finally:
+		TEXTURE_CACHE_LOCK.release()
+
+#Decode (through the cache) and upload a texture right away, returning
+#the GL texture ID
+def loadTexture(filename):
+	return getTexture(filename).getTexID()
 
 #Used to help sort edges in CCW order
 class EdgesCCWComparator(object):
@@ -113,12 +199,21 @@ class MeshFace(object):
 		self.area = None
 		self.normal = None
 		self.centroid = None
+		#Optional per-corner attributes, in the same order as getVertices()
+		#(None means fall back to the attributes stored on the vertices)
+		self.cornerTexCoords = None
+		self.cornerNormals = None
 
 	def flipNormal(self):
 		#Reverse the specification of the edges to make the normal
 		#point in the opposite direction
 		self.edges.reverse()
 		self.normal = None
+		#The start vertex stays put and the rest of the corners reverse
+		if self.cornerTexCoords:
+			self.cornerTexCoords = self.cornerTexCoords[0:1] + self.cornerTexCoords[:0:-1]
+		if self.cornerNormals:
+			self.cornerNormals = self.cornerNormals[0:1] + self.cornerNormals[:0:-1]
 
 	#Return a list of vertices on the face in CCW order
 	def getVertices(self):
@@ -153,7 +248,11 @@ class MeshFace(object):
 			self.centroid = ret
 		return self.centroid
 
-	def drawFilled(self, drawNormal = True, doLighting = True, useTexture = True):
+	#vertexNormals: Optional list of [x, y, z] vertex normals indexed by vertex
+	#ID (e.g. from PolyMesh.getVertexNormals()), so that they don't have to be
+	#recomputed at every corner
+	def drawFilled(self, drawNormal = True, doLighting = True, useTexture = True, vertexNormals = None):
+		from OpenGL.GL import glBegin, glColor3f, glColorMaterial, glEnable, glEnd, glNormal3f, glTexCoord2f, glVertex3f, GL_AMBIENT_AND_DIFFUSE, GL_COLOR_MATERIAL, GL_FRONT_AND_BACK, GL_POLYGON
 		if doLighting:
 			if drawNormal:
 				normal = self.getNormal()
@@ -166,18 +265,30 @@ class MeshFace(object):
 				glEnable(GL_COLOR_MATERIAL)
 			var = 1
 		glBegin(GL_POLYGON)
-		for v in verts:
+		for i in range(len(verts)):
+			v = verts[i]
 			P = v.pos
 			if useTexture:
-				glTexCoord2f(v.texCoords[0], v.texCoords[1])
+				T = v.texCoords
+				if self.cornerTexCoords:
+					T = self.cornerTexCoords[i]
+				glTexCoord2f(T[0], T[1])
 			elif v.color:
 				glColor3f(v.color[0], v.color[1], v.color[2])
-			N = v.getNormal()
-			glNormal3f(N.x, N.y, N.z)
+			if self.cornerNormals:
+				N = self.cornerNormals[i]
+				glNormal3f(N.x, N.y, N.z)
+			elif vertexNormals:
+				N = vertexNormals[v.ID]
+				glNormal3f(N[0], N[1], N[2])
+			else:
+				N = v.getNormal()
+				glNormal3f(N.x, N.y, N.z)
 			glVertex3f(P.x, P.y, P.z)
 		glEnd()
 	
 	def drawBorder(self):
+		from OpenGL.GL import glBegin, glEnd, glLineWidth, glVertex3f, GL_LINES
 		glLineWidth(3)
 		glBegin(GL_LINES)
 		for e in self.edges:
@@ -271,17 +382,611 @@ def getVertexInCommon(e1, e2):
 				return v[i]
 	return None
 
+#Cluster the rows of the Nx3 array X that are within "tol" of each other
+#Uses a hashed voxel grid with cells of side length tol so that each point
+#only has to be checked against the representatives in the 27 cells around
+#it, which makes this O(N) expected time.  If tol is 0, only exactly
+#coincident points are merged
+#Returns (reps, remap), where reps are the indices of the points that were
+#kept as cluster representatives and remap[i] is the index into reps of
+#the cluster that point i was merged into
+def getWeldIndices(X, tol = 0.0):
+	X = np.asarray(X, dtype = np.float64)
+	N = X.shape[0]
+	reps = []
+	remap = np.zeros(N, dtype = np.int64)
+	grid = {}
+	if tol <= 0:
+		for i, key in enumerate(map(tuple, X.tolist())):
+			if key in grid:
+				remap[i] = grid[key]
+			else:
+				grid[key] = len(reps)
+				remap[i] = len(reps)
+				reps.append(i)
+		return (np.array(reps, dtype = np.int64), remap)
+	tolSqr = tol*tol
+	cells = np.floor(X/tol).astype(np.int64).tolist()
+	Xl = X.tolist()
+	offsets = [(dx, dy, dz) for dx in [-1, 0, 1] for dy in [-1, 0, 1] for dz in [-1, 0, 1]]
+	for i in range(N):
+		[x, y, z] = Xl[i]
+		[cx, cy, cz] = cells[i]
+		found = -1
+		for (dx, dy, dz) in offsets:
+			for r in grid.get((cx+dx, cy+dy, cz+dz), []):
+				P = Xl[reps[r]]
+				if (P[0]-x)**2 + (P[1]-y)**2 + (P[2]-z)**2 <= tolSqr:
+					found = r
+					break
+			if found > -1:
+				break
+		if found == -1:
+			found = len(reps)
+			reps.append(i)
+			grid.setdefault((cx, cy, cz), []).append(found)
+		remap[i] = found
+	return (np.array(reps, dtype = np.int64), remap)
+
+#Feed the shape and the raw bytes of array A (converted to dtype, so the
+#hash doesn't depend on the platform) into the hashlib object h.  None
+#is hashed as a marker distinct from any array
+def updateArrayHash(h, A, dtype):
+	if A is None:
+		h.update('None;')
+		return
+	A = np.ascontiguousarray(A, dtype = dtype)
+	h.update('%s%s;'%(A.dtype.str, A.shape))
+	h.update(A.data)
+
+#Return the eigenvectors of the 3x3 scatter matrix XTX of a point set as
+#the columns of a matrix, in decreasing order of their eigenvalues
+#The sign of each eigenvector is arbitrary, so pick the one whose largest
+#component is positive.  That way scatter matrices that only differ by
+#roundoff (e.g. the in-memory and streamed ones) give the same axes
+def getPrincipalAxesFromScatter(XTX):
+	(lambdas, axes) = linalg.eig(XTX)
+	#Put the eigenvalues in decreasing order
+	idx = lambdas.argsort()[::-1]
+	axes = axes[:, idx]
+	signs = np.sign(axes[np.abs(axes).argmax(0), np.arange(3)])
+	signs[signs == 0] = 1
+	return axes*signs
+
+#Triangulate each face as a fan around its first vertex
+#faceVerts, faceCounts: Faces in the format of PolyMesh.getFaceIndices()
+#Returns (tris, face): an Mx3 array of vertex indices of the triangles,
+#and the index of the face that each triangle came from
+def getFanTriangles(faceVerts, faceCounts):
+	faceVerts = np.asarray(faceVerts, dtype = np.int64)
+	faceCounts = np.asarray(faceCounts, dtype = np.int64)
+	starts = np.cumsum(faceCounts) - faceCounts
+	NTris = np.maximum(faceCounts - 2, 0)
+	#Index of each triangle's face and of the triangle within that face
+	face = np.repeat(np.arange(len(faceCounts)), NTris)
+	j = np.arange(face.size) - np.repeat(np.cumsum(NTris) - NTris, NTris) + 1
+	tris = np.zeros((face.size, 3), dtype = np.int64)
+	tris[:, 0] = faceVerts[starts[face]]
+	tris[:, 1] = faceVerts[starts[face] + j]
+	tris[:, 2] = faceVerts[starts[face] + j + 1]
+	return (tris, face)
+
+#Return an Fx3 array of unit face normals, picked the same way as
+#getFaceNormal() in Primitives3D: the normal of the first triangle in the
+#face's fan that isn't degenerate.  Rows of faces with no such triangle are 0
+#X: Nx3 vertex positions
+#faceVerts, faceCounts: Faces in the format of PolyMesh.getFaceIndices()
+def getFaceNormalArrays(X, faceVerts, faceCounts):
+	X = np.asarray(X, dtype = np.float64).reshape((-1, 3))
+	NFaces = len(faceCounts)
+	(tris, face) = getFanTriangles(faceVerts, faceCounts)
+	normals = np.zeros((NFaces, 3))
+	if tris.shape[0] == 0:
+		return normals
+	V1 = X[tris[:, 1]] - X[tris[:, 0]]
+	V2 = X[tris[:, 2]] - X[tris[:, 0]]
+	N = np.cross(V1, V2)
+	NL = np.sqrt(np.sum(N**2, 1))
+	VL = np.sqrt(np.sum(V1**2, 1))*np.sqrt(np.sum(V2**2, 1))
+	valid = (VL > 0) & (NL > 1e-10*VL)
+	#First valid triangle of each face
+	first = np.zeros(NFaces, dtype = np.int64) + tris.shape[0]
+	idx = np.arange(tris.shape[0])[valid]
+	np.minimum.at(first, face[valid], idx)
+	found = first < tris.shape[0]
+	normals[found] = N[first[found]]/NL[first[found], None]
+	return normals
+
+#Return (total area, sum of triangle centroids weighted by triangle area)
+#over the fan triangulation of the faces
+#X: Nx3 vertex positions (anything that numpy can index, e.g. a memmap)
+#faceVerts, faceCounts: Faces in the format of PolyMesh.getFaceIndices()
+def getAreaWeightedSums(X, faceVerts, faceCounts):
+	(tris, face) = getFanTriangles(faceVerts, faceCounts)
+	if tris.shape[0] == 0:
+		return (0.0, np.zeros(3))
+	A = np.asarray(X[tris[:, 0]])
+	B = np.asarray(X[tris[:, 1]])
+	C = np.asarray(X[tris[:, 2]])
+	areas = 0.5*np.sqrt(np.sum(np.cross(B - A, C - A)**2, 1))
+	centroids = (A + B + C)/3.0
+	return (areas.sum(), areas.dot(centroids))
+
+#Compute per-vertex differential geometry with vectorized passes over the
+#fan triangulation of the faces
+#X: Nx3 vertex positions
+#faceVerts, faceCounts: Faces in the format of PolyMesh.getFaceIndices()
+#Returns a dictionary with the arrays
+#'normals': Nx3 area weighted average of the attached face normals
+#(same as MeshVertex.getNormal())
+#'oneRingAreas': Total area of the attached faces (MeshVertex.getOneRingArea())
+#'voronoiAreas': Mixed Voronoi areas from Meyer et al. "Discrete
+#Differential-Geometry Operators for Triangulated 2-Manifolds" (2003)
+#'meanCurvature': Mean curvature from the cotangent Laplacian, positive
+#where the surface curves away from the normals (e.g. outside of a sphere)
+#'gaussCurvature': Gaussian curvature from the angle deficit
+def getVertexGeometryArrays(X, faceVerts, faceCounts):
+	X = np.asarray(X, dtype = np.float64).reshape((-1, 3))
+	N = X.shape[0]
+	faceVerts = np.asarray(faceVerts, dtype = np.int64)
+	faceCounts = np.asarray(faceCounts, dtype = np.int64)
+	(tris, face) = getFanTriangles(faceVerts, faceCounts)
+	P = [X[tris[:, k]] for k in range(3)]
+	#Cross products of the fan triangles sum up to twice the vector area of each face
+	crosses = np.cross(P[1] - P[0], P[2] - P[0])
+	faceVecAreas = np.zeros((len(faceCounts), 3))
+	for k in range(3):
+		faceVecAreas[:, k] = 0.5*np.bincount(face, crosses[:, k], len(faceCounts))
+	faceAreas = np.sqrt(np.sum(faceVecAreas**2, 1))
+	cornerFace = np.repeat(np.arange(len(faceCounts)), faceCounts)
+	oneRingAreas = np.bincount(faceVerts, faceAreas[cornerFace], N)
+	normals = np.zeros((N, 3))
+	for k in range(3):
+		normals[:, k] = np.bincount(faceVerts, faceVecAreas[cornerFace, k], N)
+	normals = normals/np.maximum(oneRingAreas, 1e-300)[:, None]
+	#Angles, cotangents and opposite edges at each corner k of each triangle
+	triAreas = 0.5*np.sqrt(np.sum(crosses**2, 1))
+	voronoiAreas = np.zeros(N)
+	angleSums = np.zeros(N)
+	laplacian = np.zeros((N, 3))
+	cots = []
+	angles = []
+	for k in range(3):
+		e1 = P[(k+1)%3] - P[k]
+		e2 = P[(k+2)%3] - P[k]
+		dot = np.sum(e1*e2, 1)
+		cots.append(dot/np.maximum(2*triAreas, 1e-300))
+		angles.append(np.arctan2(2*triAreas, dot))
+	obtuse = np.array(angles).max(0) > np.pi/2
+	for k in range(3):
+		[i, j, l] = [tris[:, k], tris[:, (k+1)%3], tris[:, (k+2)%3]]
+		angleSums += np.bincount(i, angles[k], N)
+		#Edge (j, l) is across from corner k
+		D = cots[k][:, None]*(X[j] - X[l])
+		for c in range(3):
+			laplacian[:, c] += np.bincount(j, D[:, c], N) - np.bincount(l, D[:, c], N)
+		#Voronoi area of corner k, which is made up of the halves of the edges
+		#(k, j) and (k, l) weighted by the cotangents of the angles across them
+		A = (np.sum((X[i] - X[j])**2, 1)*cots[(k+2)%3] + np.sum((X[i] - X[l])**2, 1)*cots[(k+1)%3])/8.0
+		A[obtuse] = triAreas[obtuse]/4.0
+		A[angles[k] > np.pi/2] = triAreas[angles[k] > np.pi/2]/2.0
+		voronoiAreas += np.bincount(i, A, N)
+	safeAreas = np.maximum(voronoiAreas, 1e-300)
+	K = laplacian/(2*safeAreas[:, None])
+	meanCurvature = 0.5*np.sqrt(np.sum(K**2, 1))*np.sign(np.sum(K*normals, 1))
+	#Boundary vertices (on an edge with only one face) only have a deficit of pi
+	starts = np.cumsum(faceCounts) - faceCounts
+	nextCorner = np.arange(len(faceVerts)) + 1
+	wrap = nextCorner == np.repeat(starts + faceCounts, faceCounts)
+	nextCorner[wrap] = np.repeat(starts, faceCounts)[wrap]
+	[a, b] = [faceVerts, faceVerts[nextCorner]]
+	keys = np.minimum(a, b)*N + np.maximum(a, b)
+	(uniqueKeys, counts) = np.unique(keys, return_counts = True)
+	boundaryKeys = uniqueKeys[counts == 1]
+	isBoundary = np.zeros(N, dtype = bool)
+	isBoundary[boundaryKeys//N] = True
+	isBoundary[boundaryKeys%N] = True
+	deficit = 2*np.pi - angleSums
+	deficit[isBoundary] = np.pi - angleSums[isBoundary]
+	gaussCurvature = deficit/safeAreas
+	return {'normals':normals, 'oneRingAreas':oneRingAreas, 'voronoiAreas':voronoiAreas, 'meanCurvature':meanCurvature, 'gaussCurvature':gaussCurvature}
+
+#############################################################
+####                   VBO ARRAYS                       #####
+#############################################################
+
+#Layout of the interleaved vertex buffer drawn by PolyMesh.renderGL: each
+#buffer vertex is VBO_STRIDE float32s, with the position, normal, color and
+#texture coordinates starting at the following offsets
+VBO_POSITION = 0
+VBO_NORMAL = 3
+VBO_COLOR = 6
+VBO_TEXCOORD = 9
+VBO_STRIDE = 11
+
+#Build the arrays behind the vertex buffer objects that PolyMesh.renderGL
+#draws the faces with.  Plain numpy, so this doesn't need a GL context
+#X: Nx3 vertex positions
+#faceVerts, faceCounts: Faces in the format of PolyMesh.getFaceIndices()
+#normals: Nx3 vertex normals
+#colors: Optional Nx3 vertex colors (if None, the faces are drawn gray)
+#texCoords: Optional Nx2 vertex texture coordinates
+#cornerAttribs: Optional face index => (cornerTexCoords, cornerNormals) (see
+#PolyMesh.getFlatArrays()).  The corners of these faces get buffer vertices
+#of their own after the N mesh vertices
+#Returns a dictionary with
+#'vertices': Mx(VBO_STRIDE) float32 interleaved vertex buffer
+#'indices': uint32 buffer vertex indices of the fan triangles of the faces
+#'source': Mesh vertex that each buffer vertex comes from
+#'normalRows', 'normalValues': Buffer vertices that take their normal from
+#cornerNormals instead of the vertex normals, and those normals
+#'hasColors': Whether the buffer holds real vertex colors
+#'numVertices': N
+def getVBOArrays(X, faceVerts, faceCounts, normals, colors = None, texCoords = None, cornerAttribs = None):
+	X = np.asarray(X, dtype = np.float64).reshape((-1, 3))
+	N = X.shape[0]
+	faceVerts = np.asarray(faceVerts, dtype = np.int64)
+	faceCounts = np.asarray(faceCounts, dtype = np.int64)
+	#Buffer vertex at every face corner
+	corners = faceVerts.copy()
+	source = [np.arange(N)]
+	texRows = []
+	texValues = []
+	normalRows = []
+	normalValues = []
+	if cornerAttribs:
+		starts = (np.cumsum(faceCounts) - faceCounts).tolist()
+		counts = faceCounts.tolist()
+		nextRow = N
+		for i in sorted(cornerAttribs):
+			(cornerTexCoords, cornerNormals) = cornerAttribs[i]
+			if not (cornerTexCoords or cornerNormals):
+				continue
+			[s, c] = [starts[i], counts[i]]
+			rows = range(nextRow, nextRow + c)
+			source.append(faceVerts[s:s+c])
+			corners[s:s+c] = rows
+			if cornerTexCoords:
+				texRows += rows
+				texValues += [T[0:2] for T in cornerTexCoords]
+			if cornerNormals:
+				normalRows += rows
+				normalValues += [[V.x, V.y, V.z] for V in cornerNormals]
+			nextRow += c
+	source = np.concatenate(source)
+	vertices = np.zeros((len(source), VBO_STRIDE), dtype = np.float32)
+	if colors is not None:
+		vertices[:, VBO_COLOR:VBO_COLOR+3] = np.asarray(colors)[source, 0:3]
+	else:
+		vertices[:, VBO_COLOR:VBO_COLOR+3] = 0.5
+	if texCoords is not None:
+		vertices[:, VBO_TEXCOORD:VBO_TEXCOORD+2] = np.asarray(texCoords)[source, 0:2]
+	if len(texRows) > 0:
+		vertices[texRows, VBO_TEXCOORD:VBO_TEXCOORD+2] = texValues
+	normalRows = np.array(normalRows, dtype = np.int64)
+	normalValues = np.array(normalValues, dtype = np.float64).reshape((-1, 3))
+	fillVBOPositions(vertices, X, normals, source, normalRows, normalValues)
+	indices = getFanTriangles(corners, faceCounts)[0].astype(np.uint32).flatten()
+	return {'vertices':vertices, 'indices':indices, 'source':source, 'normalRows':normalRows, 'normalValues':normalValues, 'hasColors':colors is not None, 'numVertices':N}
+
+#Write new vertex positions and normals into the interleaved buffer
+#"vertices" from getVBOArrays() in place, leaving the colors and texture
+#coordinates alone (this is all that changes when a mesh only moves)
+def fillVBOPositions(vertices, X, normals, source, normalRows = None, normalValues = None):
+	vertices[:, VBO_POSITION:VBO_POSITION+3] = np.asarray(X)[source]
+	vertices[:, VBO_NORMAL:VBO_NORMAL+3] = np.asarray(normals)[source]
+	if normalRows is not None and len(normalRows) > 0:
+		vertices[normalRows, VBO_NORMAL:VBO_NORMAL+3] = normalValues
+
+#############################################################
+####                  BULK OBJ PARSING                  #####
+#############################################################
+
+OBJ_CHUNKSIZE = 1 << 24 #Number of bytes to tokenize at a time
+OBJ_V_RE = re.compile(r"^[ \t]*v[ \t]+([^\n]*)", re.M)
+OBJ_VT_RE = re.compile(r"^[ \t]*vt[ \t]+([^\n]*)", re.M)
+OBJ_VN_RE = re.compile(r"^[ \t]*vn[ \t]+([^\n]*)", re.M)
+OBJ_F_RE = re.compile(r"^[ \t]*f[ \t]+([^\n]*)", re.M)
+
+#Parse the numbers on a list of lines into an array with at least
+#"minCols" columns, doing all of the float conversion in one call
+#when every line has the same number of fields
+def parseObjFloatLines(lines, minCols):
+	if len(lines) == 0:
+		return np.zeros((0, minCols))
+	nCols = len(lines[0].split())
+	X = np.fromstring(" ".join(lines), dtype = np.float64, sep = " ")
+	if X.size == nCols*len(lines) and nCols >= minCols:
+		return X.reshape((len(lines), nCols))
+	#Ragged lines; fall back to parsing them one at a time
+	rows = [[float(x) for x in l.split()[0:minCols]] for l in lines]
+	return np.array([r + [0.0]*(minCols - len(r)) for r in rows])
+
+#Parse the corner tokens of a list of face lines into a (NCorners x 3)
+#integer array of (v, vt, vn) OBJ indices (0 where an index is missing)
+#along with the number of corners on each face
+def parseObjFaceLines(lines):
+	counts = np.array([len(l.split()) for l in lines], dtype = np.int64)
+	NCorners = int(counts.sum())
+	tokens = " ".join(lines)
+	if NCorners == 0:
+		return (np.zeros((0, 3), dtype = np.int64), counts)
+	#Assume every corner has the same layout as the first one
+	#(v, v/vt, v//vn or v/vt/vn) and check that assumption below
+	first = tokens.split(None, 1)[0]
+	nFields = first.count("/") + 1
+	tokens = tokens.replace("//", "/0/")
+	I = np.fromstring(tokens.replace("/", " "), dtype = np.int64, sep = " ")
+	ret = np.zeros((NCorners, 3), dtype = np.int64)
+	if tokens.count("/") == (nFields-1)*NCorners and I.size == nFields*NCorners:
+		ret[:, 0:nFields] = I.reshape((NCorners, nFields))
+		return (ret, counts)
+	#Mixed corner layouts; fall back to parsing each corner separately
+	k = 0
+	for tok in tokens.split():
+		fields = tok.split("/")
+		for i in range(min(3, len(fields))):
+			if len(fields[i]) > 0:
+				ret[k, i] = int(fields[i])
+		k = k+1
+	return (ret, counts)
+
+#Resolve 1-based (and negative, relative) OBJ indices into 0-based
+#indices, with -1 for missing indices
+#nBefore is the number of elements that had been defined before each corner
+def resolveObjIndices(I, nBefore):
+	return np.where(I < 0, I + nBefore, I - 1)
+
+#Read an OBJ file in large chunks and return its contents as arrays
+#Returns a dictionary with the keys
+#V: Nx3 positions, VC: Nx3 colors (or None), VT: Tx2 texture coordinates,
+#VN: Mx3 normals, FV, FT, FN: Per-corner 0-based position, texture coordinate
+#and normal indices (-1 if missing), FCounts: number of corners on each face
+def loadObjArrays(filename, chunkSize = OBJ_CHUNKSIZE):
+	(V, VT, VN, FI, FCounts) = ([], [], [], [], [])
+	(nV, nVT, nVN) = (0, 0, 0)
+	fin = open(filename, 'r')
+	leftover = ""
+	finished = False
+	while not finished:
+		chunk = fin.read(chunkSize)
+		if len(chunk) == 0:
+			finished = True
+			text = leftover
+		else:
+			#Only tokenize up to the last complete line in this chunk
+			text = leftover + chunk
+			cut = text.rfind("\n") + 1
+			leftover = text[cut:]
+			text = text[0:cut]
+		vLines = OBJ_V_RE.findall(text)
+		vtLines = OBJ_VT_RE.findall(text)
+		vnLines = OBJ_VN_RE.findall(text)
+		fLines = OBJ_F_RE.findall(text)
+		if len(vLines) > 0:
+			V.append(parseObjFloatLines(vLines, 3))
+		if len(vtLines) > 0:
+			VT.append(parseObjFloatLines(vtLines, 2)[:, 0:2])
+		if len(vnLines) > 0:
+			VN.append(parseObjFloatLines(vnLines, 3)[:, 0:3])
+		if len(fLines) > 0:
+			(I, counts) = parseObjFaceLines(fLines)
+			nBefore = np.array([[nV + len(vLines), nVT + len(vtLines), nVN + len(vnLines)]])
+			if (I < 0).any():
+				#Negative indices are relative to the elements that were defined
+				#before the face, so figure out where each face is in the chunk
+				fStarts = [m.start() for m in OBJ_F_RE.finditer(text)]
+				nBefore = np.zeros((len(fLines), 3), dtype = np.int64)
+				for k, regex in enumerate([OBJ_V_RE, OBJ_VT_RE, OBJ_VN_RE]):
+					starts = [m.start() for m in regex.finditer(text)]
+					nBefore[:, k] = [nV, nVT, nVN][k] + np.searchsorted(starts, fStarts)
+				nBefore = np.repeat(nBefore, counts, axis = 0)
+			FI.append(resolveObjIndices(I, nBefore))
+			FCounts.append(counts)
+		nV = nV + len(vLines)
+		nVT = nVT + len(vtLines)
+		nVN = nVN + len(vnLines)
+	fin.close()
+	ret = {}
+	V = np.concatenate(V, 0) if len(V) > 0 else np.zeros((0, 3))
+	ret['V'] = V[:, 0:3]
+	ret['VC'] = None
+	if V.shape[1] >= 6:
+		#Some exporters put vertex colors after the positions
+		ret['VC'] = V[:, 3:6]
+	ret['VT'] = np.concatenate(VT, 0) if len(VT) > 0 else np.zeros((0, 2))
+	ret['VN'] = np.concatenate(VN, 0) if len(VN) > 0 else np.zeros((0, 3))
+	FI = np.concatenate(FI, 0) if len(FI) > 0 else np.zeros((0, 3), dtype = np.int64)
+	[ret['FV'], ret['FT'], ret['FN']] = [FI[:, 0], FI[:, 1], FI[:, 2]]
+	ret['FCounts'] = np.concatenate(FCounts) if len(FCounts) > 0 else np.zeros(0, dtype = np.int64)
+	return ret
+
+#Load an OBJ file into the flat arrays format of PolyMesh.getFlatArrays()
+def getObjFlatArrays(filename):
+	obj = loadObjArrays(filename)
+	(V, VT, VN) = (obj['V'], obj['VT'], obj['VN'])
+	(FV, FT, FN, counts) = (obj['FV'], obj['FT'], obj['FN'], obj['FCounts'])
+	arrays = {'VPos':V, 'colors':obj['VC'], 'texCoords':None, 'faceVerts':FV, 'faceCounts':counts, 'cornerAttribs':{}}
+	#Give every vertex the texture coordinate of the first corner that uses it
+	cornerTexCoords = None
+	if VT.shape[0] > 0 and (FT >= 0).any():
+		firstFT = -np.ones(V.shape[0], dtype = np.int64)
+		hasFT = FT >= 0
+		(usedV, firstCorner) = np.unique(FV[hasFT], return_index = True)
+		firstFT[usedV] = FT[hasFT][firstCorner]
+		texCoords = VT[np.maximum(firstFT, 0)]
+		texCoords[firstFT < 0] = 0
+		arrays['texCoords'] = texCoords
+		#Only store texture coordinates per corner if some vertex is
+		#used with more than one of them (e.g. along a texture seam)
+		if not (FT == firstFT[FV]).all():
+			VTl = VT.tolist() + [[0.0, 0.0]]
+			cornerTexCoords = [VTl[i] for i in FT.tolist()]
+	#Normals are kept for the faces that give one at every corner
+	cornerNormals = None
+	faceHasNormals = []
+	if VN.shape[0] > 0 and (FN >= 0).any() and counts.size > 0:
+		VNl = [Vector3D(N[0], N[1], N[2]) for N in VN.tolist()]
+		cornerNormals = [VNl[i] for i in FN.tolist()]
+		faceHasNormals = np.logical_and.reduceat(FN >= 0, np.cumsum(counts) - counts).tolist()
+	if cornerTexCoords or cornerNormals:
+		starts = (np.cumsum(counts) - counts).tolist()
+		for (i, (s, c)) in enumerate(zip(starts, counts.tolist())):
+			T = None
+			N = None
+			if cornerTexCoords:
+				T = cornerTexCoords[s:s+c]
+			if cornerNormals and faceHasNormals[i]:
+				N = cornerNormals[s:s+c]
+			if T or N:
+				arrays['cornerAttribs'][i] = (T, N)
+	return arrays
+
+#Return copies of a face's per-corner texture coordinates and normals (see
+#MeshFace), so that meshes built from the same attributes can be edited
+#independently
+def copyCornerAttribs(cornerTexCoords, cornerNormals):
+	if cornerTexCoords:
+		cornerTexCoords = [list(T) for T in cornerTexCoords]
+	if cornerNormals:
+		cornerNormals = [N.Copy() for N in cornerNormals]
+	return (cornerTexCoords, cornerNormals)
+
+#Parse OFF style face lines "N v1 v2 ... vN" into (faceVerts, faceCounts) (see
+#PolyMesh.getFaceIndices()).  This is a single numpy call when the faces all
+#have the same N and there are no trailing per-face colors
+def parseOffFaceLines(lines):
+	F = np.fromstring(" ".join(lines), dtype = np.int64, sep = " ")
+	K = 0
+	if len(lines) > 0:
+		K = int(lines[0].split()[0])
+	if K > 0 and F.size == (K+1)*len(lines) and (F[::K+1] == K).all():
+		F = F.reshape((len(lines), K+1))
+		return (F[:, 1:].flatten(), F[:, 0].copy())
+	faceVerts = []
+	faceCounts = []
+	for line in lines:
+		#Assume the vertices are specified in CCW order
+		fields = [int(i) for i in line.split()]
+		faceVerts += fields[1:fields[0]+1]
+		faceCounts.append(fields[0])
+	return (np.array(faceVerts, dtype = np.int64), np.array(faceCounts, dtype = np.int64))
+
+#Load an OFF/COFF file into the flat arrays format of PolyMesh.getFlatArrays()
+#The vertex and face sections are each converted with a single numpy call
+def getOffFlatArrays(filename):
+	fin = open(filename, 'r')
+	lines = [l for l in fin.read().split("\n") if len(l.split()) > 0 and not l.lstrip()[0] in ['#', '\0']]
+	fin.close()
+	divideColor = False
+	fields = lines[0].split()
+	start = 1
+	if fields[0] == "OFF" or fields[0] == "COFF":
+		divideColor = (fields[0] == "COFF")
+		fields = fields[1:]
+		if len(fields) == 0:
+			fields = lines[1].split()
+			start = 2
+	[nVertices, nFaces] = [int(field) for field in fields[0:2]]
+	VLines = lines[start:start+nVertices]
+	FLines = lines[start+nVertices:start+nVertices+nFaces]
+	V = parseObjFloatLines(VLines, 3)
+	arrays = {'VPos':V[:, 0:3].copy(), 'colors':None, 'texCoords':None, 'cornerAttribs':{}}
+	if V.shape[1] >= 6 and V.shape[0] > 0:
+		#There is color information
+		colors = V[:, 3:6].copy()
+		if divideColor:
+			colors = colors/255.0
+		if colors[:, 0].max() > 1:
+			#Rescale colors
+			colors = colors/255.0
+		arrays['colors'] = colors
+	(arrays['faceVerts'], arrays['faceCounts']) = parseOffFaceLines(FLines)
+	return arrays
+
+#Call f(*args) with the cyclic garbage collector switched off.  Building
+#or copying a mesh creates millions of small objects that all reference
+#each other, and the collector would otherwise rescan the whole growing
+#object graph many times along the way
+def callWithoutGC(f, *args):
+	gcWasEnabled = gc.isenabled()
+	gc.disable()
+	try:
+		return f(*args)
+	finally:
+		if gcWasEnabled:
+			gc.enable()
+
+#############################################################
+####                    MESH SNAPSHOTS                  #####
+#############################################################
+
+#Number of rows per block of snapshot storage
+SNAPSHOT_BLOCKSIZE = 4096
+
+#Split the array X into read-only blocks of SNAPSHOT_BLOCKSIZE rows,
+#reusing the blocks of the previous snapshot (prevBlocks) wherever they
+#are unchanged, so that only the blocks that were edited take new memory
+def getSharedBlocks(X, prevBlocks = None):
+	blocks = []
+	for i in range(0, X.shape[0], SNAPSHOT_BLOCKSIZE):
+		B = X[i:i+SNAPSHOT_BLOCKSIZE]
+		k = len(blocks)
+		if prevBlocks and k < len(prevBlocks) and np.array_equal(prevBlocks[k], B):
+			B = prevBlocks[k]
+		else:
+			B = B.copy()
+			B.flags.writeable = False
+		blocks.append(B)
+	return blocks
+
+def joinBlocks(blocks, shape):
+	if len(blocks) == 0:
+		return np.zeros(shape)
+	return np.concatenate(blocks, 0)
+
+#An immutable copy of the geometry and topology of a PolyMesh, which
+#can be restored with PolyMesh.restoreSnapshot().  Storage is kept in blocks
+#that are shared with the snapshot passed to PolyMesh.getSnapshot(), so
+#an undo stack of snapshots only pays for the parts of the mesh that changed
+#between consecutive steps
+class MeshSnapshot(object):
+	def __init__(self):
+		self.VPos = [] #Blocks of the Nx3 vertex positions
+		self.colors = None #Blocks of the Nx3 vertex colors (None if uncolored)
+		self.texCoords = [] #Blocks of the Nx2 vertex texture coordinates
+		self.faceVerts = [] #Blocks of the flattened face vertex indices
+		self.faceCounts = [] #Blocks of the number of vertices in each face
+		self.cornerAttribs = {} #Face index => (cornerTexCoords, cornerNormals)
+	
+	def getNumVertices(self):
+		return sum([B.shape[0] for B in self.VPos])
+	
+	def getNumFaces(self):
+		return sum([B.shape[0] for B in self.faceCounts])
+
 #############################################################
 ####                	POLYGON MESH                    #####
 #############################################################
 
+PICK_TOLERANCE = 10 #Pixels from the mouse that pickVertex() looks for vertices in
+#Fraction of the distance to a vertex in front of it where pickVertex()
+#stops looking for occluders (so the vertex's own faces don't hide it)
+PICK_OCCLUSION_EPS = 1e-6
+
 class PolyMesh(object):
 	def __init__(self):
 		self.DisplayList = -1
-		self.IndexDisplayList = -1
 		self.texID = None #Texture ID
+		self.texture = None #TextureImage that gets uploaded to texID when first drawn
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True #Whether the cached vertex geometry is stale
+		self.needsPositionUpdate = False #Whether only the vertex positions changed since the last draw
+		self.geometryCache = {} #See getGeometryCache()
+		#Vertex buffer objects that the faces are drawn with (see updateVBOs())
+		self.vboArrays = None
+		self.vertexVBO = None
+		self.indexVBO = None
 		self.drawFaces = 1
 		self.drawEdges = 0
 		self.drawVerts = 0
@@ -294,16 +999,232 @@ class PolyMesh(object):
 		#Pointers to a representative vertex in different 
 		#connected components
 		self.components = []
+		#Flat arrays (see getFlatArrays()) that stand in for the vertices,
+		#edges and faces in lazy topology mode, or None
+		self.lazyArrays = None
+		#Number of nested beginBatchEdit() calls that are still open
+		self.batchDepth = 0
+	
+	#In lazy topology mode, the vertex/edge/face objects are only built
+	#the first time something asks for them
+	def __getattr__(self, name):
+		if name in ['vertices', 'edges', 'faces', 'components'] and self.__dict__.get('lazyArrays') is not None:
+			self.materializeTopology()
+			return self.__dict__[name]
+		raise AttributeError(name)
+	
+	#Switch to lazy topology mode: keep only the flat arrays of the mesh
+	#and drop the vertex/edge/face objects until they're accessed
+	def setLazyArrays(self, arrays):
+		for key in ['vertices', 'edges', 'faces', 'components']:
+			self.__dict__.pop(key, None)
+		self.lazyArrays = arrays
+		self.needsDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
+	def isTopologyLazy(self):
+		return self.lazyArrays is not None
+	
+	#Build the vertex/edge/face objects from the lazy arrays
+	def materializeTopology(self):
+		if self.lazyArrays is None:
+			return
+		self.setFromFlatArrays(self.lazyArrays, checkFaces = True)
+	
+	#Make a deep copy of the mesh.  The topology is copied structurally
+	#through the element IDs, so faces are not validated again and edges
+	#are not looked up again
 	def Clone(self):
-		newMesh = PolyMesh()
-		for i in range(len(self.vertices)):
-			newMesh.addVertex(self.vertices[i].pos, self.vertices[i].color)
-		for i in range(len(self.faces)):
-			vertices = [newMesh.vertices[v.ID] for v in self.faces[i].getVertices()]
-			newMesh.addFace(vertices)
+		return callWithoutGC(self.cloneHelper)
+	
+	def cloneHelper(self):
+		newMesh = self.__class__()
+		newMesh.texture = self.texture
+		if self.lazyArrays is not None:
+			arrays = dict(self.lazyArrays)
+			for key in ['VPos', 'colors', 'texCoords']:
+				if arrays[key] is not None:
+					arrays[key] = arrays[key].copy()
+			arrays['cornerAttribs'] = dict([(i, copyCornerAttribs(T, N)) for (i, (T, N)) in arrays['cornerAttribs'].items()])
+			newMesh.setLazyArrays(arrays)
+			return newMesh
+		verts = []
+		for v in self.vertices:
+			newv = MeshVertex(Point3D(v.pos.x, v.pos.y, v.pos.z), v.ID)
+			newv.texCoords = list(v.texCoords)
+			if v.color is not None:
+				newv.color = list(v.color)
+			newv.component = v.component
+			verts.append(newv)
+		edges = []
+		for e in self.edges:
+			newe = MeshEdge(verts[e.v1.ID], verts[e.v2.ID], e.ID)
+			newe.v1.edges.add(newe)
+			newe.v2.edges.add(newe)
+			edges.append(newe)
+		faces = []
+		for f in self.faces:
+			newf = MeshFace(f.ID)
+			newf.startV = verts[f.startV.ID]
+			newf.edges = [edges[e.ID] for e in f.edges]
+			newf.area = f.area
+			(newf.cornerTexCoords, newf.cornerNormals) = copyCornerAttribs(f.cornerTexCoords, f.cornerNormals)
+			faces.append(newf)
+		for (e, newe) in zip(self.edges, edges):
+			if e.f1:
+				newe.f1 = faces[e.f1.ID]
+			if e.f2:
+				newe.f2 = faces[e.f2.ID]
+		newMesh.vertices = verts
+		newMesh.edges = edges
+		newMesh.faces = faces
+		newMesh.components = [verts[v.ID] for v in self.components if v.ID > -1]
 		return newMesh
 	
+	#Return a MeshSnapshot of the current state of the mesh.  If "prev" is
+	#another snapshot of this mesh (e.g. the top of an undo stack), storage
+	#for everything that hasn't changed since then is shared with it
+	def getSnapshot(self, prev = None):
+		if not prev:
+			prev = MeshSnapshot()
+		arrays = self.getFlatArrays()
+		snapshot = MeshSnapshot()
+		snapshot.VPos = getSharedBlocks(arrays['VPos'], prev.VPos)
+		if arrays['colors'] is not None:
+			snapshot.colors = getSharedBlocks(arrays['colors'], prev.colors)
+		snapshot.texCoords = getSharedBlocks(arrays['texCoords'], prev.texCoords)
+		snapshot.faceVerts = getSharedBlocks(arrays['faceVerts'], prev.faceVerts)
+		snapshot.faceCounts = getSharedBlocks(arrays['faceCounts'], prev.faceCounts)
+		snapshot.cornerAttribs = arrays['cornerAttribs']
+		return snapshot
+	
+	#Replace the contents of this mesh with a snapshot from getSnapshot()
+	def restoreSnapshot(self, snapshot):
+		arrays = {}
+		arrays['VPos'] = joinBlocks(snapshot.VPos, (0, 3))
+		arrays['colors'] = None
+		if snapshot.colors:
+			arrays['colors'] = joinBlocks(snapshot.colors, (0, 3))
+		arrays['texCoords'] = joinBlocks(snapshot.texCoords, (0, 2))
+		arrays['faceVerts'] = joinBlocks(snapshot.faceVerts, (0,))
+		arrays['faceCounts'] = joinBlocks(snapshot.faceCounts, (0,))
+		arrays['cornerAttribs'] = snapshot.cornerAttribs
+		self.setFromFlatArrays(arrays)
+	
+	#Return the mesh as a dictionary of flat arrays
+	#'VPos': Nx3 vertex positions
+	#'colors': Nx3 vertex colors (None if some vertex doesn't have a color)
+	#'texCoords': Nx2 vertex texture coordinates
+	#'faceVerts': Vertex indices of all of the faces concatenated together
+	#'faceCounts': Number of vertices in each face
+	#'cornerAttribs': Face index => (cornerTexCoords, cornerNormals) for
+	#the faces that have per-corner attributes
+	def getFlatArrays(self):
+		if self.lazyArrays is not None:
+			return dict(self.lazyArrays)
+		return callWithoutGC(self.getFlatArraysHelper)
+	
+	def getFlatArraysHelper(self):
+		arrays = {}
+		N = len(self.vertices)
+		arrays['VPos'] = np.array([[v.pos.x, v.pos.y, v.pos.z] for v in self.vertices]).reshape((N, 3))
+		arrays['colors'] = None
+		if N > 0 and not (None in [v.color for v in self.vertices]):
+			arrays['colors'] = np.array([v.color[0:3] for v in self.vertices], dtype = np.float64)
+		arrays['texCoords'] = np.array([v.texCoords[0:2] for v in self.vertices], dtype = np.float64).reshape((N, 2))
+		(arrays['faceVerts'], arrays['faceCounts']) = self.getFaceIndices()
+		cornerAttribs = {}
+		for f in self.faces:
+			if f.cornerTexCoords or f.cornerNormals:
+				cornerAttribs[f.ID] = (f.cornerTexCoords, f.cornerNormals)
+		arrays['cornerAttribs'] = cornerAttribs
+		return arrays
+	
+	#Replace the contents of this mesh with arrays from getFlatArrays()
+	#(checkFaces is passed along to buildFromArrays)
+	def setFromFlatArrays(self, arrays, checkFaces = False):
+		self.lazyArrays = None
+		faceVerts = np.asarray(arrays['faceVerts']).tolist()
+		faces = []
+		i = 0
+		for count in np.asarray(arrays['faceCounts']).tolist():
+			faces.append(faceVerts[i:i+count])
+			i += count
+		self.vertices = []
+		self.edges = []
+		self.faces = []
+		self.components = []
+		newFaces = self.buildFromArrays(arrays['VPos'], faces, arrays['colors'], arrays['texCoords'], checkFaces)
+		for (i, (cornerTexCoords, cornerNormals)) in arrays['cornerAttribs'].items():
+			if newFaces[i]:
+				(newFaces[i].cornerTexCoords, newFaces[i].cornerNormals) = copyCornerAttribs(cornerTexCoords, cornerNormals)
+	
+	#Pickle the mesh as flat arrays instead of as the graph of vertex/edge/face
+	#objects, which is slow, deeply recursive and huge.  This is what makes it
+	#cheap to send meshes to multiprocessing workers.  The edges are rebuilt
+	#from the faces and then put back in their original order (keeping their
+	#IDs), along with any edges that aren't on a face
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		for key in ['vertices', 'edges', 'faces', 'components']:
+			state.pop(key, None)
+		#GL objects only make sense in the context that created them
+		state['DisplayList'] = -1
+		state['texID'] = None
+		state['vboArrays'] = None
+		state['vertexVBO'] = None
+		state['indexVBO'] = None
+		state['needsDisplayUpdate'] = True
+		state['needsGeometryUpdate'] = True
+		state['geometryCache'] = {}
+		if self.lazyArrays is not None:
+			#The lazy arrays get pickled as they are
+			return state
+		arrays = self.getFlatArrays()
+		arrays['vertexComponents'] = np.array([v.component for v in self.vertices], dtype = np.int64)
+		arrays['components'] = np.array([v.ID for v in self.components if v.ID > -1], dtype = np.int64)
+		arrays['edgeVerts'] = np.array([[e.v1.ID, e.v2.ID] for e in self.edges], dtype = np.int64).reshape((-1, 2))
+		state['meshArrays'] = arrays
+		return state
+	
+	def __setstate__(self, state):
+		callWithoutGC(self.setStateHelper, state)
+	
+	def setStateHelper(self, state):
+		state = dict(state)
+		if not 'meshArrays' in state:
+			self.__dict__.update(state)
+			return
+		arrays = state.pop('meshArrays')
+		self.__dict__.update(state)
+		self.setFromFlatArrays(arrays)
+		if 'edgeVerts' in arrays:
+			self.restoreEdgeOrder(arrays['edgeVerts'])
+		for (v, c) in zip(self.vertices, arrays['vertexComponents'].tolist()):
+			v.component = c
+		self.components = [self.vertices[i] for i in arrays['components'].tolist() if i > -1]
+	
+	#Put the edges that were rebuilt from the faces back in the order of
+	#edgeVerts (an Ex2 array of the vertex indices of every edge, in order of
+	#their IDs), and add the edges in it that aren't on any face
+	def restoreEdgeOrder(self, edgeVerts):
+		lookup = {}
+		for e in self.edges:
+			lookup[(min(e.v1.ID, e.v2.ID), max(e.v1.ID, e.v2.ID))] = e
+		edges = []
+		for [i, j] in edgeVerts.tolist():
+			e = lookup.pop((min(i, j), max(i, j)), None)
+			if not e:
+				e = MeshEdge(self.vertices[i], self.vertices[j], -1)
+				e.v1.edges.add(e)
+				e.v2.edges.add(e)
+			edges.append(e)
+		#Anything left over goes at the end
+		edges += sorted(lookup.values(), key = lambda e: e.ID)
+		for (ID, e) in enumerate(edges):
+			e.ID = ID
+		self.edges = edges
+	
 	#Return the edge between v1 and v2 if it exists, or
 	#return None if an edge has not yet been created 
 	#between them
@@ -320,6 +1241,7 @@ class PolyMesh(object):
 	#############################################################
 
 	def addVertex(self, P, color = None):
+		self.needsGeometryUpdate = True
 		vertex = MeshVertex(P, len(self.vertices))
 		vertex.color = color
 		self.vertices.append(vertex)
@@ -346,6 +1268,7 @@ class PolyMesh(object):
 		if not are2DConvex(verts):
 			sys.stderr.write("Error: Trying to add mesh face that is not convex\n")
 			return None
+		self.needsGeometryUpdate = True
 		face = MeshFace(len(self.faces))
 		face.startV = meshVerts[0]
 		for i in range(0, len(meshVerts)):
@@ -358,15 +1281,90 @@ class PolyMesh(object):
 			edge.addFace(face, v1) #Add pointer to face from edge
 		self.faces.append(face)
 		return face
-	
+
+	#Add vertices and faces in bulk
+	#VPos: Nx3 array of vertex positions
+	#faces: List of faces, each of which is a list of indices into VPos in CCW order
+	#colors: Optional Nx3 array of vertex colors
+	#texCoords: Optional Nx2 array of vertex texture coordinates
+	#Edges are looked up in a dictionary keyed by vertex index pairs instead
+	#of by intersecting the vertices' edge sets, and only faces with more than
+	#3 vertices go through the planarity/convexity checks in addFace, so this
+	#runs in time linear in the number of face corners
+	#Returns a list parallel to "faces" with the new MeshFace objects (None
+	#for faces that were rejected)
+	#If checkFaces is False, polygons are trusted to be planar and convex
+	#(e.g. when they come from a snapshot of a mesh that was already valid)
+	def buildFromArrays(self, VPos, faces, colors = None, texCoords = None, checkFaces = True):
+		return callWithoutGC(self.buildFromArraysHelper, VPos, faces, colors, texCoords, checkFaces)
+
+	def buildFromArraysHelper(self, VPos, faces, colors, texCoords, checkFaces):
+		start = len(self.vertices)
+		VPos = np.asarray(VPos, dtype = np.float64).reshape((-1, 3))
+		for P in VPos.tolist():
+			self.vertices.append(MeshVertex(Point3D(P[0], P[1], P[2]), len(self.vertices)))
+		if colors is not None:
+			for (v, C) in zip(self.vertices[start:], np.asarray(colors).tolist()):
+				v.color = C[0:3]
+		if texCoords is not None:
+			for (v, T) in zip(self.vertices[start:], np.asarray(texCoords).tolist()):
+				v.texCoords = T[0:2]
+		verts = self.vertices
+		edges = self.edges
+		edgeMap = {}
+		for e in edges:
+			[a, b] = [e.v1.ID, e.v2.ID]
+			edgeMap[(min(a, b), max(a, b))] = e
+		ret = [None]*len(faces)
+		for k in range(len(faces)):
+			f = faces[k]
+			if start > 0:
+				f = [start + i for i in f]
+			N = len(f)
+			if N > 3 and checkFaces:
+				fverts = [verts[i].pos for i in f]
+				if not arePlanar(fverts):
+					sys.stderr.write("Error: Trying to add mesh face that is not planar\n")
+					continue
+				if not are2DConvex(fverts):
+					sys.stderr.write("Error: Trying to add mesh face that is not convex\n")
+					continue
+			face = MeshFace(len(self.faces))
+			face.startV = verts[f[0]]
+			for i in range(N):
+				[a, b] = [f[i], f[(i+1)%N]]
+				key = (a, b) if a < b else (b, a)
+				edge = edgeMap.get(key)
+				if edge is None:
+					edge = MeshEdge(verts[a], verts[b], len(edges))
+					edges.append(edge)
+					verts[a].edges.add(edge)
+					verts[b].edges.add(edge)
+					edgeMap[key] = edge
+				face.edges.append(edge)
+				edge.addFace(face, verts[a])
+			self.faces.append(face)
+			ret[k] = face
+		self.needsDisplayUpdate = True
+		self.needsGeometryUpdate = True
+		return ret
+
 	#Remove the face from the list of faces and remove the pointers
 	#from all edges to this face
 	def removeFace(self, face):
-		#Swap the face to remove with the last face (O(1) removal)
-		self.faces[face.ID] = self.faces[-1]
-		self.faces[face.ID].ID = face.ID #Update ID of swapped face
-		face.ID = -1
-		self.faces.pop()
+		if face.ID == -1:
+			#Already removed
+			return
+		self.needsGeometryUpdate = True
+		if self.batchDepth > 0:
+			#Leave a tombstone for commitBatchEdit()
+			face.ID = -1
+		else:
+			#Swap the face to remove with the last face (O(1) removal)
+			self.faces[face.ID] = self.faces[-1]
+			self.faces[face.ID].ID = face.ID #Update ID of swapped face
+			face.ID = -1
+			self.faces.pop()
 		#Remove pointers from all of the face's edges
 		for edge in face.edges:
 			edge.removeFace(face)
@@ -376,11 +1374,18 @@ class PolyMesh(object):
 	#(NOTE: This function is not responsible for cleaning up
 	#faces that may have used this edge; that is up to the client)
 	def removeEdge(self, edge):
-		#Swap the edge to remove with the last edge
-		self.edges[edge.ID] = self.edges[-1]
-		self.edges[edge.ID].ID = edge.ID #Update ID of swapped face
-		edge.ID = -1
-		self.edges.pop()
+		if edge.ID == -1:
+			#Already removed
+			return
+		if self.batchDepth > 0:
+			#Leave a tombstone for commitBatchEdit()
+			edge.ID = -1
+		else:
+			#Swap the edge to remove with the last edge
+			self.edges[edge.ID] = self.edges[-1]
+			self.edges[edge.ID].ID = edge.ID #Update ID of swapped face
+			edge.ID = -1
+			self.edges.pop()
 		#Remove pointers from the two vertices that make up this edge
 		edge.v1.edges.remove(edge)
 		edge.v2.edges.remove(edge)
@@ -389,10 +1394,45 @@ class PolyMesh(object):
 	#NOTE: This function is not responsible for cleaning up any of
 	#the edges or faces that may have used this vertex
 	def removeVertex(self, vertex):
-		self.vertices[vertex.ID] = self.vertices[-1]
-		self.vertices[vertex.ID].ID = vertex.ID
-		vertex.ID = -1
-		self.vertices.pop()
+		if vertex.ID == -1:
+			#Already removed
+			return
+		self.needsGeometryUpdate = True
+		if self.batchDepth > 0:
+			#Leave a tombstone for commitBatchEdit()
+			vertex.ID = -1
+		else:
+			self.vertices[vertex.ID] = self.vertices[-1]
+			self.vertices[vertex.ID].ID = vertex.ID
+			vertex.ID = -1
+			self.vertices.pop()
+	
+	#Batched edits: between beginBatchEdit() and commitBatchEdit(), the
+	#remove methods above only unlink an element and mark it with ID -1
+	#(a tombstone) instead of swapping it with the last element, and new
+	#elements are appended after the tombstones.  commitBatchEdit() drops
+	#all of the tombstones and renumbers the IDs in a single pass, so large
+	#edits take linear time.  Batches can be nested; only the outermost
+	#commit compacts.  While a batch is open the vertex/edge/face lists
+	#still hold the tombstones, so skip elements with ID -1 when walking them
+	def beginBatchEdit(self):
+		self.batchDepth += 1
+	
+	def commitBatchEdit(self):
+		if self.batchDepth == 0:
+			sys.stderr.write("Warning (commitBatchEdit): No batch edit in progress\n")
+			return
+		self.batchDepth -= 1
+		if self.batchDepth > 0:
+			return
+		for elems in [self.vertices, self.edges, self.faces]:
+			alive = [x for x in elems if x.ID != -1]
+			for i in range(len(alive)):
+				alive[i].ID = i
+			elems[:] = alive
+		self.components = [v for v in self.components if v.ID != -1]
+		self.needsDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	#############################################################
 	####    TOPOLOGY SUBDIVISION AND REMESHING METHODS      #####
@@ -431,7 +1471,7 @@ class PolyMesh(object):
 				if e.ID != -1: #If the edge has not already been removed
 					self.removeEdge(e)
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	#Split every face into N triangles by creating a vertex at
 	#the centroid of each face
@@ -450,7 +1490,7 @@ class PolyMesh(object):
 				newVerts = [v1, v2, centroid]
 				newFace = self.addFace(newVerts)
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	def starRemesh(self):
 		#Copy over the face list since it's about to be modified
@@ -509,7 +1549,7 @@ class PolyMesh(object):
 				v2 = verts[i+1]
 				newFace = self.addFace([v0, v1, v2])
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 
 	#For every vertex, create a new vertex a parameter t [0-0.5] of
 	#the way along each of its N attached edges, and then "chop off"
@@ -518,6 +1558,7 @@ class PolyMesh(object):
 	def truncate(self, t):
 		choppedVertices = list(self.vertices)
 		choppedFaces = list(self.faces)
+		self.beginBatchEdit()
 		#Truncate each vertex in the original list of vertices one at a time
 		i = 0
 		for v in choppedVertices:
@@ -550,7 +1591,7 @@ class PolyMesh(object):
 			for e in edges:
 				self.removeEdge(e)
 			#Remove the vertex at the tip
-				self.removeVertex(v)
+			self.removeVertex(v)
 			#Update the faces that have been removed with the three new edges replacing
 			#the original two and add them back
 			for f in facesToRemove:
@@ -582,8 +1623,10 @@ class PolyMesh(object):
 			i = i+1
 			if i >= 1:
 				break	
+		self.commitBatchEdit()
 	
 	def flipNormals(self):
+		self.needsGeometryUpdate = True
 		for f in self.faces:
 			f.flipNormal()
 	
@@ -619,31 +1662,24 @@ class PolyMesh(object):
 			if counts[i] > largestCount:
 				largestCount = counts[i]
 				largestComponent = i
-		facesToDel = []
-		edgesToDel = []
+		self.beginBatchEdit()
 		#Delete faces first, then edges, then vertices
 		for f in self.faces:
 			if f.startV.component != largestComponent:
-				edgesToDel = edgesToDel + f.edges
-				facesToDel.append(f)
-		for f in facesToDel:
-			self.removeFace(f)
-		for e in edgesToDel:
-			if e.ID != -1:
-				self.removeEdge(e)
-		verticesToDel = []
+				self.removeFace(f)
+				for e in f.edges:
+					self.removeEdge(e)
 		for v in self.vertices:
 			if v.component != largestComponent:
-				verticesToDel.append(v)
-		for v in verticesToDel:
-			self.removeVertex(v)
+				self.removeVertex(v)
+		self.commitBatchEdit()
 		#Now update the connected components list
 		if len(self.vertices) > 0:
 			self.components = [self.vertices[0]]
 			for v in self.vertices:
 				v.component = 0
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	#Fill hole with the "advancing front" method
 	#but keep it simple for now; not tests for self intersections
@@ -698,59 +1734,267 @@ class PolyMesh(object):
 				print "Found hole of size %i"%len(loop)
 				self.fillHole(loop)
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
+
+	#Merge vertices that are within "tol" of each other (exactly coincident
+	#vertices if tol is 0) and rebuild the faces on top of the merged vertices.
+	#Faces that collapse to fewer than 3 vertices are dropped, and so are
+	#faces that would repeat a vertex, duplicate an earlier face or add a
+	#third face to an edge (which the half edge structure can't represent).
+	#The number of faces that were dropped is reported on stderr.  The first
+	#vertex in each cluster keeps its color and texture coordinates
+	#Returns the number of vertices that were removed
+	def weldVertices(self, tol = 0.0):
+		N = len(self.vertices)
+		if N == 0:
+			return 0
+		X = np.array([[v.pos.x, v.pos.y, v.pos.z] for v in self.vertices])
+		(reps, remap) = getWeldIndices(X, tol)
+		if len(reps) == N:
+			return 0
+		oldVertices = self.vertices
+		oldFaces = []
+		faces = []
+		corners = []
+		remap = remap.tolist()
+		faceKeys = set()
+		edgeCounts = {}
+		dropped = 0
+		for f in self.faces:
+			verts = [remap[v.ID] for v in f.getVertices()]
+			#Remove corners that were merged into their neighbors
+			keep = [i for i in range(len(verts)) if verts[i] != verts[i-1]]
+			if len(set(verts)) < 3 or len(keep) < 3:
+				continue
+			newVerts = [verts[i] for i in keep]
+			faceKey = tuple(sorted(newVerts))
+			faceEdges = [(min(a, b), max(a, b)) for (a, b) in zip(newVerts, newVerts[1:] + newVerts[0:1])]
+			if len(set(newVerts)) < len(newVerts) or faceKey in faceKeys or max([edgeCounts.get(e, 0) for e in faceEdges]) >= 2:
+				dropped += 1
+				continue
+			faceKeys.add(faceKey)
+			for e in faceEdges:
+				edgeCounts[e] = edgeCounts.get(e, 0) + 1
+			oldFaces.append(f)
+			faces.append(newVerts)
+			corners.append(keep)
+		if dropped > 0:
+			sys.stderr.write("Warning: Dropped %i faces that were duplicated or would have made edges non-manifold while welding\n"%dropped)
+		self.vertices = []
+		self.edges = []
+		self.faces = []
+		self.components = []
+		newFaces = self.buildFromArrays(X[reps], faces)
+		for (k, i) in enumerate(reps.tolist()):
+			self.vertices[k].color = oldVertices[i].color
+			self.vertices[k].texCoords = oldVertices[i].texCoords
+		for (f, oldf, keep) in zip(newFaces, oldFaces, corners):
+			if f == None:
+				continue
+			if oldf.cornerTexCoords:
+				f.cornerTexCoords = [oldf.cornerTexCoords[i] for i in keep]
+			if oldf.cornerNormals:
+				f.cornerNormals = [oldf.cornerNormals[i] for i in keep]
+		return N - len(reps)
 
 	#############################################################
 	####                 GEOMETRY METHODS                   #####
 	#############################################################
 
 	#Transformations are simple because geometry information is only
-	#stored in the vertices
+	#stored in the vertices (or in the position array in lazy topology mode)
 	def Transform(self, matrix):
+		self.needsGeometryUpdate = True
+		self.needsPositionUpdate = True
+		if self.lazyArrays is not None:
+			M = np.array(matrix.m, dtype = np.float64).reshape((4, 4))
+			X = self.lazyArrays['VPos']
+			Y = X.dot(M[0:3, 0:3].T) + M[0:3, 3]
+			W = X.dot(M[3, 0:3]) + M[3, 3]
+			self.lazyArrays['VPos'] = Y/W[:, None]
+			return
 		for v in self.vertices:
 			v.pos = matrix*v.pos
 	
 	def Translate(self, dV):
+		self.needsGeometryUpdate = True
+		self.needsPositionUpdate = True
+		if self.lazyArrays is not None:
+			self.lazyArrays['VPos'] = self.lazyArrays['VPos'] + np.array([dV.x, dV.y, dV.z])
+			return
 		for v in self.vertices:
 			v.pos = v.pos + dV
 	
 	def Scale(self, dx, dy, dz):
+		self.needsGeometryUpdate = True
+		self.needsPositionUpdate = True
+		if self.lazyArrays is not None:
+			self.lazyArrays['VPos'] = self.lazyArrays['VPos']*np.array([dx, dy, dz])
+			return
 		for v in self.vertices:
 			v.pos.x = dx*v.pos.x
 			v.pos.y = dy*v.pos.y
 			v.pos.z = dz*v.pos.z
-
+	
+	#Move all of the vertices to the positions in the Nx3 array X at once.
+	#This only marks the vertex positions as changed, so the next renderGL()
+	#refreshes the positions and normals of the vertex buffer in place
+	#instead of rebuilding everything
+	def setVertexPositions(self, X):
+		X = np.asarray(X, dtype = np.float64).reshape((-1, 3))
+		if self.lazyArrays is not None:
+			self.lazyArrays['VPos'] = X.copy()
+		else:
+			for (v, P) in zip(self.vertices, X.tolist()):
+				v.pos = Point3D(P[0], P[1], P[2])
+		self.needsGeometryUpdate = True
+		self.needsPositionUpdate = True
+	
+	#Return an Nx3 array of the vertex positions.  In lazy topology mode
+	#this is the mesh's own position array (which shouldn't be modified),
+	#and no vertex/edge/face objects are built
+	def getVertexPositions(self):
+		if self.lazyArrays is not None:
+			return self.lazyArrays['VPos']
+		return callWithoutGC(self.getVertexPositionsHelper)
+	
+	def getVertexPositionsHelper(self):
+		return np.array([[v.pos.x, v.pos.y, v.pos.z] for v in self.vertices]).reshape((-1, 3))
+	
+	#Return (faceVerts, faceCounts), the vertex indices of all faces
+	#concatenated together and the number of vertices in each face.  They're
+	#cached with the rest of the geometry (see getGeometryCache()), so like
+	#in lazy topology mode they shouldn't be modified
+	def getFaceIndices(self):
+		if self.lazyArrays is not None:
+			return (self.lazyArrays['faceVerts'], self.lazyArrays['faceCounts'])
+		cache = self.getGeometryCache()
+		if not 'faceIndices' in cache:
+			cache['faceIndices'] = callWithoutGC(self.getFaceIndicesHelper)
+		return cache['faceIndices']
+	
+	def getFaceIndicesHelper(self):
+		faceVerts = []
+		faceCounts = []
+		for f in self.faces:
+			#Walk around the face inline (same as getVertices())
+			v = f.startV
+			for e in f.edges:
+				faceVerts.append(v.ID)
+				v = e.v2 if e.v1 is v else e.v1
+			faceCounts.append(len(f.edges))
+		return (np.array(faceVerts, dtype = np.int64), np.array(faceCounts, dtype = np.int64))
+	
 	def getCentroid(self):
-		center = Vector3D(0.0, 0.0, 0.0)
-		for v in self.vertices:
-			center = center + v.pos
-		center = center * (1.0/float(len(self.vertices)))
-		return center
+		C = self.getVertexPositions().mean(0).tolist()
+		return Point3D(C[0], C[1], C[2])
 	
 	def getBBox(self):
-		if len(self.vertices) == 0:
+		X = self.getVertexPositions()
+		if X.shape[0] == 0:
 			return BBox3D(0, 0, 0, 0, 0, 0)
-		P0 = self.vertices[0].pos
-		bbox = BBox3D(P0.x, P0.x, P0.y, P0.y, P0.z, P0.z)
-		for v in self.vertices:
-			bbox.addPoint(v.pos)
-		return bbox
+		[xmin, ymin, zmin] = X.min(0).tolist()
+		[xmax, ymax, zmax] = X.max(0).tolist()
+		return BBox3D(xmin, xmax, ymin, ymax, zmin, zmax)
+	
+	#Return the centroid of the surface (as opposed to getCentroid(),
+	#which averages the vertices)
+	def getAreaWeightedCentroid(self):
+		(faceVerts, faceCounts) = self.getFaceIndices()
+		(area, C) = getAreaWeightedSums(self.getVertexPositions(), faceVerts, faceCounts)
+		if area == 0:
+			return self.getCentroid()
+		C = (C/area).tolist()
+		return Point3D(C[0], C[1], C[2])
+	
+	#Return the dictionary of cached results that only depend on the vertex
+	#positions and the faces, emptying it first if the mesh changed since
+	#the last call (i.e. needsGeometryUpdate is set)
+	def getGeometryCache(self):
+		if self.needsGeometryUpdate or self.geometryCache is None:
+			self.geometryCache = {}
+			self.needsGeometryUpdate = False
+		return self.geometryCache
+	
+	#Return the per-vertex normals, areas and curvatures from
+	#getVertexGeometryArrays().  They're computed in one vectorized pass and
+	#cached until an edit sets needsGeometryUpdate (code that moves vertices
+	#around directly should set it too)
+	def getVertexGeometry(self):
+		cache = self.getGeometryCache()
+		if not 'vertexGeometry' in cache:
+			(faceVerts, faceCounts) = self.getFaceIndices()
+			cache['vertexGeometry'] = getVertexGeometryArrays(self.getVertexPositions(), faceVerts, faceCounts)
+		return cache['vertexGeometry']
+	
+	def getVertexNormals(self):
+		return self.getVertexGeometry()['normals']
+	
+	def getOneRingAreas(self):
+		return self.getVertexGeometry()['oneRingAreas']
+	
+	def getVoronoiAreas(self):
+		return self.getVertexGeometry()['voronoiAreas']
+	
+	def getMeanCurvatures(self):
+		return self.getVertexGeometry()['meanCurvature']
+	
+	def getGaussianCurvatures(self):
+		return self.getVertexGeometry()['gaussCurvature']
+	
+	#Return a hex digest that identifies the mesh by its vertex positions
+	#and face indices, for use as a key when caching results computed from
+	#the mesh (in memory or on disk).  If attributes is True, the vertex
+	#colors and texture coordinates and the per-corner face attributes are
+	#hashed as well.  The digest is cached with the rest of the geometry,
+	#so code that changes the mesh directly (rather than through the mesh
+	#methods) must set needsGeometryUpdate, and code that only changes the
+	#colors or texture coordinates must call invalidateAttributes()
+	def fingerprint(self, attributes = False):
+		cache = self.getGeometryCache()
+		key = 'fingerprintAttributes' if attributes else 'fingerprint'
+		if not key in cache:
+			h = hashlib.sha1()
+			(faceVerts, faceCounts) = self.getFaceIndices()
+			updateArrayHash(h, self.getVertexPositions(), '<f8')
+			updateArrayHash(h, faceVerts, '<i8')
+			updateArrayHash(h, faceCounts, '<i8')
+			if attributes:
+				arrays = self.getFlatArrays()
+				updateArrayHash(h, arrays['colors'], '<f8')
+				#Vertices without texture coordinates default to (0, 0)
+				texCoords = arrays['texCoords']
+				if texCoords is None:
+					texCoords = np.zeros((arrays['VPos'].shape[0], 2))
+				updateArrayHash(h, texCoords, '<f8')
+				for (i, (cornerTexCoords, cornerNormals)) in sorted(arrays['cornerAttribs'].items()):
+					if not (cornerTexCoords or cornerNormals):
+						continue
+					h.update('%i;'%i)
+					if cornerTexCoords:
+						cornerTexCoords = [T[0:2] for T in cornerTexCoords]
+					updateArrayHash(h, cornerTexCoords or None, '<f8')
+					if cornerNormals:
+						cornerNormals = [[N.x, N.y, N.z] for N in cornerNormals]
+					updateArrayHash(h, cornerNormals or None, '<f8')
+			cache[key] = h.hexdigest()
+		return cache[key]
+	
+	#Call after changing the vertex colors, texture coordinates or corner
+	#attributes directly, so they get drawn and fingerprinted again
+	#without throwing away the cached geometry
+	def invalidateAttributes(self):
+		self.needsDisplayUpdate = True
+		if self.geometryCache is not None:
+			self.geometryCache.pop('fingerprintAttributes', None)
 	
 	#Use PCA to find the principal axes of the vertices
 	def getPrincipalAxes(self):
-		C = self.getCentroid()
-		N = len(self.vertices)
-		X = np.zeros((N, 3))
-		for i in range(N):
-			V = self.vertices[i]
-			#Subtract off zero-order moment (centroid)
-			X[i, :] = [V.pos.x - C.x, V.pos.y - C.y, V.pos.z - C.z]
+		X = self.getVertexPositions()
+		#Subtract off zero-order moment (centroid)
+		X = X - X.mean(0)
 		XTX = X.transpose().dot(X)
-		(lambdas, axes) = linalg.eig(XTX)
-		#Put the eigenvalues in decreasing order
-		idx = lambdas.argsort()[::-1]
-		lambdas = lambdas[idx]
-		axes = axes[:, idx]
+		axes = getPrincipalAxesFromScatter(XTX)
 		Axis1 = Vector3D(axes[0, 0], axes[1, 0], axes[2, 0])
 		Axis2 = Vector3D(axes[0, 1], axes[1, 1], axes[2, 1])
 		Axis3 = Vector3D(axes[0, 2], axes[1, 2], axes[2, 2])
@@ -850,24 +2094,24 @@ class PolyMesh(object):
 					e = f.edges[i]
 				newFace.append(splitFaceEndE.centerVertex)
 				facesToAdd.append(newFace)
+		self.beginBatchEdit()
 		#First remove all faces that are no longer relevant
 		for f in facesToDel:
 			self.removeFace(f)	
 		#Now remove edges that are no longer relevant
 		for e in edgesToDel:
-			if e.ID != -1:
-				self.removeEdge(e)
+			self.removeEdge(e)
 		#Now remove vertices that are no longer relevant
 		for v in verticesToDel:
-			if v.ID != -1:
-				self.removeVertex(v)
+			self.removeVertex(v)
 		#Add new faces
 		for f in facesToAdd:
 			self.addFace(f)
+		self.commitBatchEdit()
 		if fillHoles:
 			self.fillHoles(slicedHolesOnly = True)
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	def sliceAbovePlane(self, plane, fillHoles = True):
 		planeNeg = Plane3D(plane.P0, plane.N)
@@ -884,23 +2128,31 @@ class PolyMesh(object):
 			dPPerp = dP - dPPar
 			V.pos = P0 - dPPar + dPPerp
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	#############################################################
 	####                INPUT/OUTPUT METHODS                #####
 	#############################################################
-	def loadFile(self, filename):
+	#If weldTol is not None, merge vertices that are within weldTol of each
+	#other after loading (use 0 to merge only exactly coincident vertices)
+	#If lazyTopology is True (OFF and OBJ files only), only the flat arrays
+	#of the mesh are loaded and the vertex/edge/face objects are built the
+	#first time they're needed.  Position-only workloads such as getBBox(),
+	#getCentroid(), getPrincipalAxes() and getVertexPositions() never need them
+	def loadFile(self, filename, weldTol = None, lazyTopology = False):
 		suffix = re.split("\.", filename)[-1]
 		if suffix == "off":
-			self.loadOffFile(filename)
+			self.loadOffFile(filename, lazyTopology)
 		elif suffix == "toff":
 			self.loadTOffFile(filename)
 		elif suffix == "obj":
-			self.loadObjFile(filename)
+			self.loadObjFile(filename, lazyTopology)
 		else:
 			print "Unsupported file suffix (%s) for loading mesh"%(suffix, filename)
+		if weldTol is not None:
+			self.weldVertices(weldTol)
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+		self.needsGeometryUpdate = True
 	
 	def saveFile(self, filename, verbose = False):
 		suffix = re.split("\.", filename)[-1]
@@ -913,60 +2165,12 @@ class PolyMesh(object):
 		else:
 			print "Unsupported file suffix (%s) for saving mesh %s"%(suffix, filename)		
 	
-	def loadOffFile(self, filename):
-		fin = open(filename, 'r')
-		nVertices = 0
-		nFaces = 0
-		nEdges = 0
-		lineCount = 0
-		face = 0
-		vertex = 0
-		divideColor = False
-		for line in fin:
-			lineCount = lineCount+1
-			fields = line.split() #Splits whitespace by default
-			if len(fields) == 0: #Blank line
-				continue
-			if fields[0][0] in ['#', '\0', ' '] or len(fields[0]) == 0:
-				continue
-			#Check section
-			if nVertices == 0:
-				if fields[0] == "OFF" or fields[0] == "COFF":
-					if len(fields) > 2:
-						fields[1:4] = [int(field) for field in fields]
-						[nVertices, nFaces, nEdges] = fields[1:4]		
-					if fields[0] == "COFF":
-						divideColor = True			
-				else:
-					fields[0:3] = [int(field) for field in fields]
-					[nVertices, nFaces, nEdges] = fields[0:3]
-			elif vertex < nVertices:
-				fields = [float(i) for i in fields]
-				P = Point3D(fields[0],fields[1], fields[2])
-				color = None
-				if len(fields) >= 6:
-					#There is color information
-					if divideColor:
-						color = [float(c)/255.0 for c in fields[3:6]]
-					else:
-						color = [float(c) for c in fields[3:6]]
-				self.addVertex(P, color)
-				vertex = vertex+1
-			elif face < nFaces:
-				#Assume the vertices are specified in CCW order
-				fields = [int(i) for i in fields]
-				meshVerts = fields[1:fields[0]+1]
-				verts = [self.vertices[i] for i in meshVerts]
-				self.addFace(verts)
-				face = face+1
-		fin.close()
-		for v in self.vertices:
-			if v.color:
-				if v.color[0] > 1:
-					#Rescale colors
-					for v2 in self.vertices:
-						v2.color = [a/255.0 for a in v2.color]
-					break
+	def loadOffFile(self, filename, lazyTopology = False):
+		arrays = getOffFlatArrays(filename)
+		if lazyTopology:
+			self.setLazyArrays(arrays)
+		else:
+			self.setFromFlatArrays(arrays, checkFaces = True)
 	
 	#My own "TOFF" format, which is like OFF with texture
 	def loadTOffFile(self, filename):
@@ -989,7 +2193,7 @@ class PolyMesh(object):
 			if nVertices == 0:
 				if fields[0] == "TOFF":
 					textureName = fields[1]
-					self.texID = loadTexture(textureName)	
+					self.texture = getTexture(textureName, background = True)
 				else:
 					fields[0:3] = [int(field) for field in fields]
 					[nVertices, nFaces, nEdges] = fields[0:3]
@@ -1065,25 +2269,12 @@ class PolyMesh(object):
 		if verbose:
 			print "Saved file to %s"%filename
 		
-	def loadObjFile(self, filename):
-		#TODO: Right now vertex normals, face normals, and texture coordinates are ignored
-		#Later incorporate them??
-		fin = open(filename, 'r')
-		for line in fin:
-			fields = line.split()
-			if len(fields) == 0: #Blank line
-				continue
-			if fields[0][0] in ['#', '\0', ' '] or len(fields[0]) == 0:
-				continue
-			if fields[0] == "v":
-				coords = [float(i) for i in fields[1:4]]
-				self.addVertex(Point3D(coords[0], coords[1], coords[2]))
-			if fields[0] == "f":
-				#Indices are numbered starting at 1 (so need to subtract that off)
-				indices = [int(re.split("/",s)[0])-1 for s in fields[1:]]
-				verts = [self.vertices[i] for i in indices]
-				self.addFace(verts)
-		fin.close()
+	def loadObjFile(self, filename, lazyTopology = False):
+		arrays = getObjFlatArrays(filename)
+		if lazyTopology:
+			self.setLazyArrays(arrays)
+		else:
+			self.setFromFlatArrays(arrays, checkFaces = True)
 	
 	def saveObjFile(self, filename, verbose = False):
 		fout = open(filename, "w")
@@ -1122,8 +2313,68 @@ class PolyMesh(object):
 	####                     RENDERING                      #####
 	#############################################################
 	
-	#vertexColors is an Nx3 numpy array, where N is the number of vertices
+	#Return the arrays for the vertex buffer objects of this mesh
+	#(see getVBOArrays())
+	def getRenderArrays(self):
+		arrays = self.getFlatArrays()
+		return getVBOArrays(arrays['VPos'], arrays['faceVerts'], arrays['faceCounts'], self.getVertexNormals(), arrays['colors'], arrays['texCoords'], arrays['cornerAttribs'])
+	
+	#Bring the vertex buffer objects up to date.  If positionsOnly is True
+	#and the buffers already exist, only the positions and normals in the
+	#vertex buffer are refreshed (with glBufferSubData), and the colors,
+	#texture coordinates and the index buffer are kept
+	def updateVBOs(self, positionsOnly = False):
+		from OpenGL.arrays import vbo
+		from OpenGL.GL import GL_ELEMENT_ARRAY_BUFFER
+		X = self.getVertexPositions()
+		if positionsOnly and self.vertexVBO is not None and self.vboArrays['numVertices'] == X.shape[0]:
+			arrays = self.vboArrays
+			vertices = arrays['vertices']
+			fillVBOPositions(vertices, X, self.getVertexNormals(), arrays['source'], arrays['normalRows'], arrays['normalValues'])
+			self.vertexVBO[0:len(vertices)] = vertices
+			return
+		self.vboArrays = self.getRenderArrays()
+		if len(self.vboArrays['indices']) == 0:
+			return
+		if self.vertexVBO is None:
+			self.vertexVBO = vbo.VBO(self.vboArrays['vertices'])
+			self.indexVBO = vbo.VBO(self.vboArrays['indices'], target = GL_ELEMENT_ARRAY_BUFFER)
+		else:
+			self.vertexVBO.set_array(self.vboArrays['vertices'])
+			self.indexVBO.set_array(self.vboArrays['indices'])
+	
+	#Draw the faces from the vertex buffer objects
+	def drawVBOs(self):
+		from OpenGL.GL import glColorMaterial, glColorPointer, glDisableClientState, glDrawElements, glEnable, glEnableClientState, glNormalPointer, glTexCoordPointer, glVertexPointer, GL_AMBIENT_AND_DIFFUSE, GL_COLOR_ARRAY, GL_COLOR_MATERIAL, GL_FLOAT, GL_FRONT_AND_BACK, GL_NORMAL_ARRAY, GL_TEXTURE_COORD_ARRAY, GL_TRIANGLES, GL_UNSIGNED_INT, GL_VERTEX_ARRAY
+		if self.vboArrays is None or len(self.vboArrays['indices']) == 0:
+			return
+		stride = VBO_STRIDE*4
+		self.vertexVBO.bind()
+		self.indexVBO.bind()
+		clientStates = [GL_VERTEX_ARRAY, GL_NORMAL_ARRAY]
+		glVertexPointer(3, GL_FLOAT, stride, self.vertexVBO + VBO_POSITION*4)
+		glNormalPointer(GL_FLOAT, stride, self.vertexVBO + VBO_NORMAL*4)
+		if self.useTexture:
+			clientStates.append(GL_TEXTURE_COORD_ARRAY)
+			glTexCoordPointer(2, GL_FLOAT, stride, self.vertexVBO + VBO_TEXCOORD*4)
+		elif self.vboArrays['hasColors']:
+			if self.doLighting:
+				glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+				glEnable(GL_COLOR_MATERIAL)
+			clientStates.append(GL_COLOR_ARRAY)
+			glColorPointer(3, GL_FLOAT, stride, self.vertexVBO + VBO_COLOR*4)
+		for state in clientStates:
+			glEnableClientState(state)
+		glDrawElements(GL_TRIANGLES, len(self.vboArrays['indices']), GL_UNSIGNED_INT, self.indexVBO)
+		for state in clientStates:
+			glDisableClientState(state)
+		self.vertexVBO.unbind()
+		self.indexVBO.unbind()
+	
+	#The faces are drawn from vertex buffer objects, and the edges, vertices
+	#and normals (when they're turned on) from a display list
 	def renderGL(self, drawEdges = 0, drawVerts = 0, drawNormals = 0, drawFaces = 1, lightingOn = True, useTexture = True ):
+		from OpenGL.GL import glBegin, glBindTexture, glCallList, glColor3f, glDeleteLists, glDisable, glEnable, glEnd, glEndList, glGenLists, glLineWidth, glNewList, glPointSize, glVertex3f, GL_COMPILE, GL_LIGHTING, GL_LINES, GL_POINTS, GL_TEXTURE_2D
 		if self.drawFaces != drawFaces:
 			self.drawFaces = drawFaces
 			self.needsDisplayUpdate = True
@@ -1142,24 +2393,18 @@ class PolyMesh(object):
 		if self.useTexture != useTexture:
 			self.useTexture = useTexture
 			self.needsDisplayUpdate = True
+		if self.needsPositionUpdate and (self.drawEdges or self.drawVerts or self.drawNormals):
+			#The display list has positions in it too
+			self.needsDisplayUpdate = True
 		if self.needsDisplayUpdate:
+			if self.texture and self.texID is None:
+				self.texID = self.texture.getTexID()
+			if self.drawFaces:
+				self.updateVBOs()
 			if self.DisplayList != -1: #Deallocate previous display list
 				glDeleteLists(self.DisplayList, 1)
 			self.DisplayList = glGenLists(1)
 			glNewList(self.DisplayList, GL_COMPILE)
-			if self.texID and self.useTexture:
-				glEnable(GL_TEXTURE_2D)
-				glBindTexture(GL_TEXTURE_2D, self.texID)
-			else:
-				glDisable(GL_TEXTURE_2D)
-			if self.drawFaces:
-				if self.doLighting:
-					glEnable(GL_LIGHTING)
-					glColor3f(0.5, 0.5, 0.5)
-				else:
-					glDisable(GL_LIGHTING)
-				for f in self.faces:
-					f.drawFilled(drawNormal = False, doLighting = self.doLighting, useTexture = useTexture)
 			if self.drawEdges:
 				glDisable(GL_LIGHTING)
 				glColor3f(0, 0, 1)
@@ -1189,189 +2434,303 @@ class PolyMesh(object):
 				glColor3f(0, 1, 0)
 				glLineWidth(3)
 				glBegin(GL_LINES)
+				normals = self.getVertexNormals()
 				for v in self.vertices:
 					P1 = v.pos
-					P2 = P1 + 0.05*v.getNormal()
+					N = normals[v.ID]
 					glVertex3f(P1.x, P1.y, P1.z)
-					glVertex3f(P2.x, P2.y, P2.z)
+					glVertex3f(P1.x + 0.05*N[0], P1.y + 0.05*N[1], P1.z + 0.05*N[2])
 				glEnd()
 			glEnable(GL_LIGHTING)
 			glEndList()
 			self.needsDisplayUpdate = False
+			self.needsPositionUpdate = False
+		elif self.needsPositionUpdate:
+			if self.drawFaces:
+				self.updateVBOs(positionsOnly = True)
+			self.needsPositionUpdate = False
+		if self.texID and self.useTexture:
+			glEnable(GL_TEXTURE_2D)
+			glBindTexture(GL_TEXTURE_2D, self.texID)
+		else:
+			glDisable(GL_TEXTURE_2D)
+		if self.drawFaces:
+			if self.doLighting:
+				glEnable(GL_LIGHTING)
+				glColor3f(0.5, 0.5, 0.5)
+			else:
+				glDisable(GL_LIGHTING)
+			self.drawVBOs()
 		glCallList(self.DisplayList)
 
-	#Render the vertices of the mesh as points with colors equal to their indices
-	#in the vertex list.  Used to help with vertex selection (will work as long as
-	#there are fewer than 2^32 vertices)
-	def renderGLIndices(self):
-		if self.needsIndexDisplayUpdate:
-			if self.IndexDisplayList != -1: #Deallocate previous display list
-				glDeleteLists(self.IndexDisplayList, 1)
-			self.IndexDisplayList = glGenLists(1)
-			print "Updating index display list"
-			glNewList(self.IndexDisplayList, GL_COMPILE)
-			glDisable(GL_LIGHTING)
-			N = len(self.vertices)
-			#First draw all of the faces with index N+1 so that occlusion is
-			#taken into proper consideration
-			[R, G, B, A] = splitIntoRGBA(N+2)
-			glColor4ub(R, G, B, A)
-			for f in self.faces:
-				f.drawFilled()
-			glPointSize(20)
-			glBegin(GL_POINTS)
-			for i in range(0, N):
-				P = self.vertices[i].pos
-				[R, G, B, A] = splitIntoRGBA(i+1)
-				glColor4ub(R, G, B, A)
-				glVertex3f(P.x, P.y, P.z)
-			glEnd()
-			glEnable(GL_LIGHTING)
-			glEndList()
-			self.needsIndexDisplayUpdate = False
-		glCallList(self.IndexDisplayList)
+	#Return (bvh, X, tris, face): a TriangleBVH over the fan triangulation
+	#of the faces, along with the vertex positions, the triangles and the
+	#face that each triangle came from.  It's built on the first ray query
+	#and cached until the mesh changes (see getGeometryCache())
+	def getBVH(self):
+		cache = self.getGeometryCache()
+		if not 'bvh' in cache:
+			X = np.array(self.getVertexPositions(), dtype = np.float64)
+			(tris, face) = getFanTriangles(*self.getFaceIndices())
+			cache['bvh'] = (TriangleBVH(X, tris), X, tris, face)
+		return cache['bvh']
+	
+	#Cast a ray from the point P0 in the direction V (Point3D/Vector3D)
+	#Returns [t, hit point, face index, [i, j, k], [a, b, c]] for the closest
+	#face that the ray hits, where [i, j, k] are the vertex indices of the
+	#triangle of the face that was hit and [a, b, c] are the barycentric
+	#coordinates of the hit point in that triangle, or None if it misses
+	def castRay(self, P0, V, tMin = 0.0):
+		(bvh, X, tris, face) = self.getBVH()
+		hit = bvh.intersectRay([P0.x, P0.y, P0.z], [V.x, V.y, V.z], tMin)
+		if not hit:
+			return None
+		[t, tri, u, v] = [float(hit[0]), hit[1], float(hit[2]), float(hit[3])]
+		return [t, P0 + t*V, int(face[tri]), tris[tri].tolist(), [1.0 - u - v, u, v]]
 	
-	#Slow version with no spatial subdivision
+	#Return [t, Point, Face] for the closest face that the Ray3D hits (in
+	#lazy topology mode Face is the face index), or None if it misses
 	def getRayIntersection(self, ray):
-		t = float("inf")
-		Point = None
-		Face = None
-		for f in self.faces:
-			intersection = ray.intersectMeshFace(f)
-			if intersection != None:
-				if intersection[0] < t:
-					t = intersection[0]
-					Point = intersection[1]
-					Face = f
-		if isinstance(Point, Point3D):
-			return [t, Point, Face]
-		return None
+		hit = self.castRay(ray.P0, ray.V)
+		if not hit:
+			return None
+		[t, P, face, tri, bary] = hit
+		if self.lazyArrays is None:
+			return [t, P, self.faces[face]]
+		return [t, P, face]
+	
+	#Pick the face under the pixel (x, y) of a pixWidth x pixHeight viewport
+	#of the camera (y going up from the bottom).  Returns the same thing as
+	#castRay()
+	def pickFace(self, camera, x, y, pixWidth, pixHeight):
+		ray = getRayThroughPixel(camera, x, y, pixWidth, pixHeight)
+		return self.castRay(ray.P0, ray.V)
+	
+	#Pick the visible vertex that projects closest to the pixel (x, y), if
+	#it's within tolerance pixels.  Returns its index, or -1 if there isn't one
+	def pickVertex(self, camera, x, y, pixWidth, pixHeight, tolerance = PICK_TOLERANCE):
+		(bvh, X, tris, face) = self.getBVH()
+		#Usually the closest vertex is on one of the triangles touching the
+		#triangle under the mouse
+		hit = self.pickFace(camera, x, y, pixWidth, pixHeight)
+		if hit:
+			cache = self.getGeometryCache()
+			if not 'vertexTriangles' in cache:
+				#Triangles attached to each vertex, in compressed row format
+				order = np.argsort(tris.flatten(), kind = 'mergesort')
+				counts = np.bincount(tris.flatten(), minlength = X.shape[0])
+				cache['vertexTriangles'] = (np.cumsum(counts) - counts, counts, order/3)
+			(starts, counts, triIdx) = cache['vertexTriangles']
+			ring = [triIdx[starts[i]:starts[i] + counts[i]] for i in hit[3]]
+			idx = np.unique(tris[np.concatenate(ring)].flatten())
+			(pixels, depth) = projectToPixels(camera, X[idx], pixWidth, pixHeight)
+			dists = np.sqrt((pixels[:, 0] - x)**2 + (pixels[:, 1] - y)**2)
+			if dists.min() <= tolerance:
+				return int(idx[np.argmin(dists)])
+		#Otherwise (e.g. near the silhouette) look at all of the vertices
+		#that project near the mouse and keep the ones that nothing hides
+		(pixels, depth) = projectToPixels(camera, X, pixWidth, pixHeight)
+		dists = np.sqrt((pixels[:, 0] - x)**2 + (pixels[:, 1] - y)**2)
+		idx = np.arange(X.shape[0])[(depth > 0) & (dists <= tolerance)]
+		if idx.size == 0:
+			return -1
+		eye = np.array([camera.eye.x, camera.eye.y, camera.eye.z])
+		occluded = bvh.occludedRays(np.tile(eye, (idx.size, 1)), X[idx] - eye, 0.0, 1.0 - PICK_OCCLUSION_EPS)
+		idx = idx[~occluded]
+		if idx.size == 0:
+			return -1
+		return int(idx[np.argmin(dists[idx])])
 	
 	def __str__(self):
+		if self.lazyArrays is not None:
+			nV = self.lazyArrays['VPos'].shape[0]
+			nF = self.lazyArrays['faceCounts'].shape[0]
+			return "PolyMesh Object: NVertices = %i, NFaces = %i (lazy topology)"%(nV, nF)
 		nV = len(self.vertices)
 		nE = len(self.edges)
 		nF = len(self.faces)
 		topology = nV-nE+nF
 		return "PolyMesh Object: NVertices = %i, NEdges = %i, NFaces = %i, topology=%i"%(nV, nE, nF, topology)	
 
-#Helper function for getBoxMesh and addFaceTiles
-def makeBoxEdge(mesh, v1, v2, stepSize):
+#############################################################
+####                PRIMITIVE GENERATORS                #####
+#############################################################
+
+#Canonical primitives are cached as a layout (VPos, faces): an Nx3 array of
+#vertex positions and a list of per-face vertex index lists.  Scenes with
+#hundreds of identical boxes or spheres only lay out the topology once, and
+#every request builds a fresh mesh from the scaled/translated layout
+PRIMITIVE_CACHE_SIZE = 32
+PRIMITIVE_CACHE = OrderedDict()
+
+#Return the cached layout stored under key (least recently used entries
+#are evicted first), calling makeLayout() to create it on a miss.  The
+#returned layout is shared and must not be modified
+def getCachedPrimitive(key, makeLayout):
+	if key in PRIMITIVE_CACHE:
+		layout = PRIMITIVE_CACHE.pop(key)
+	else:
+		(VPos, faces) = makeLayout()
+		VPos = np.array(VPos, dtype = np.float64).reshape((-1, 3))
+		VPos.flags.writeable = False
+		layout = (VPos, [tuple(f) for f in faces])
+	PRIMITIVE_CACHE[key] = layout
+	while len(PRIMITIVE_CACHE) > PRIMITIVE_CACHE_SIZE:
+		PRIMITIVE_CACHE.popitem(last = False)
+	return layout
+
+#Build a new mesh from the cached layout under key, with every vertex
+#position P mapped to P*scale + offset
+def getPrimitiveMesh(key, makeLayout, scale = None, offset = None):
+	(VPos, faces) = getCachedPrimitive(key, makeLayout)
+	if scale is not None:
+		VPos = VPos*np.array(scale, dtype = np.float64)
+	if offset is not None:
+		VPos = VPos + np.array(offset, dtype = np.float64)
+	mesh = PolyMesh()
+	mesh.buildFromArrays(VPos, faces, checkFaces = False)
+	return mesh
+
+#Return the layout (VPos, faces) of an existing mesh
+def getMeshLayout(mesh):
+	VPos = mesh.getVertexPositions()
+	faces = [[v.ID for v in f.getVertices()] for f in mesh.faces]
+	return (VPos, faces)
+
+#Split every triangle of (X, tris) into four by adding a vertex at the
+#midpoint of each edge.  Vertices and faces come out in the same order
+#as PolyMesh.evenTriangleRemesh: midpoints are numbered in the order
+#their edges are first seen walking the faces, and each triangle [A, B, C]
+#becomes its three corner triangles followed by the center triangle
+def subdivideTriangleArrays(X, tris):
+	NV = X.shape[0]
+	E = tris[:, [0, 1, 1, 2, 2, 0]].reshape((-1, 2))
+	keys = np.minimum(E[:, 0], E[:, 1])*NV + np.maximum(E[:, 0], E[:, 1])
+	(first, inverse) = np.unique(keys, return_index = True, return_inverse = True)[1:]
+	order = np.argsort(first)
+	rank = np.zeros(len(first), dtype = np.int64)
+	rank[order] = np.arange(len(first))
+	E = E[first[order]]
+	XMid = 0.5*(X[E[:, 0]] + X[E[:, 1]])
+	M = (NV + rank[inverse]).reshape((-1, 3))
+	[A, B, C] = [tris[:, 0], tris[:, 1], tris[:, 2]]
+	newTris = np.array([[M[:, 0], B, M[:, 1]], [M[:, 1], C, M[:, 2]], [M[:, 2], A, M[:, 0]], [M[:, 0], M[:, 1], M[:, 2]]])
+	newTris = newTris.transpose((2, 0, 1)).reshape((-1, 3))
+	return (np.concatenate((X, XMid), 0), newTris)
+
+#Subdivide (X, tris) nIters times, pushing the vertices out onto the unit
+#sphere after every pass
+def getSubdividedSphereLayout(X, tris, nIters):
+	X = np.array(X, dtype = np.float64)
+	tris = np.array(tris, dtype = np.int64)
+	for i in range(nIters):
+		(X, tris) = subdivideTriangleArrays(X, tris)
+		X = X/np.sqrt(np.sum(X**2, 1))[:, None]
+	return (X, tris.tolist())
+
+#Helper function for getBoxMesh and addFaceTiles: return the indices of
+#the vertices from VPos[i1] to VPos[i2], appending evenly spaced vertices
+#in between to VPos so that each piece is about stepSize long
+def makeBoxEdge(VPos, i1, i2, stepSize):
 	if stepSize < 0:
-		return [v1, v2]
-	verts = [v1]
-	direc = v2.pos - v1.pos
-	frac = stepSize/direc.Length()
+		return [i1, i2]
+	verts = [i1]
+	[P1, P2] = [VPos[i1], VPos[i2]]
+	direc = [P2[k] - P1[k] for k in range(3)]
+	frac = stepSize/(direc[0]**2.0 + direc[1]**2.0 + direc[2]**2.0)**0.5
 	#Round to the nearest integer number of tiles
 	N = int(math.floor(1.0/frac+0.5))
 	if N == 0:
 		N = 1
 	frac = 1.0/float(N)
 	for i in range(1, N):
-		newVert = mesh.addVertex(v1.pos+direc*frac*i)
-		verts.append(newVert)
-	verts.append(v2)
+		VPos.append([P1[k] + direc[k]*frac*i for k in range(3)])
+		verts.append(len(VPos)-1)
+	verts.append(i2)
 	return verts
 
-#Helper function for getBoxMesh
-def addFaceTiles(mesh, stepSize, ebott, eright, etop, eleft):
+#Helper function for getBoxMesh: append the square tiles of one face,
+#given the vertex indices along its four sides
+def addFaceTiles(VPos, faces, stepSize, ebott, eright, etop, eleft):
 	topRow = etop
-	index = 1
 	for index in range(1, len(eleft)):
 		bottomRow = None
 		if index == len(eleft)-1:
 			bottomRow = ebott
 		else:
-			bottomRow = makeBoxEdge(mesh, eleft[index], eright[index], stepSize)
+			bottomRow = makeBoxEdge(VPos, eleft[index], eright[index], stepSize)
 		#Now add the square faces on this part
 		for i in range(0, len(topRow)-1):
-			mesh.addFace([bottomRow[i], bottomRow[i+1], topRow[i+1], topRow[i]])
+			faces.append([bottomRow[i], bottomRow[i+1], topRow[i+1], topRow[i]])
 		topRow = bottomRow
 
-#L is length along z
-#W is width along x
-#H is height along y
-#stepSize is the length of each square tile.  By default there are no tiles
-#(stepSize = -1).  If one of the sides is not an integer multiple of the step size,
-#then round to the nearest step size that would make it an integer multiple along
-#that dimension
-def getBoxMesh(L = 1.0, W = 1.0, H = 1.0, C = Point3D(0, 0, 0), stepSize = -1):
-	mesh = PolyMesh()
-	endpoints = []
+#Layout of a box centered at the origin (see getBoxMesh)
+def getBoxLayout(L, W, H, stepSize):
+	VPos = []
+	faces = []
 	for dZ in [L/2.0, -L/2.0]:
 		for dH in [-H/2.0, H/2.0]:
 			for dW in [-W/2.0, W/2.0]:
-				endpoints.append(mesh.addVertex(C+Point3D(dW, dH, dZ)))
+				VPos.append([dW, dH, dZ])
 	edgeIndices = [[0, 1], [1, 3], [3, 2], [2, 0], [1, 5], [5, 7], [7, 3], [7, 6], [6, 2], [0, 4], [4, 6], [4, 5]]
-	edges = []
-	edgesRev = []
-	for edgePointers in edgeIndices:
-		[v1, v2] = [endpoints[edgePointers[0]], endpoints[edgePointers[1]]]
-		edges.append(makeBoxEdge(mesh, v1, v2, stepSize))
-	for edge in edges:
-		edgeRev = edge[:]
-		edgeRev.reverse()
-		edgesRev.append(edgeRev)
-	#def addFaceTiles(mesh, stepSize, ebott, eright, etop, eleft):
+	edges = [makeBoxEdge(VPos, i1, i2, stepSize) for [i1, i2] in edgeIndices]
+	edgesRev = [edge[::-1] for edge in edges]
+	#addFaceTiles(VPos, faces, stepSize, ebott, eright, etop, eleft)
 	#Front Face
-	addFaceTiles(mesh, stepSize, edges[0], edgesRev[1], edgesRev[2], edges[3])
+	addFaceTiles(VPos, faces, stepSize, edges[0], edgesRev[1], edgesRev[2], edges[3])
 	#Back Face
-	addFaceTiles(mesh, stepSize, edgesRev[11], edgesRev[10], edges[7], edgesRev[5])
+	addFaceTiles(VPos, faces, stepSize, edgesRev[11], edgesRev[10], edges[7], edgesRev[5])
 	#Left Face
-	addFaceTiles(mesh, stepSize, edgesRev[9], edges[3], edges[8], edgesRev[10])
+	addFaceTiles(VPos, faces, stepSize, edgesRev[9], edges[3], edges[8], edgesRev[10])
 	#Right Face
-	addFaceTiles(mesh, stepSize, edges[4], edgesRev[5], edgesRev[6], edgesRev[1])
+	addFaceTiles(VPos, faces, stepSize, edges[4], edgesRev[5], edgesRev[6], edgesRev[1])
 	#Top Face
-	addFaceTiles(mesh, stepSize, edgesRev[2], edges[6], edgesRev[7], edges[8])
+	addFaceTiles(VPos, faces, stepSize, edgesRev[2], edges[6], edgesRev[7], edges[8])
 	#Bottom Face
-	addFaceTiles(mesh, stepSize, edges[11], edges[4], edges[0], edges[9])
-	return mesh
+	addFaceTiles(VPos, faces, stepSize, edges[11], edges[4], edges[0], edges[9])
+	return (VPos, faces)
+
+#L is length along z
+#W is width along x
+#H is height along y
+#stepSize is the length of each square tile.  By default there are no tiles
+#(stepSize = -1).  If one of the sides is not an integer multiple of the step size,
+#then round to the nearest step size that would make it an integer multiple along
+#that dimension
+def getBoxMesh(L = 1.0, W = 1.0, H = 1.0, C = Point3D(0, 0, 0), stepSize = -1):
+	if stepSize < 0:
+		#All untiled boxes share the unit box layout
+		return getPrimitiveMesh(('box',), lambda: getBoxLayout(1.0, 1.0, 1.0, -1), [W, H, L], [C.x, C.y, C.z])
+	return getPrimitiveMesh(('box', L, W, H, stepSize), lambda: getBoxLayout(L, W, H, stepSize), None, [C.x, C.y, C.z])
 
 def getRectMesh(P0, P1, P2, P3, stepSize = -1):
-	mesh = PolyMesh()
-	endpoints = [P0, P1, P2, P3]
-	for i in range(0, len(endpoints)):
-		endpoints[i] = mesh.addVertex(endpoints[i])
+	VPos = [[P.x, P.y, P.z] for P in [P0, P1, P2, P3]]
+	faces = []
 	edgeIndices = [[0, 1], [2, 1], [3, 2], [3, 0]]
-	edges = []
-	for edgePointers in edgeIndices:
-		[v1, v2] = [endpoints[edgePointers[0]], endpoints[edgePointers[1]]]
-		edges.append(makeBoxEdge(mesh, v1, v2, stepSize))
-	addFaceTiles(mesh, stepSize, edges[0], edges[1], edges[2], edges[3])
+	edges = [makeBoxEdge(VPos, i1, i2, stepSize) for [i1, i2] in edgeIndices]
+	addFaceTiles(VPos, faces, stepSize, edges[0], edges[1], edges[2], edges[3])
+	mesh = PolyMesh()
+	mesh.buildFromArrays(VPos, faces)
 	return mesh
 
+def getTetrahedronLayout():
+	VPos = [[-1, 1, 1], [1, -1, 1], [1, 1, -1], [-1, -1, -1]]
+	faces = [[0, 1, 2], [1, 3, 2], [2, 3, 0], [3, 1, 0]]
+	return (VPos, faces)
+
 def getTetrahedronMesh():
-	mesh = PolyMesh()
-	v1 = mesh.addVertex(Point3D(-1, 1, 1))
-	v2 = mesh.addVertex(Point3D(1, -1, 1))
-	v3 = mesh.addVertex(Point3D(1, 1, -1))
-	v4 = mesh.addVertex(Point3D(-1, -1, -1))
-	mesh.addFace([v1, v2, v3])
-	mesh.addFace([v2, v4, v3])
-	mesh.addFace([v3, v4, v1])
-	mesh.addFace([v4, v2, v1])
-	return mesh
+	return getPrimitiveMesh(('tetrahedron',), getTetrahedronLayout)
+
+def getOctahedronLayout():
+	VPos = [[0, 0, 1], [1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, -1], [-1, 0, 0]]
+	#Top part followed by bottom part
+	faces = [[2, 0, 1], [2, 1, 4], [2, 4, 5], [2, 5, 0], [0, 3, 1], [1, 3, 4], [4, 3, 5], [5, 3, 0]]
+	return (VPos, faces)
 
 def getOctahedronMesh():
-	mesh = PolyMesh()
-	v1 = mesh.addVertex(Point3D(0, 0, 1))
-	v2 = mesh.addVertex(Point3D(1, 0, 0))
-	v3 = mesh.addVertex(Point3D(0, 1, 0))
-	v4 = mesh.addVertex(Point3D(0, -1, 0))
-	v5 = mesh.addVertex(Point3D(0, 0, -1))
-	v6 = mesh.addVertex(Point3D(-1, 0, 0))
-	#Top Part
-	mesh.addFace([v3, v1, v2])
-	mesh.addFace([v3, v2, v5])
-	mesh.addFace([v3, v5, v6])
-	mesh.addFace([v3, v6, v1])
-	#Bottom Part
-	mesh.addFace([v1, v4, v2])
-	mesh.addFace([v2, v4, v5])
-	mesh.addFace([v5, v4, v6])
-	mesh.addFace([v6, v4, v1])
-	return mesh
+	return getPrimitiveMesh(('octahedron',), getOctahedronLayout)
 
-def getIcosahedronMesh():
+def makeIcosahedronMesh():
 	mesh = PolyMesh()
 	phi = (1+math.sqrt(5))/2
 	#Use the unit cube to help construct the icosahedron
@@ -1428,9 +2787,12 @@ def getIcosahedronMesh():
 	
 	return mesh
 
-def getDodecahedronMesh():
+def getIcosahedronMesh():
+	return getPrimitiveMesh(('icosahedron',), lambda: getMeshLayout(makeIcosahedronMesh()))
+
+def makeDodecahedronMesh():
 	#Use icosahedron dual to help construct this
-	icosa = getIcosahedronMesh()
+	icosa = makeIcosahedronMesh()
 	mesh = PolyMesh()
 	#Add the vertex associated with each icosahedron face
 	for f in icosa.faces:
@@ -1447,44 +2809,32 @@ def getDodecahedronMesh():
 		mesh.addFace(verts)
 	return mesh
 
+def getDodecahedronMesh():
+	return getPrimitiveMesh(('dodecahedron',), lambda: getMeshLayout(makeDodecahedronMesh()))
+
+def getHemiOctahedronLayout():
+	VPos = [[0, 0, 1], [1, 0, 0], [0, 1, 0], [0, -1, 0], [-1, 0, 0]]
+	#Top part followed by bottom part
+	faces = [[2, 0, 1], [2, 4, 0], [0, 3, 1], [4, 3, 0]]
+	return (VPos, faces)
+
 def getHemiOctahedronMesh():
-	mesh = PolyMesh()
-	v1 = mesh.addVertex(Point3D(0, 0, 1))
-	v2 = mesh.addVertex(Point3D(1, 0, 0))
-	v3 = mesh.addVertex(Point3D(0, 1, 0))
-	v4 = mesh.addVertex(Point3D(0, -1, 0))
-	v6 = mesh.addVertex(Point3D(-1, 0, 0))
-	#Top Part
-	mesh.addFace([v3, v1, v2])
-	mesh.addFace([v3, v6, v1])
-	#Bottom Part
-	mesh.addFace([v1, v4, v2])
-	mesh.addFace([v6, v4, v1])
-	return mesh
+	return getPrimitiveMesh(('hemioctahedron',), getHemiOctahedronLayout)
 
+#Subdivide an octahedron nIters times, moving the points so that they're
+#R away from the origin (with nIters = 0 the unit octahedron is returned)
 def getSphereMesh(R, nIters):
-	mesh = getOctahedronMesh()
-	for i in range(nIters):
-		mesh.evenTriangleRemesh()
-		#Move points so that they're R away from the origin
-		for v in mesh.vertices:
-			P = v.pos
-			L = P.Length()
-			scale = R/L
-			v.pos = scale*P
-	return mesh
+	if nIters == 0:
+		return getOctahedronMesh()
+	makeLayout = lambda: getSubdividedSphereLayout(*(getOctahedronLayout() + (nIters,)))
+	return getPrimitiveMesh(('sphere', nIters), makeLayout, [R, R, R])
 
+#Same as getSphereMesh, starting from the hemi-octahedron
 def getHemiSphereMesh(R, nIters):
-	mesh = getHemiOctahedronMesh()
-	for i in range(nIters):
-		mesh.evenTriangleRemesh()
-		#Move points so that they're R away from the origin
-		for v in mesh.vertices:
-			P = v.pos
-			L = P.Length()
-			scale = R/L
-			v.pos = scale*P
-	return mesh	
+	if nIters == 0:
+		return getHemiOctahedronMesh()
+	makeLayout = lambda: getSubdividedSphereLayout(*(getHemiOctahedronLayout() + (nIters,)))
+	return getPrimitiveMesh(('hemisphere', nIters), makeLayout, [R, R, R])
 
 if __name__ == '__main__2':
 	mesh = PolyMesh()
@@ -6,7 +6,6 @@ import math
 from numpy import matrix
 import numpy as np
 import numpy.linalg as linalg
-import matplotlib.pyplot as plt
 
 #############################################################
 ####                 PRIMITIVE CLASSES                  #####
@@ -607,6 +606,7 @@ def printPointsList(L, name):
 			print "]"
 
 if __name__ == '__main__':
+	import matplotlib.pyplot as plt
 	Vs = [Point3D(0.00360787, 0.0590845, -0.0482064), Point3D(0.0396016, 0.0424315, -0.0762202), Point3D(0.0301187, 0.0612541, -0.0644878)]
 	P = Point3D(0.0142555, 0.0875641, -0.0460397)
 #	Vs = [Point3D(0, 0, 0), Point3D(1, 0, 0), Point3D(0, 1, 0)]
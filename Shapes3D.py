@@ -1,5 +1,4 @@
 from Primitives3D import *
-from OpenGL.GL import *
 import sys
 
 
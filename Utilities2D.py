@@ -7,7 +7,6 @@
 from Primitives3D import *
 import numpy as np
 import numpy.linalg as linalg
-import matplotlib.pyplot as plt
 
 #This helper function is used to print 2D polygons
 #as parallel lists of x and y coordinates
@@ -243,6 +242,7 @@ def getBarycentricCoords(A, B, C, X, checkValidity = True):
 		if (lambdas[0] < 0 or lambdas[1] < 0 or lambdas[2] < 0):
 			print "ERROR: Not a convex combination; lambda = %s"%lambdas
 			print "pointInsideConvexPolygon2D = %s"%pointInsideConvexPolygon2D([A, B, C], X, 0)
+			import matplotlib.pyplot as plt
 			plt.plot([A.x, B.x, C.x, A.x], [A.y, B.y, C.y, A.y], 'r')
 			plt.hold(True)
 			plt.plot([X.x], [X.y], 'b.')
@@ -7,22 +7,10 @@ from PolyMesh import *
 from Cameras3D import *
 from EMScene import *
 from Beam3D import *
-import Image
 from sys import argv
 
 DRAW_BACKPROJECTED = True
 
-def splitIntoRGBA(val):
-	A = (0xff000000&val)>>24
-	R = (0x00ff0000&val)>>16
-	G = (0x0000ff00&val)>>8
-	B = (0x000000ff&val)
-	return [R, G, B, A]
-
-def extractFromRGBA(R, G, B, A):
-	A = 0
-	return (((A<<24)&0xff000000) | ((R<<16)&0x00ff0000) | ((G<<8)&0x0000ff00) | (B&0x000000ff))
-
 class Viewer(object):
 	def updateCameraVars(self):
 		self.yfov = self.camera.yfov
@@ -31,7 +19,6 @@ class Viewer(object):
 		self.farDist = 100.0
 		self.xScale = math.tan(self.xfov/2.0)
 		self.yScale = math.tan(self.yfov/2.0)
-		self.pickingFace = False
 
 	def __init__(self, filename):
 		#GLUT State variables
@@ -73,9 +60,7 @@ class Viewer(object):
 		glutPostRedisplay()
 
 	def GLUTRedraw(self):
-		N = len(self.meshFaces)
-		[Rclear, Gclear, Bclear, Aclear] = splitIntoRGBA(N)
-		glClearColor(Rclear, Gclear, Bclear, Aclear)
+		glClearColor(0.0, 0.0, 0.0, 0.0)
 		glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 		
 		#First draw the 3D beam scene on the left
@@ -86,87 +71,70 @@ class Viewer(object):
 		gluPerspective(180.0*self.camera.yfov/math.pi, 1.0, 0.01, 100.0)
 		
 		self.camera.gotoCameraFrame()
-		if self.pickingFace:
-			self.pickFace()
+		glLightfv(GL_LIGHT0, GL_POSITION, [3.0, 4.0, 5.0, 0.0]);
+		glLightfv(GL_LIGHT1, GL_POSITION,  [-3.0, -2.0, -3.0, 0.0]);
+	
+		glEnable(GL_LIGHTING)
+		
+		if self.sceneTransparent:
+			glDisable(GL_DEPTH_TEST)
 		else:
-			glLightfv(GL_LIGHT0, GL_POSITION, [3.0, 4.0, 5.0, 0.0]);
-			glLightfv(GL_LIGHT1, GL_POSITION,  [-3.0, -2.0, -3.0, 0.0]);
+			glEnable(GL_DEPTH_TEST)
+		self.scene.renderGL()
 		
-			glEnable(GL_LIGHTING)
-			
-			if self.sceneTransparent:
-				glDisable(GL_DEPTH_TEST)
-			else:
-				glEnable(GL_DEPTH_TEST)
-			self.scene.renderGL()
-			
-			if self.selectedFace:
-				glDisable(GL_LIGHTING)
-				glDisable(GL_DEPTH_TEST)
-				glColor3f(1, 0, 0)
-				self.selectedFace.drawBorder()
-				glEnable(GL_DEPTH_TEST)
-			
-			if self.scene.Source:
-				glDisable(GL_LIGHTING)
-				glColor3f(1, 0, 0)
-				P = self.scene.Source
-				quadric = gluNewQuadric()
-				glPushMatrix()
-				glTranslatef(P.x, P.y, P.z)
-				gluSphere(quadric, 0.1, 32, 32)
-				glPopMatrix()
+		if self.selectedFace:
+			glDisable(GL_LIGHTING)
+			glDisable(GL_DEPTH_TEST)
+			glColor3f(1, 0, 0)
+			self.selectedFace.drawBorder()
+			glEnable(GL_DEPTH_TEST)
+		
+		if self.scene.Source:
+			glDisable(GL_LIGHTING)
+			glColor3f(1, 0, 0)
+			P = self.scene.Source
+			quadric = gluNewQuadric()
+			glPushMatrix()
+			glTranslatef(P.x, P.y, P.z)
+			gluSphere(quadric, 0.1, 32, 32)
+			glPopMatrix()
+		
+		if self.drawBeam:
+			beam = self.beamTree.root.children[self.beamIndex]
+			beam.drawBeam()
 			
-			if self.drawBeam:
-				beam = self.beamTree.root.children[self.beamIndex]
-				beam.drawBeam()
-				
-				if self.drawChildren:
-					for child in beam.children:
-						if DRAW_BACKPROJECTED:
-							child.drawBackProjected(self.meshFaces)
-						child.drawBeam()
-						for child2 in child.children:
-							child2.drawBeam()
+			if self.drawChildren:
+				for child in beam.children:
+					if DRAW_BACKPROJECTED:
+						child.drawBackProjected(self.meshFaces)
+					child.drawBeam()
+					for child2 in child.children:
+						child2.drawBeam()
+		
+		#Next draw the 2D projection scene on the right
+		dim = self.pixWidth - 800
+		glViewport(800, 0, dim, dim)
+		glScissor(800, 0, dim, dim)
+		if len(beam.children) > 0:
+			beam.children[0].drawProjectedMeshFaces(self.meshFaces, dim, self.toggleDrawSplits)
 			
-			#Next draw the 2D projection scene on the right
-			dim = self.pixWidth - 800
-			glViewport(800, 0, dim, dim)
-			glScissor(800, 0, dim, dim)
-			if len(beam.children) > 0:
-				beam.children[0].drawProjectedMeshFaces(self.meshFaces, dim, self.toggleDrawSplits)
-				
-			glutSwapBuffers()
+		glutSwapBuffers()
 	
+	#Select the face under the mouse in the 800x800 beam view on the left
+	#by casting the mouse ray against the meshes
 	def pickFace(self):
-		glDisable(GL_LIGHTING)
-		N = len(self.meshFaces)
-		for i in range(0, len(self.meshFaces)):
-			face = self.meshFaces[i]
-			[R, G, B, A] = splitIntoRGBA(i)
-			glColor4ub(R, G, B, A)
-			face.drawFilled()
-		glutSwapBuffers()
-		[xdim, ydim] = [self.pixWidth, self.pixHeight]
-		pixels = glReadPixelsb(0, 0, 800, 800, GL_RGBA, GL_UNSIGNED_BYTE)
-		#im = Image.new("RGB", (800, 800))
-		#pix = im.load()
-		#for x in range(0, 800):
-		#	for y in range(0, 800):
-		#		pix[x, y] = (pixels[x][y][0], pixels[x][y][1], pixels[x][y][2])
-		#im.save("out.png")
-		#print len(pixels)
-		#print len(pixels[0])
 		[x, y] = [self.GLUTmouse[0], self.GLUTmouse[1]]
-		pixel = pixels[y][x]
-		faceIndex = extractFromRGBA(pixel[0], pixel[1], pixel[2], pixel[3])
-		if faceIndex < N:
-			self.selectedFace = self.meshFaces[faceIndex]
+		if x >= 800 or y >= 800:
+			return
+		closest = None
+		for mesh in self.scene.meshes:
+			hit = mesh.pickFace(self.camera, x, y, 800, 800)
+			if hit and (not closest or hit[0] < closest[0]):
+				closest = [hit[0], mesh.faces[hit[2]]]
+		if closest:
+			self.selectedFace = closest[1]
 		else:
-			print "ERROR: No face exists at that location (faceIndex %i)"%faceIndex
-			[R, G, B, A] = splitIntoRGBA(faceIndex)
-			print "(R, G, B, A) = (%i, %i, %i, %i)"%(R, G, B, A)
-		self.pickingFace = False
+			print "No face exists at that location"
 		glutPostRedisplay()
 	
 	def handleMouseStuff(self, x, y):
@@ -216,7 +184,7 @@ class Viewer(object):
 		if state == GLUT_DOWN:
 			self.GLUTButton[buttonMap[button]] = 1
 			if button == GLUT_MIDDLE_BUTTON:
-				self.pickingFace = True
+				self.pickFace()
 		else:
 			self.GLUTButton[buttonMap[button]] = 0
 		glutPostRedisplay()
@@ -0,0 +1,63 @@
+#Import-time benchmark for the compute-only modules.  Every module is
+#imported in a fresh interpreter, which reports how long the import took
+#and which rendering/plotting packages it pulled in.  Exits with status 1 if
+#a module goes over the time budget or imports OpenGL, wx, matplotlib or PIL,
+#so headless workers (e.g. meshBatch.py) keep starting up quickly
+#Usage: python benchmarkImports.py [budget in seconds (default 0.5)]
+import subprocess
+import sys
+import os
+
+COMPUTE_MODULES = ['Primitives3D', 'Shapes3D', 'PolyMesh', 'Graphics3D', 'MeshStreaming', 'LaplacianMesh', 'PointCloud', 'ICP', 'PRST', 'Geodesics', 'GMDS', 'Cameras3D', 'BVH3D', 'Beam3D', 'EMScene', 'meshBatch', 'emCoverage']
+FORBIDDEN_PACKAGES = ['OpenGL', 'wx', 'matplotlib', 'pylab', 'PIL', 'Image']
+DEFAULT_BUDGET = 0.5
+
+#Code run in the fresh interpreter; prints the import time and the
+#forbidden packages that ended up in sys.modules
+IMPORT_SCRIPT = """
+import sys, time
+tic = time.time()
+import %s
+print time.time() - tic
+print 'packages:' + ' '.join(sorted(set([m.split('.')[0] for m in sys.modules.keys() if m.split('.')[0] in %r])))
+"""
+
+#Returns (import time in seconds, [forbidden packages]) or raises
+#RuntimeError if the module fails to import
+def timeImport(module):
+	root = os.path.dirname(os.path.abspath(__file__))
+	proc = subprocess.Popen([sys.executable, '-c', IMPORT_SCRIPT%(module, FORBIDDEN_PACKAGES)], cwd = root, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+	(out, err) = proc.communicate()
+	if proc.returncode != 0:
+		raise RuntimeError(err.strip())
+	lines = out.strip().split('\n')
+	return (float(lines[-2]), lines[-1].split(':', 1)[1].split())
+
+def main(budget):
+	failed = []
+	for module in COMPUTE_MODULES:
+		try:
+			(t, packages) = timeImport(module)
+		except RuntimeError as err:
+			print "%-14s FAILED TO IMPORT\n%s"%(module, err)
+			failed.append(module)
+			continue
+		status = "ok"
+		if t > budget:
+			status = "OVER BUDGET"
+		if len(packages) > 0:
+			status = "IMPORTS %s"%", ".join(packages)
+		if status != "ok":
+			failed.append(module)
+		print "%-14s %.3fs  %s"%(module, t, status)
+	if len(failed) > 0:
+		print "\n%i of %i modules failed (budget %gs): %s"%(len(failed), len(COMPUTE_MODULES), budget, ", ".join(failed))
+		return 1
+	print "\nAll %i modules imported within %gs"%(len(COMPUTE_MODULES), budget)
+	return 0
+
+if __name__ == '__main__':
+	budget = DEFAULT_BUDGET
+	if len(sys.argv) > 1:
+		budget = float(sys.argv[1])
+	sys.exit(main(budget))
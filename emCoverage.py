@@ -0,0 +1,113 @@
+#Headless received-power coverage maps.  Loads an EMScene, builds the
+#virtual source tree once, and computes the received power at every point
+#of a 2D or 3D grid of receivers, tiled across a pool of worker processes.
+#The result is saved as a NumPy array (.npy, linear power relative to the
+#transmitted power) or, for 2D grids, as an image in dB (.png).  With
+#--checkpoint, finished tiles are saved as they come in, and running the
+#same command again picks up where an interrupted run left off
+#
+#Example (floor plan at height 0.5 of test.xml with 10cm spacing, at
+#2.4GHz with the paths adding coherently, 4 processes at a time):
+#python emCoverage.py test.xml --bounds -2 0.5 -3 2 0.5 3 --step 0.1 -f 2400 --coherent -j 4 -o coverage.png
+#
+#A band is sampled with --band (e.g. --band 2400 2500 11), and the power
+#is averaged over its frequencies
+from EMScene import *
+import argparse
+import multiprocessing
+import time
+import sys
+
+#Range of the image in dB below its maximum
+IMAGE_DB_RANGE = 60.0
+
+#Return the PIL Image module (from Pillow, or from an old standalone PIL)
+def getImageModule():
+	try:
+		from PIL import Image
+	except ImportError, err:
+		import Image
+	return Image
+
+#Save a 2D coverage map as an image, with the first grid dimension going
+#to the right and the second going up.  The power is shown in dB from
+#IMAGE_DB_RANGE below its maximum (blue) to the maximum (red)
+def saveCoverageImage(power, filename):
+	Image = getImageModule()
+	dB = 10*np.log10(np.maximum(power, 1e-300))
+	dBMax = np.max(dB)
+	t = np.clip((dB - (dBMax - IMAGE_DB_RANGE))/IMAGE_DB_RANGE, 0, 1)
+	#Blue => cyan => yellow => red
+	colors = np.array([[0, 0, 255], [0, 255, 255], [255, 255, 0], [255, 0, 0]], dtype = np.float64)
+	x = t*(colors.shape[0] - 1)
+	i = np.minimum(np.floor(x).astype(np.int64), colors.shape[0] - 2)
+	x = (x - i)[:, :, None]
+	rgb = (1 - x)*colors[i] + x*colors[i+1]
+	rgb = np.uint8(np.round(rgb))
+	(width, height) = power.shape
+	im = Image.new("RGB", (width, height))
+	pix = im.load()
+	for x in range(width):
+		for y in range(height):
+			pix[x, height - y - 1] = tuple(rgb[x, y].tolist())
+	im.save(filename)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description = "Compute a received power coverage map over a grid of receivers")
+	parser.add_argument('scene', help = "EMScene .xml file")
+	parser.add_argument('--bounds', nargs = 6, type = float, required = True, metavar = ('X0', 'Y0', 'Z0', 'X1', 'Y1', 'Z1'), help = "Corners of the receiver grid (make it flat in one direction for a 2D map)")
+	parser.add_argument('--step', type = float, default = 0.25, help = "Spacing of the receiver grid (default 0.25)")
+	freqs = parser.add_mutually_exclusive_group(required = True)
+	freqs.add_argument('-f', '--fmhz', type = float, help = "Frequency in MHz")
+	freqs.add_argument('--band', nargs = 3, type = float, metavar = ('FMIN', 'FMAX', 'N'), help = "Average over N frequencies from FMIN to FMAX MHz")
+	parser.add_argument('--coherent', action = 'store_true', help = "Add the paths as phasors instead of adding their powers")
+	parser.add_argument('--maxlevel', type = int, default = None, help = "Maximum number of reflections (default: from the scene)")
+	parser.add_argument('--minatten', type = float, default = None, help = "Attenuation floor for pruning the source tree (default: from the scene)")
+	parser.add_argument('--maxpathlength', type = float, default = None, help = "Maximum path length (default: from the scene)")
+	parser.add_argument('-j', '--workers', type = int, default = multiprocessing.cpu_count(), help = "Number of worker processes (default: number of CPUs)")
+	parser.add_argument('--tile', type = int, default = COVERAGE_TILE_SIZE, help = "Number of receivers per tile (default %i)"%COVERAGE_TILE_SIZE)
+	parser.add_argument('--checkpoint', default = None, help = "File to save finished tiles to and resume from")
+	parser.add_argument('-o', '--output', required = True, help = "Output file (.npy, or .png for 2D grids)")
+	opts = parser.parse_args(argv)
+	suffix = opts.output.split('.')[-1].lower()
+	if not suffix in ['npy', 'png']:
+		parser.error("The output has to be a .npy or .png file")
+	if opts.step <= 0:
+		parser.error("The grid step has to be positive")
+	fMhz = opts.fmhz
+	if opts.band:
+		fMhz = np.linspace(opts.band[0], opts.band[1], max(1, int(opts.band[2])))
+	receivers = getReceiverGrid(opts.bounds[0:3], opts.bounds[3:6], opts.step)
+	if suffix == 'png' and receivers.ndim != 3:
+		parser.error("Images can only be saved for 2D grids (the bounds have to be flat in one direction)")
+	if suffix == 'png':
+		#Fail now rather than after the whole map has been computed
+		try:
+			getImageModule()
+		except ImportError, err:
+			parser.error("Saving .png images needs PIL (%s)"%err)
+
+	tic = time.time()
+	scene = EMScene()
+	scene.Read(opts.scene, False)
+	if opts.minatten != None:
+		scene.minAtten = opts.minatten
+	if opts.maxpathlength != None:
+		scene.maxPathLength = opts.maxpathlength
+	if scene.fMhz == None:
+		scene.fMhz = np.min(fMhz)
+	scene.buildVirtualSourceTree(opts.maxlevel)
+	print "Built the source tree in %.3fs"%(time.time() - tic)
+	print "%i receivers in a %s grid"%(np.prod(receivers.shape[0:-1]), "x".join([str(n) for n in receivers.shape[0:-1]]))
+	tic = time.time()
+	power = scene.getCoverageMap(receivers, fMhz, opts.coherent, opts.workers, opts.tile, opts.checkpoint)
+	print "Computed the coverage map in %.3fs"%(time.time() - tic)
+	if suffix == 'npy':
+		np.save(opts.output, power)
+	else:
+		saveCoverageImage(power, opts.output)
+	print "=> %s"%opts.output
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
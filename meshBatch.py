@@ -0,0 +1,233 @@
+#Headless batch processing of meshes.  Applies a pipeline of PolyMesh
+#operations to every mesh in a set of files, directories or glob patterns,
+#runs the files in a pool of worker processes, and prints the progress and
+#the time spent in each stage as the files finish.  This never imports
+#OpenGL or wx, so it can run on machines without a display
+#
+#Example (keep the largest component of every .off file in meshes/, plug
+#its holes, subdivide it twice and save it as .ply in out/, 4 at a time):
+#python meshBatch.py meshes/*.off -p largest fillholes subdivide:2 -o out -f ply -j 4
+#
+#Run "python meshBatch.py --list" to see all of the operations
+from Primitives3D import *
+from PolyMesh import *
+import argparse
+import multiprocessing
+import traceback
+import glob
+import time
+import sys
+import os
+
+INPUT_SUFFIXES = ['off', 'toff', 'obj']
+OUTPUT_SUFFIXES = ['off', 'obj', 'ply']
+
+#############################################################
+####                    OPERATIONS                      #####
+#############################################################
+#Every operation takes the mesh followed by its (float) arguments, modifies
+#the mesh in place and optionally returns a string to report for that file
+
+def opWeld(mesh, tol = 0.0):
+	return "%i vertices merged"%mesh.weldVertices(tol)
+
+def opLargest(mesh):
+	mesh.deleteAllButLargestConnectedComponent()
+
+def opFillHoles(mesh):
+	mesh.fillHoles()
+
+def opTriangulate(mesh):
+	mesh.minTrianglesRemesh()
+
+def opSubdivide(mesh, nIters = 1):
+	for i in range(int(nIters)):
+		mesh.evenTriangleRemesh()
+
+def opSlice(mesh, px, py, pz, nx, ny, nz):
+	mesh.sliceBelowPlane(Plane3D(Point3D(px, py, pz), Vector3D(nx, ny, nz)))
+
+def opFlip(mesh):
+	mesh.flipNormals()
+
+def opCenter(mesh):
+	mesh.Translate(Point3D(0, 0, 0) - mesh.getCentroid())
+
+def opScale(mesh, s):
+	mesh.Scale(s, s, s)
+
+def opPCA(mesh):
+	(Axis1, Axis2, Axis3, maxProj, minProj, axes) = mesh.getPrincipalAxes()
+	extents = (maxProj - minProj).tolist()
+	return "axes %s %s %s, extents %g %g %g"%(Axis1, Axis2, Axis3, extents[0], extents[1], extents[2])
+
+def opStats(mesh):
+	if mesh.isTopologyLazy():
+		return "%i vertices, %i faces"%(mesh.getVertexPositions().shape[0], mesh.getFaceIndices()[1].shape[0])
+	return "%i vertices, %i edges, %i faces, %i boundary edges"%(len(mesh.vertices), len(mesh.edges), len(mesh.faces), len([e for e in mesh.edges if e.numAttachedFaces() < 2]))
+
+#Operation name => (function, allowed numbers of arguments, whether the
+#operation only needs the vertex positions (so a file whose whole pipeline
+#is made of such operations can be loaded in lazy topology mode), help)
+OPERATIONS = {
+	'weld':(opWeld, [0, 1], False, "weld[:tol]  Merge vertices within tol of each other (default 0)"),
+	'largest':(opLargest, [0], False, "largest  Delete all but the largest connected component"),
+	'fillholes':(opFillHoles, [0], False, "fillholes  Fill the holes in the mesh"),
+	'triangulate':(opTriangulate, [0], False, "triangulate  Split polygonal faces into triangles"),
+	'subdivide':(opSubdivide, [0, 1], False, "subdivide[:n]  Split every face with edge midpoints n times (default 1)"),
+	'slice':(opSlice, [6], False, "slice:px,py,pz,nx,ny,nz  Delete the part below the plane through P with normal N"),
+	'flip':(opFlip, [0], False, "flip  Flip the face orientations"),
+	'center':(opCenter, [0], True, "center  Move the centroid to the origin"),
+	'scale':(opScale, [1], True, "scale:s  Scale the mesh uniformly by s"),
+	'pca':(opPCA, [0], True, "pca  Report the principal axes and the extents along them"),
+	'stats':(opStats, [0], False, "stats  Report the number of vertices/edges/faces"),
+}
+
+#Parse a pipeline step of the form "name" or "name:arg1,arg2,..."
+#Returns (name, [args]) or raises ValueError
+def parseStep(step):
+	fields = step.split(':', 1)
+	name = fields[0].lower()
+	args = []
+	if len(fields) > 1 and len(fields[1]) > 0:
+		args = [float(a) for a in fields[1].split(',')]
+	if not name in OPERATIONS:
+		raise ValueError("Unknown operation \"%s\""%name)
+	if not len(args) in OPERATIONS[name][1]:
+		raise ValueError("Wrong number of arguments for \"%s\" (usage: %s)"%(name, OPERATIONS[name][3].split()[0]))
+	return (name, args)
+
+#Expand files, directories and glob patterns into a sorted list of mesh files
+def getInputFiles(inputs):
+	files = []
+	for pattern in inputs:
+		if os.path.isdir(pattern):
+			matches = [os.path.join(pattern, f) for f in os.listdir(pattern)]
+		else:
+			matches = glob.glob(pattern)
+		for f in matches:
+			if os.path.isfile(f) and f.split('.')[-1].lower() in INPUT_SUFFIXES:
+				files.append(f)
+	return sorted(set(files))
+
+def getOutputFilename(filename, outDir, outFormat):
+	(base, suffix) = os.path.splitext(os.path.basename(filename))
+	suffix = suffix[1:].lower()
+	if outFormat:
+		suffix = outFormat
+	elif not suffix in OUTPUT_SUFFIXES:
+		suffix = 'off'
+	return os.path.join(outDir, "%s.%s"%(base, suffix))
+
+#############################################################
+####                     PROCESSING                     #####
+#############################################################
+
+#Load one mesh, run the pipeline on it and save it.  This runs in the
+#worker processes, so it catches every error and reports it in the result:
+#(filename, output filename, [(stage, seconds)], [(stage, report)], error)
+def processFile(job):
+	(filename, steps, outFilename) = job
+	timings = []
+	reports = []
+	try:
+		lazy = len(steps) > 0 and not (False in [OPERATIONS[name][2] for (name, args) in steps])
+		tic = time.time()
+		mesh = PolyMesh()
+		mesh.loadFile(filename, lazyTopology = lazy)
+		timings.append(('load', time.time() - tic))
+		for (name, args) in steps:
+			tic = time.time()
+			report = OPERATIONS[name][0](mesh, *args)
+			timings.append((name, time.time() - tic))
+			if report:
+				reports.append((name, report))
+		if outFilename:
+			tic = time.time()
+			mesh.saveFile(outFilename)
+			timings.append(('save', time.time() - tic))
+	except Exception:
+		return (filename, outFilename, timings, reports, traceback.format_exc())
+	return (filename, outFilename, timings, reports, None)
+
+def printResult(result, index, total, verbose):
+	(filename, outFilename, timings, reports, error) = result
+	totalTime = sum([t for (stage, t) in timings])
+	status = "FAILED" if error else "done"
+	sys.stdout.write("[%i/%i] %s %s in %.3fs\n"%(index, total, filename, status, totalTime))
+	if verbose or error:
+		sys.stdout.write("\t%s\n"%", ".join(["%s %.3fs"%(stage, t) for (stage, t) in timings]))
+	for (stage, report) in reports:
+		sys.stdout.write("\t%s: %s\n"%(stage, report))
+	if outFilename and not error:
+		sys.stdout.write("\t=> %s\n"%outFilename)
+	if error:
+		sys.stdout.write("\t" + error.replace("\n", "\n\t").rstrip() + "\n")
+	sys.stdout.flush()
+
+#Print the total time spent in each stage over all of the files
+def printSummary(results, wallTime):
+	stages = []
+	totals = {}
+	for (filename, outFilename, timings, reports, error) in results:
+		for (stage, t) in timings:
+			if not stage in totals:
+				stages.append(stage)
+				totals[stage] = 0.0
+			totals[stage] += t
+	nFailed = len([r for r in results if r[4]])
+	print "\n%i files processed (%i failed) in %.3fs"%(len(results), nFailed, wallTime)
+	for stage in stages:
+		print "\t%-12s %.3fs"%(stage, totals[stage])
+
+def main(argv):
+	parser = argparse.ArgumentParser(description = "Apply a pipeline of operations to a batch of meshes")
+	parser.add_argument('inputs', nargs = '*', help = "Mesh files, directories or glob patterns (.off, .toff, .obj)")
+	parser.add_argument('-p', '--pipeline', nargs = '+', default = [], metavar = 'OP', help = "Operations to apply in order (see --list)")
+	parser.add_argument('-o', '--outdir', default = None, help = "Directory to save the results in (results aren't saved if omitted)")
+	parser.add_argument('-f', '--format', default = None, choices = OUTPUT_SUFFIXES, help = "Output format (default: same as the input)")
+	parser.add_argument('-j', '--workers', type = int, default = multiprocessing.cpu_count(), help = "Number of worker processes (default: number of CPUs)")
+	parser.add_argument('-v', '--verbose', action = 'store_true', help = "Print the time of every stage of every file")
+	parser.add_argument('--list', action = 'store_true', help = "List the available operations and exit")
+	opts = parser.parse_args(argv)
+	if opts.list:
+		for name in sorted(OPERATIONS):
+			print OPERATIONS[name][3]
+		return 0
+	try:
+		steps = [parseStep(step) for step in opts.pipeline]
+	except ValueError as err:
+		parser.error(str(err))
+	files = getInputFiles(opts.inputs)
+	if len(files) == 0:
+		parser.error("No mesh files found")
+	if opts.outdir and not os.path.exists(opts.outdir):
+		os.makedirs(opts.outdir)
+	jobs = []
+	for f in files:
+		outFilename = None
+		if opts.outdir:
+			outFilename = getOutputFilename(f, opts.outdir, opts.format)
+		jobs.append((f, steps, outFilename))
+
+	tic = time.time()
+	results = []
+	nWorkers = max(1, min(opts.workers, len(jobs)))
+	if nWorkers == 1:
+		resultsIter = (processFile(job) for job in jobs)
+	else:
+		pool = multiprocessing.Pool(nWorkers)
+		resultsIter = pool.imap_unordered(processFile, jobs)
+	for result in resultsIter:
+		results.append(result)
+		printResult(result, len(results), len(jobs), opts.verbose)
+	if nWorkers > 1:
+		pool.close()
+		pool.join()
+	printSummary(results, time.time() - tic)
+	if len([r for r in results if r[4]]) > 0:
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,7 @@
 #Based off of http://wiki.wxpython.org/GLCanvas
 #Lots of help from http://wiki.wxpython.org/Getting%20Started
 from OpenGL.GL import *
+from OpenGL.GLU import *
 import wx
 from wx import glcanvas
 
@@ -27,6 +28,7 @@ import matplotlib.pyplot as plt
 DEFAULT_SIZE = wx.Size(1200, 800)
 DEFAULT_POS = wx.Point(10, 10)
 PRINCIPAL_AXES_SCALEFACTOR = 1
+MAX_UNDO_STEPS = 20
 
 
 #GUI States
@@ -34,7 +36,7 @@ PRINCIPAL_AXES_SCALEFACTOR = 1
 SUBSTATE_NONE = -1
 
 #Laplacian substates
-(CHOOSELAPLACE_WAITING, CHOOSELAPLACE_PICKVERTEX) = (0, 1)
+CHOOSELAPLACE_WAITING = 0
 
 def saveImageGL(mvcanvas, filename):
 	view = glGetIntegerv(GL_VIEWPORT)
@@ -186,6 +188,9 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 		self.cutPlane = None
 		self.displayCutPlane = False
 		
+		#Stack of mesh snapshots taken before destructive operations
+		self.undoStack = []
+		
 		self.GLinitialized = False
 		#GL-related events
 		wx.EVT_ERASE_BACKGROUND(self, self.processEraseBackgroundEvent)
@@ -205,7 +210,26 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 		self.eigvalues = np.zeros(0)
 		self.eigvectors = np.zeros(0)
 		self.needsDisplayUpdate = True
-		self.needsIndexDisplayUpdate = True
+	
+	#Save the state of the mesh so that the next operation can be undone
+	def pushUndo(self):
+		if not self.mesh:
+			return
+		prev = None
+		if len(self.undoStack) > 0:
+			prev = self.undoStack[-1]
+		self.undoStack.append(self.mesh.getSnapshot(prev))
+		if len(self.undoStack) > MAX_UNDO_STEPS:
+			self.undoStack.pop(0)
+	
+	def Undo(self, evt):
+		if not self.mesh or len(self.undoStack) == 0:
+			print "Nothing to undo"
+			return
+		self.mesh.restoreSnapshot(self.undoStack.pop())
+		self.invalidateMesh()
+		self.bbox = self.mesh.getBBox()
+		self.Refresh()
 	
 	def initPointCloud(self, pointCloud):
 		self.pointCloud = pointCloud
@@ -254,6 +278,7 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 	
 	def CutWithPlane(self, evt):
 		if self.cutPlane:
+			self.pushUndo()
 			self.mesh.sliceBelowPlane(self.cutPlane, False)
 			self.mesh.starTriangulate() #TODO: This is a patch to deal with "non-planar faces" added
 			self.Refresh()
@@ -277,6 +302,7 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 
 	def FlipAcrossPlane(self, evt):
 		if self.cutPlane:
+			self.pushUndo()
 			self.mesh.flipAcrossPlane(self.cutPlane)
 			self.Refresh()
 
@@ -307,6 +333,7 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 
 	def deleteConnectedComponents(self, evt):
 		if self.mesh:
+			self.pushUndo()
 			self.mesh.deleteAllButLargestConnectedComponent()
 		#Update mesh bbox now that the geometry has changed
 		self.bbox = self.mesh.getBBox()
@@ -314,18 +341,21 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 
 	def splitFaces(self, evt):
 		if self.mesh:
+			self.pushUndo()
 			self.mesh.splitFaces()
 			self.invalidateMesh()
 		self.Refresh()
 
 	def FillHoles(self, evt):
 		if self.mesh:
+			self.pushUndo()
 			self.mesh.fillHoles()
 			self.invalidateMesh()
 		self.Refresh()
 	
 	def Truncate(self, evt):
 		if self.mesh:
+			self.pushUndo()
 			self.mesh.truncate(0.5)
 			self.invalidateMesh()
 		self.Refresh()
@@ -358,10 +388,10 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 		#Make the first vertex blue and the last vertex red
 		g = np.array([ [1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0] ])
 		colors = self.mesh.solveFunctionWithConstraints(constraints, deltaCoords, g)
+		self.pushUndo()
 		for i in range(0, N):
 			self.mesh.vertices[i].color = [a for a in colors[i]]
-		self.mesh.needsDisplayUpdate = True
-		self.mesh.needsIndexDisplayUpdate = True
+		self.mesh.invalidateAttributes()
 		self.Refresh()
 	
 	def doLaplacianMeshSelectVertices(self, evt):
@@ -376,12 +406,14 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 	
 	def doLaplacianSolveWithConstraints(self, evt):
 		if self.mesh:
+			self.pushUndo()
 			self.mesh.solveVertexPositionsWithConstraints(self.laplacianConstraints)
 		self.invalidateMesh()
 		self.Refresh()
 
 	def doLaplacianMembraneWithConstraints(self, evt):
 		if self.mesh:
+			self.pushUndo()
 			self.mesh.createMembraneSurface(self.laplacianConstraints)
 		self.invalidateMesh()
 		self.Refresh()
@@ -401,9 +433,10 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 			plt.title('Exponential Factors')
 			plt.show()
 			#x = x/np.max(x) #Should already be in the range [0, 1]
+			self.pushUndo()
 			for i in range(len(self.mesh.vertices)):
 				self.mesh.vertices[i].color = cmConvert(x[i])
-			self.mesh.needsDisplayUpdate = True
+			self.mesh.invalidateAttributes()
 			self.Refresh()
 		dlg.Destroy()
 
@@ -416,9 +449,10 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 			cmConvert = cm.get_cmap("jet")
 			(x, self.eigvalues, self.eigvectors) = self.mesh.getHeatFlowFromPoints(indices, k, t, self.eigvalues, self.eigvectors)
 			#x = x/np.max(x) #Should already be in the range [0, 1]
+			self.pushUndo()
 			for i in range(len(self.mesh.vertices)):
 				self.mesh.vertices[i].color = cmConvert(x[i])
-			self.mesh.needsDisplayUpdate = True
+			self.mesh.invalidateAttributes()
 			self.Refresh()
 		dlg.Destroy()
 	
@@ -600,23 +634,6 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 					glVertex3f(P2.x, P2.y, P2.z)
 				glEnd()
 				
-			elif self.GUISubstate == CHOOSELAPLACE_PICKVERTEX:
-				glClearColor(0.0, 0.0, 0.0, 0.0)
-				glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-				self.mesh.renderGLIndices()
-				pixel = glReadPixels(self.MousePos[0], self.MousePos[1], 1, 1, GL_RGBA, GL_UNSIGNED_BYTE)
-				[R, G, B, A] = [int(pixel.encode("hex")[i*2:(i+1)*2], 16) for i in range(4)]
-				idx = extractFromRGBA(R, G, B, 0) - 1
-				if idx >= 0 and idx < len(self.mesh.vertices):
-					if idx in self.laplacianConstraints:
-						#De-select if it's already selected
-						self.laplaceCurrentIdx = -1
-						self.laplacianConstraints.pop(idx, None)
-					else:
-						self.laplacianConstraints[idx] = self.mesh.vertices[idx].pos.Copy()
-						self.laplaceCurrentIdx = idx
-				self.GUISubstate = CHOOSELAPLACE_WAITING
-				self.Refresh()
 	
 		self.SwapBuffers()
 	
@@ -638,15 +655,29 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 
 	def MouseDown(self, evt):
 		state = wx.GetMouseState()
-		if self.GUIState == STATE_CHOOSELAPLACEVERTICES:
-			if state.ShiftDown():
-				#Pick vertex for laplacian mesh constraints
-				self.GUISubstate = CHOOSELAPLACE_PICKVERTEX
 		x, y = evt.GetPosition()
 		self.CaptureMouse()
 		self.handleMouseStuff(x, y)
+		if self.GUIState == STATE_CHOOSELAPLACEVERTICES:
+			if state.ShiftDown():
+				#Pick vertex for laplacian mesh constraints
+				self.pickLaplaceVertex()
 		self.Refresh()
 	
+	#Select (or de-select) the vertex under the mouse as a laplacian mesh
+	#constraint.  The mouse ray is cast against the mesh on the CPU, so this
+	#doesn't need to render anything
+	def pickLaplaceVertex(self):
+		idx = self.mesh.pickVertex(self.camera, self.MousePos[0], self.MousePos[1], self.size.x, self.size.y)
+		if idx >= 0:
+			if idx in self.laplacianConstraints:
+				#De-select if it's already selected
+				self.laplaceCurrentIdx = -1
+				self.laplacianConstraints.pop(idx, None)
+			else:
+				self.laplacianConstraints[idx] = self.mesh.vertices[idx].pos.Copy()
+				self.laplaceCurrentIdx = idx
+	
 	def MouseUp(self, evt):
 		x, y = evt.GetPosition()
 		self.handleMouseStuff(x, y)
@@ -665,19 +696,12 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 			if self.GUIState == STATE_CHOOSELAPLACEVERTICES and state.ControlDown() and self.laplaceCurrentIdx in self.laplacianConstraints:
 				#Move up laplacian mesh constraint based on where the user drags
 				#the mouse
-				t = self.camera.towards
-				u = self.camera.up
-				r = t % u
 				P0 = self.laplacianConstraints[idx]
 				#Construct a plane going through the point which is parallel to the
 				#viewing plane
-				plane = Plane3D(P0, t)
+				plane = Plane3D(P0, self.camera.towards)
 				#Construct a ray through the pixel where the user is clicking
-				tanFOV = math.tan(self.camera.yfov/2)
-				scaleX = tanFOV*(self.MousePos[0] - self.size.x/2)/(self.size.x/2)
-				scaleY = tanFOV*(self.MousePos[1] - self.size.y/2)/(self.size.y/2)
-				V = t + scaleX*r + scaleY*u
-				ray = Ray3D(self.camera.eye, V)
+				ray = getRayThroughPixel(self.camera, self.MousePos[0], self.MousePos[1], self.size.x, self.size.y)
 				self.laplacianConstraints[idx] = ray.intersectPlane(plane)[1]
 			else:
 				#Translate/rotate shape
@@ -691,7 +715,7 @@ class MeshViewerCanvas(glcanvas.GLCanvas):
 		self.Refresh()
 
 class MeshViewerFrame(wx.Frame):
-	(ID_LOADDATASET, ID_SAVEDATASET, ID_SAVEDATASETMETERS, ID_SAVESCREENSHOT, ID_CONNECTEDCOMPONENTS, ID_SPLITFACES, ID_TRUNCATE, ID_FILLHOLES, ID_GEODESICDISTANCES, ID_PRST, ID_INTERPOLATECOLORS, ID_SAVEROTATINGSCREENSOTS, ID_SAVELIGHTINGSCREENSHOTS, ID_SELECTLAPLACEVERTICES, ID_CLEARLAPLACEVERTICES, ID_SOLVEWITHCONSTRAINTS, ID_MEMBRANEWITHCONSTRAINTS, ID_GETHKS, ID_GETHEATFLOW) = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19)
+	(ID_LOADDATASET, ID_SAVEDATASET, ID_SAVEDATASETMETERS, ID_SAVESCREENSHOT, ID_CONNECTEDCOMPONENTS, ID_SPLITFACES, ID_TRUNCATE, ID_FILLHOLES, ID_GEODESICDISTANCES, ID_PRST, ID_INTERPOLATECOLORS, ID_SAVEROTATINGSCREENSOTS, ID_SAVELIGHTINGSCREENSHOTS, ID_SELECTLAPLACEVERTICES, ID_CLEARLAPLACEVERTICES, ID_SOLVEWITHCONSTRAINTS, ID_MEMBRANEWITHCONSTRAINTS, ID_GETHKS, ID_GETHEATFLOW, ID_UNDO) = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20)
 	
 	def __init__(self, parent, id, title, pos=DEFAULT_POS, size=DEFAULT_SIZE, style=wx.DEFAULT_FRAME_STYLE, name = 'GLWindow'):
 		style = style | wx.NO_FULL_REPAINT_ON_RESIZE
@@ -723,6 +747,11 @@ class MeshViewerFrame(wx.Frame):
 		menuExit = filemenu.Append(wx.ID_EXIT,"E&xit"," Terminate the program")
 		self.Bind(wx.EVT_MENU, self.OnExit, menuExit)
 		
+		#####Edit menu
+		editMenu = wx.Menu()
+		menuUndo = editMenu.Append(MeshViewerFrame.ID_UNDO, "&Undo\tCtrl+Z", "Undo the last mesh operation")
+		self.Bind(wx.EVT_MENU, self.glcanvas.Undo, menuUndo)
+		
 		#####Operations menu
 		operationsMenu = wx.Menu()
 		#Menu option for deleting all but largest connected component
@@ -778,6 +807,7 @@ class MeshViewerFrame(wx.Frame):
 		# Creating the menubar.
 		menuBar = wx.MenuBar()
 		menuBar.Append(filemenu,"&File") # Adding the "filemenu" to the MenuBar
+		menuBar.Append(editMenu,"&Edit")
 		menuBar.Append(operationsMenu,"&Operations")
 		menuBar.Append(laplacianMenu, "&MeshLaplacian")
 		self.SetMenuBar(menuBar)  # Adding the MenuBar to the Frame content.
@@ -858,6 +888,7 @@ class MeshViewerFrame(wx.Frame):
 			filepath = os.path.join(dirname, filename)
 			print dirname
 			self.glcanvas.mesh = LaplacianMesh()
+			self.glcanvas.undoStack = []
 			print "Loading mesh %s..."%filename
 			self.glcanvas.mesh.loadFile(filepath)
 			self.glcanvas.meshCentroid = self.glcanvas.mesh.getCentroid()
@@ -885,6 +916,7 @@ class MeshViewerFrame(wx.Frame):
 	def OnSaveMeshMeters(self, evt):
 		for V in self.glcanvas.mesh.vertices:
 			V.pos = 0.001*V.pos
+		self.glcanvas.mesh.needsGeometryUpdate = True
 		dlg = wx.FileDialog(self, "Choose a file", ".", "", "*", wx.SAVE)
 		if dlg.ShowModal() == wx.ID_OK:
 			filename = dlg.GetFilename()
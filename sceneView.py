@@ -153,10 +153,9 @@ class Viewer(object):
 					glColor3f(0, 1, 0)
 					glBegin(GL_LINES)
 					P0 = self.scene.Source
-					for source in self.scene.vSources:
-						P1 = source.pos
+					for [x, y, z] in self.scene.vSourcePos.tolist():
 						glVertex3f(P0.x, P0.y, P0.z)
-						glVertex3f(P1.x, P1.y, P1.z)				
+						glVertex3f(x, y, z)				
 					glEnd()
 		
 				if self.scene.Receiver:
@@ -164,19 +163,17 @@ class Viewer(object):
 					glColor3f(0, 1, 1)
 					glBegin(GL_LINES)
 					P0 = self.scene.Receiver
-					for source in self.scene.vSources:
-						P1 = source.pos
+					for [x, y, z] in self.scene.vSourcePos.tolist():
 						glVertex3f(P0.x, P0.y, P0.z)
-						glVertex3f(P1.x, P1.y, P1.z)				
+						glVertex3f(x, y, z)				
 					glEnd()			
 		
 			glDisable(GL_LIGHTING)
 			glColor3f(1, 0, 1)
 			quadric = gluNewQuadric()
-			for source in self.scene.vSources:
-				P = source.pos
+			for [x, y, z] in self.scene.vSourcePos.tolist():
 				glPushMatrix()
-				glTranslatef(P.x, P.y, P.z)
+				glTranslatef(x, y, z)
 				gluSphere(quadric, 0.1, 32, 32)
 				glPopMatrix()		
 		
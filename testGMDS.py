@@ -1,6 +1,7 @@
 #Based off of http://wiki.wxpython.org/GLCanvas
 #Lots of help from http://wiki.wxpython.org/Getting%20Started
 from OpenGL.GL import *
+from OpenGL.GLU import *
 import wx
 from wx import glcanvas
 